@@ -0,0 +1,70 @@
+# benchmark.py
+# 本地性能基准，不访问真实后端。用法：
+#   python benchmark.py            运行全部基准
+#   python benchmark.py external   只运行指定基准
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from parser import DSLParser
+from interpreter import Interpreter
+from external import ExternalFunction
+
+CALL_DSL = (
+    "intent: refund\n"
+    "wait user_order_id\n"
+    "call check(user_order_id) as eligibility\n"
+    "say \"${user_order_id}: ${eligibility}\"\n"
+)
+
+
+def bench_external(scripts=40, latency=0.05, slow=1.0, timeout=0.2, max_concurrency=8):
+    """call 外部函数：同步 feed 逐个执行 vs feed_async 并发执行，其中一个脚本的后端很慢"""
+    inputs = ["slow"] + [f"{i}" for i in range(scripts - 1)]
+    script = DSLParser(CALL_DSL).parse()
+
+    def check(order_id):
+        time.sleep(slow if order_id == "slow" else latency)
+        return "eligible"
+
+    async def check_async(order_id):
+        await asyncio.sleep(slow if order_id == "slow" else latency)
+        return "eligible"
+
+    interpreter = Interpreter(script, {"check": check})
+    suspended = interpreter.run().continuation
+    start = time.perf_counter()
+    for x in inputs:
+        interpreter.feed(suspended, x)
+    serial = time.perf_counter() - start
+
+    check_fn = ExternalFunction(check_async, timeout=timeout, max_concurrency=max_concurrency)
+    interpreter = Interpreter(script, {"check": check_fn})
+    suspended = interpreter.run().continuation
+
+    async def main():
+        return await asyncio.gather(*(interpreter.feed_async(suspended, x) for x in inputs))
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    concurrent = time.perf_counter() - start
+    print(f"[external] {scripts} 个脚本（后端 {latency * 1000:.0f} ms，其中一个 {slow:.1f} s）: "
+          f"同步逐个 {serial:.2f} s, 异步并发 {concurrent:.2f} s "
+          f"（并发上限 {max_concurrency}，超时 {timeout:.1f} s，慢脚本结果 {results[0].messages[0]!r}）")
+
+
+BENCHMARKS = {
+    'external': bench_external,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
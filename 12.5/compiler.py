@@ -0,0 +1,136 @@
+# compiler.py
+from typing import Callable, Dict, List, Tuple, Any
+from script_ast import (
+    Script,
+    ASTNode,
+    LabelNode,
+    SayNode,
+    WaitNode,
+    GotoNode,
+    CallNode,
+    IfNode
+)
+
+# 操作码。每条指令是 (op, a, b, c) 四元组：
+#   SAY           a=消息（不含变量）
+#   SAY_TEMPLATE  a=预先切分的模板片段 ((是否变量, 文本或变量名), ...)
+#   WAIT          a=变量名
+#   CALL          a=函数名（解释器加载时替换为函数对象）  b=参数变量  c=结果变量（可为 None）
+#   JUMP          a=目标地址
+#   JUMP_IF_FALSE a=编译好的条件函数 ctx -> bool  b=条件不成立时的目标地址  c=原始条件（调试用）
+SAY, SAY_TEMPLATE, WAIT, CALL, JUMP, JUMP_IF_FALSE = range(6)
+
+OP_NAMES = ("SAY", "SAY_TEMPLATE", "WAIT", "CALL", "JUMP", "JUMP_IF_FALSE")
+
+Instruction = Tuple[int, Any, Any, Any]
+
+
+def compile_condition(condition: Tuple[str, str, str]) -> Callable[[Dict[str, Any]], bool]:
+    """把 (var, op, val) 编译成闭包，执行时只剩一次字典查找和一次比较"""
+    var, op, val = condition
+    if op == "==":
+        return lambda context: context.get(var, "") == val
+    return lambda context: context.get(var, "") != val
+
+
+def render_segments(segments, context: Dict[str, Any]) -> str:
+    """按预先切分的片段拼出消息，未赋值的变量原样保留为 ${var}"""
+    return "".join(
+        (str(context[text]) if text in context else "${" + text + "}") if is_var else text
+        for is_var, text in segments
+    )
+
+
+class CompiledScript:
+    def __init__(self, intent: str, code: List[Instruction], labels: Dict[str, int]):
+        self.intent = intent
+        self.code = code
+        self.labels = labels
+
+    def dump(self) -> str:
+        """反汇编，便于调试"""
+        lines = []
+        for addr, (op, a, b, c) in enumerate(self.code):
+            if op == JUMP_IF_FALSE:
+                a, c = c, None  # 显示原始条件而不是闭包
+            args = ", ".join(repr(x) for x in (a, b, c) if x is not None)
+            lines.append(f"{addr:4d}  {OP_NAMES[op]:<14}{args}")
+        return "\n".join(lines)
+
+
+class Compiler:
+    """
+    把嵌套的 AST 展平成线性指令序列：
+    if/elif/else 编译成条件跳转，标签和 goto 编译成绝对地址，
+    解释器只需要一个 pc 循环，不再有嵌套语句块。
+    """
+    def __init__(self):
+        self.code: List[list] = []
+        self.labels: Dict[str, int] = {}
+        self.gotos: List[Tuple[int, str]] = []  # 待回填的 (指令地址, 标签名)
+
+    def compile(self, script: Script) -> CompiledScript:
+        self.compile_block(script.statements)
+        for addr, target in self.gotos:
+            if target not in self.labels:
+                raise RuntimeError(f"Label '{target}' not found")
+            self.code[addr][1] = self.labels[target]
+        code = [tuple(ins) for ins in self.code]
+        return CompiledScript(script.intent, code, dict(self.labels))
+
+    def emit(self, op: int, a=None, b=None, c=None) -> int:
+        self.code.append([op, a, b, c])
+        return len(self.code) - 1
+
+    def compile_block(self, block: List[ASTNode]):
+        for stmt in block:
+            self.compile_statement(stmt)
+
+    def compile_statement(self, stmt: ASTNode):
+        if isinstance(stmt, LabelNode):
+            if stmt.name in self.labels:
+                raise SyntaxError(f"Duplicate label '{stmt.name}'")
+            self.labels[stmt.name] = len(self.code)
+
+        elif isinstance(stmt, SayNode):
+            if any(is_var for is_var, _ in stmt.segments):
+                self.emit(SAY_TEMPLATE, tuple(stmt.segments))
+            else:
+                self.emit(SAY, stmt.message)
+
+        elif isinstance(stmt, WaitNode):
+            self.emit(WAIT, stmt.var_name)
+
+        elif isinstance(stmt, GotoNode):
+            self.gotos.append((self.emit(JUMP), stmt.target))
+
+        elif isinstance(stmt, CallNode):
+            self.emit(CALL, stmt.func_name, stmt.arg, stmt.result_var)
+
+        elif isinstance(stmt, IfNode):
+            self.compile_if(stmt)
+
+        else:
+            raise RuntimeError(f"Unknown node type: {type(stmt)}")
+
+    def compile_if(self, stmt: IfNode):
+        end_jumps = []
+        branches = [(stmt.condition, stmt.then_body)] + list(stmt.elif_clauses)
+        for condition, body in branches:
+            skip = self.emit(JUMP_IF_FALSE, compile_condition(condition), None, condition)
+            self.compile_block(body)
+            end_jumps.append(self.emit(JUMP))
+            self.code[skip][2] = len(self.code)
+        if stmt.else_body:
+            self.compile_block(stmt.else_body)
+        else:
+            # 没有 else 时最后一个分支末尾的 JUMP 可以省掉
+            self.code.pop()
+            end_jumps.pop()
+            self.code[skip][2] = len(self.code)
+        for addr in end_jumps:
+            self.code[addr][1] = len(self.code)
+
+
+def compile_script(script: Script) -> CompiledScript:
+    return Compiler().compile(script)
@@ -0,0 +1,93 @@
+# external.py
+import time
+import asyncio
+from typing import Any, Callable, Dict, Optional
+
+
+class ExternalFunction:
+    """
+    脚本 call 语句调用的外部函数及其调用策略：
+    - timeout:         异步模式下单次调用的超时秒数，超时后结果为 on_timeout
+    - cacheable:       幂等函数（如资格检查）按参数缓存结果，cache_ttl 秒后过期（None 表示不过期）
+    - max_concurrency: 异步模式下该函数同时进行中的调用数上限，避免压垮单个后端
+    普通函数和协程函数都可以包装；普通函数在异步模式下放到线程里执行，不阻塞事件循环。
+    """
+    def __init__(self, func: Callable, timeout: Optional[float] = None, cacheable: bool = False,
+                 cache_ttl: Optional[float] = None, cache_size: int = 10_000,
+                 max_concurrency: Optional[int] = None, on_timeout: Any = "timeout"):
+        self.func = func
+        self.timeout = timeout
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_concurrency = max_concurrency
+        self.on_timeout = on_timeout
+        self.is_async = asyncio.iscoroutinefunction(func)
+        self.cache: Dict[str, tuple] = {}  # 参数 -> (结果, 写入时间)
+        self.stats = {"calls": 0, "cache_hits": 0, "timeouts": 0}
+        self._semaphore = None
+        self._loop = None
+
+    def _cached(self, arg: str):
+        entry = self.cache.get(arg)
+        if entry is None:
+            return False, None
+        result, stored_at = entry
+        if self.cache_ttl is not None and time.monotonic() - stored_at > self.cache_ttl:
+            del self.cache[arg]
+            return False, None
+        self.stats["cache_hits"] += 1
+        return True, result
+
+    def _store(self, arg: str, result: Any):
+        if len(self.cache) >= self.cache_size:
+            del self.cache[next(iter(self.cache))]  # 淘汰最早写入的一项
+        self.cache[arg] = (result, time.monotonic())
+
+    def call(self, arg: str) -> Any:
+        """同步模式调用（不支持超时和并发限制）"""
+        if self.is_async:
+            raise RuntimeError(f"Function '{self.func.__name__}' is a coroutine, use run_async()")
+        if self.cacheable:
+            hit, result = self._cached(arg)
+            if hit:
+                return result
+        self.stats["calls"] += 1
+        result = self.func(arg)
+        if self.cacheable:
+            self._store(arg, result)
+        return result
+
+    def _get_semaphore(self):
+        # asyncio.Semaphore 绑定在首次使用它的事件循环上，换了循环就重新创建
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def call_async(self, arg: str) -> Any:
+        if self.cacheable:
+            hit, result = self._cached(arg)
+            if hit:
+                return result
+        try:
+            if self.max_concurrency:
+                async with self._get_semaphore():
+                    result = await self._invoke(arg)
+            else:
+                result = await self._invoke(arg)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            return self.on_timeout  # 超时结果不缓存
+        if self.cacheable:
+            self._store(arg, result)
+        return result
+
+    async def _invoke(self, arg: str) -> Any:
+        self.stats["calls"] += 1
+        if self.is_async:
+            call = self.func(arg)
+        else:
+            call = asyncio.to_thread(self.func, arg)
+        return await asyncio.wait_for(call, self.timeout)
@@ -1,96 +1,154 @@
 # interpreter.py
-from typing import Dict, List, Any, Callable, Optional
-from ast import (
-    Script,
-    ASTNode,
-    LabelNode,
-    SayNode,
-    WaitNode,
-    GotoNode,
-    CallNode,
-    IfNode
+from typing import Dict, List, Any, Callable, Optional, Union
+from script_ast import Script
+from external import ExternalFunction
+from compiler import (
+    compile_script,
+    render_segments,
+    SAY,
+    SAY_TEMPLATE,
+    WAIT,
+    CALL,
+    JUMP,
+    JUMP_IF_FALSE
 )
 
+
+class ExecutionResult:
+    """
+    一次执行的结果：
+    - messages: 本次执行中 say 输出的消息
+    - continuation: 停在 wait 时的续体（可 JSON 序列化），脚本结束时为 None
+    """
+    def __init__(self, messages: List[str], continuation: Optional[Dict[str, Any]]):
+        self.messages = messages
+        self.continuation = continuation
+
+    @property
+    def done(self) -> bool:
+        return self.continuation is None
+
+
 class Interpreter:
-    def __init__(self, script: Script, functions: Dict[str, Callable] = None):
+    """
+    可恢复的脚本解释器。脚本先由 compiler 展平成线性指令，执行到 wait 时返回续体：
+        {"pc": 下一条指令地址, "context": {...}, "waiting": "变量名"}
+    续体只包含整数、字符串和字典，可以直接存库或序列化，之后用 feed() 继续执行。
+    这样一个进程可以同时挂起成千上万个等待用户输入的脚本。
+
+    functions 的值可以是普通函数、协程函数或 ExternalFunction（带超时 / 缓存 / 并发限制）。
+    含协程函数或需要超时控制时使用 run_async() / feed_async()，
+    慢后端只会挂起调用它的那个脚本，其他脚本照常执行。
+    """
+    def __init__(self, script: Script, functions: Dict[str, Union[Callable, ExternalFunction]] = None):
         self.script = script
-        self.context: Dict[str, Any] = {}
-        self.functions = functions or {}
-        self.label_map: Dict[str, int] = {}
-        for i, stmt in enumerate(script.statements):
-            if isinstance(stmt, LabelNode):
-                self.label_map[stmt.name] = i
-
-    def run(self):
-        pc = 0
-        statements = self.script.statements
-
-        while pc < len(statements):
-            stmt = statements[pc]
-
-            if isinstance(stmt, SayNode):
-                print(f"[Bot] {stmt.message}")
-
-            elif isinstance(stmt, WaitNode):
-                user_input = input(f"[User] Enter {stmt.var_name}: ").strip()
-                self.context[stmt.var_name] = user_input
-
-            elif isinstance(stmt, GotoNode):
-                if stmt.target not in self.label_map:
-                    raise RuntimeError(f"Label '{stmt.target}' not found")
-                pc = self.label_map[stmt.target]
-                continue
-
-            elif isinstance(stmt, CallNode):
-                if stmt.func_name not in self.functions:
-                    raise RuntimeError(f"Function '{stmt.func_name}' not defined")
-                func = self.functions[stmt.func_name]
-                arg_value = self.context.get(stmt.arg, "")
-                result = func(arg_value)
-                if stmt.result_var:
-                    self.context[stmt.result_var] = result
-
-            elif isinstance(stmt, IfNode):
-                cond_var, op, cond_val = stmt.condition
-                actual_val = self.context.get(cond_var, "")
-                match = (actual_val == cond_val) if op == "==" else (actual_val != cond_val)
-
-                executed = False
-                if match:
-                    self._execute_block(stmt.then_body)
-                    executed = True
-                else:
-                    for elif_cond, elif_body in stmt.elif_clauses:
-                        var, op2, val2 = elif_cond
-                        v = self.context.get(var, "")
-                        ok = (v == val2) if op2 == "==" else (v != val2)
-                        if ok:
-                            self._execute_block(elif_body)
-                            executed = True
-                            break
-                    if not executed and stmt.else_body:
-                        self._execute_block(stmt.else_body)
-
-            elif isinstance(stmt, LabelNode):
-                pass  # 标签无操作
+        self.functions = {
+            name: f if isinstance(f, ExternalFunction) else ExternalFunction(f)
+            for name, f in (functions or {}).items()
+        }
+        self.program = compile_script(script)
+        self.code = self._link(self.program.code)
 
-            else:
-                raise RuntimeError(f"Unknown node type: {type(stmt)}")
+    def _link(self, code):
+        """加载时把 CALL 指令里的函数名解析为函数对象，执行时不再查表"""
+        linked = []
+        for op, a, b, c in code:
+            if op == CALL:
+                if a not in self.functions:
+                    raise RuntimeError(f"Function '{a}' not defined")
+                a = self.functions[a]
+            linked.append((op, a, b, c))
+        return linked
+
+    def run(self, context: Dict[str, Any] = None) -> ExecutionResult:
+        """从头开始执行，直到第一个 wait 或脚本结束"""
+        return self._drive(self._steps(0, dict(context or {})))
+
+    def feed(self, continuation: Dict[str, Any], user_input: str) -> ExecutionResult:
+        """把用户输入写入续体等待的变量，然后继续执行"""
+        return self._drive(self._resume(continuation, user_input))
+
+    async def run_async(self, context: Dict[str, Any] = None) -> ExecutionResult:
+        return await self._drive_async(self._steps(0, dict(context or {})))
+
+    async def feed_async(self, continuation: Dict[str, Any], user_input: str) -> ExecutionResult:
+        return await self._drive_async(self._resume(continuation, user_input))
+
+    def run_interactive(self):
+        """命令行交互模式：阻塞读取 input()，供 main.py 使用"""
+        result = self.run()
+        while True:
+            for message in result.messages:
+                print(f"[Bot] {message}")
+            if result.done:
+                break
+            var_name = result.continuation["waiting"]
+            user_input = input(f"[User] Enter {var_name}: ")
+            result = self.feed(result.continuation, user_input)
+
+    def _resume(self, continuation: Dict[str, Any], user_input: str):
+        context = dict(continuation["context"])
+        context[continuation["waiting"]] = user_input.strip()
+        return self._steps(continuation["pc"], context)
 
+    @staticmethod
+    def _drive(steps) -> ExecutionResult:
+        """同步驱动：遇到 call 时直接调用"""
+        try:
+            request = next(steps)
+            while True:
+                func, arg = request
+                request = steps.send(func.call(arg))
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    async def _drive_async(steps) -> ExecutionResult:
+        """异步驱动：遇到 call 时 await，期间事件循环可以执行其他脚本"""
+        try:
+            request = next(steps)
+            while True:
+                func, arg = request
+                request = steps.send(await func.call_async(arg))
+        except StopIteration as stop:
+            return stop.value
+
+    def _steps(self, pc: int, context: Dict[str, Any]):
+        """
+        执行循环本身，写成生成器：遇到 CALL 时 yield (函数, 参数)，由驱动方调用后把结果 send 回来。
+        同步和异步两种模式共用同一个循环。
+        """
+        code = self.code
+        end = len(code)
+        messages = []
+
+        while pc < end:
+            op, a, b, c = code[pc]
             pc += 1
 
-    def _execute_block(self, block: List[ASTNode]):
-        """执行 if/elif/else 中的单条语句（简化）"""
-        for stmt in block:
-            if isinstance(stmt, SayNode):
-                print(f"[Bot] {stmt.message}")
-            elif isinstance(stmt, WaitNode):
-                user_input = input(f"[User] Enter {stmt.var_name}: ").strip()
-                self.context[stmt.var_name] = user_input
-            elif isinstance(stmt, CallNode):
-                if stmt.func_name in self.functions:
-                    arg_val = self.context.get(stmt.arg, "")
-                    res = self.functions[stmt.func_name](arg_val)
-                    if stmt.result_var:
-                        self.context[stmt.result_var] = res
-            # 注意：不支持在 if 块中 goto（保持简单）
\ No newline at end of file
+            if op == SAY:
+                messages.append(a)
+
+            elif op == SAY_TEMPLATE:
+                messages.append(render_segments(a, context))
+
+            elif op == JUMP_IF_FALSE:
+                if not a(context):
+                    pc = b
+
+            elif op == JUMP:
+                pc = a
+
+            elif op == WAIT:
+                continuation = {"pc": pc, "context": context, "waiting": a}
+                return ExecutionResult(messages, continuation)
+
+            elif op == CALL:
+                result = yield a, context.get(b, "")
+                if c:
+                    context[c] = result
+
+            else:
+                raise RuntimeError(f"Unknown opcode: {op}")
+
+        return ExecutionResult(messages, None)
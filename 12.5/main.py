@@ -29,7 +29,7 @@ def main():
     functions = {"check_refund": check_refund}
 
     interpreter = Interpreter(script, functions)
-    interpreter.run()
+    interpreter.run_interactive()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,21 +1,55 @@
 # parser.py
 import re
 from typing import List, Tuple, Optional
-from ast import Script, LabelNode, SayNode, WaitNode, GotoNode, CallNode, IfNode, ASTNode
+from script_ast import Script, LabelNode, SayNode, WaitNode, GotoNode, CallNode, IfNode, ASTNode
+
+VAR_RE = re.compile(r'\$\{(\w+)\}')
+
+
+def split_template(message: str) -> List[Tuple[bool, str]]:
+    """把 "订单 ${order_id} 已提交" 切分为 [(False, "订单 "), (True, "order_id"), (False, " 已提交")]"""
+    segments = []
+    pos = 0
+    for m in VAR_RE.finditer(message):
+        if m.start() > pos:
+            segments.append((False, message[pos:m.start()]))
+        segments.append((True, m.group(1)))
+        pos = m.end()
+    if pos < len(message) or not segments:
+        segments.append((False, message[pos:]))
+    return segments
+
+
+def strip_comment(line: str) -> str:
+    """去掉行尾注释（引号内的 # 保留）"""
+    in_quote = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quote = not in_quote
+        elif ch == "#" and not in_quote:
+            return line[:i]
+    return line
+
 
 class DSLParser:
     def __init__(self, source: str):
+        # 每行保存 (缩进宽度, 去掉首尾空白后的内容)，缩进用于划分 if/elif/else 的语句块
         lines = []
+        self.indents = []
         for line in source.splitlines():
-            stripped = line.strip()
-            if stripped and not stripped.startswith("#"):
+            stripped = strip_comment(line).strip()
+            if stripped:
                 lines.append(stripped)
+                self.indents.append(len(line) - len(line.lstrip()))
         self.lines = lines
         self.pos = 0
 
     def peek(self) -> Optional[str]:
         return self.lines[self.pos] if self.pos < len(self.lines) else None
 
+    def peek_indent(self) -> int:
+        return self.indents[self.pos] if self.pos < len(self.lines) else -1
+
     def consume(self) -> str:
         if self.pos >= len(self.lines):
             raise SyntaxError("Unexpected end of script")
@@ -48,7 +82,8 @@ class DSLParser:
             match = re.match(r'say\s+"(.*)"$', line)
             if not match:
                 raise SyntaxError(f"Invalid say statement: {line}")
-            return SayNode(match.group(1))
+            message = match.group(1)
+            return SayNode(message, split_template(message))
 
         elif line.startswith("wait "):
             self.consume()
@@ -71,32 +106,37 @@ class DSLParser:
             func_name, arg, result_var = match.groups()
             return CallNode(func_name, arg, result_var)
 
-        elif line.startswith("if ") or line.startswith("elif ") or line == "else:":
+        elif line.startswith("if "):
             return self.parse_if()
 
+        elif line.startswith("elif ") or line == "else:":
+            raise SyntaxError(f"'{line}' without matching if")
+
         else:
             raise SyntaxError(f"Unknown statement: {line}")
 
     def parse_if(self) -> IfNode:
+        indent = self.peek_indent()
         if_line = self.consume()
         cond_str = if_line[3:].rstrip(":").strip()
         main_cond = self.parse_condition(cond_str)
-        then_body = self.parse_block()
+        then_body = self.parse_block(indent)
 
         elif_clauses = []
         else_body = None
 
-        while self.peek():
+        # elif / else 必须与 if 对齐
+        while self.peek() and self.peek_indent() == indent:
             next_line = self.peek()
             if next_line.startswith("elif "):
                 self.consume()
                 cond_str = next_line[5:].rstrip(":").strip()
                 cond = self.parse_condition(cond_str)
-                body = self.parse_block()
+                body = self.parse_block(indent)
                 elif_clauses.append((cond, body))
             elif next_line == "else:":
                 self.consume()
-                else_body = self.parse_block()
+                else_body = self.parse_block(indent)
                 break
             else:
                 break
@@ -119,9 +159,12 @@ class DSLParser:
             raise SyntaxError(f"Left side must be identifier: {left}")
         return (left, op, right)
 
-    def parse_block(self) -> List['ASTNode']:
-        """简化版：只读一条语句（避免吃掉后续语句）"""
-        if self.peek() is None:
-            return []
-        stmt = self.parse_statement()
-        return [stmt]
\ No newline at end of file
+    def parse_block(self, parent_indent: int) -> List['ASTNode']:
+        """读取缩进比 parent_indent 更深的连续语句，作为 if/elif/else 的语句块"""
+        if self.peek() is None or self.peek_indent() <= parent_indent:
+            line = self.lines[self.pos - 1]
+            raise SyntaxError(f"Expected an indented block after: {line}")
+        block = []
+        while self.peek() is not None and self.peek_indent() > parent_indent:
+            block.append(self.parse_statement())
+        return block
@@ -1,4 +1,4 @@
-# ast.py
+# script_ast.py
 from abc import ABC, abstractmethod
 from typing import List, Tuple, Optional
 
@@ -15,8 +15,10 @@ class LabelNode(ASTNode):
         self.name = name
 
 class SayNode(ASTNode):
-    def __init__(self, message: str):
+    def __init__(self, message: str, segments: List[Tuple[bool, str]] = None):
         self.message = message
+        # 解析时预先切分好的模板：[(是否变量, 文本或变量名), ...]
+        self.segments = segments if segments is not None else [(False, message)]
 
 class WaitNode(ASTNode):
     def __init__(self, var_name: str):
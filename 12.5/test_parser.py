@@ -1,6 +1,12 @@
 # test_parser.py
-from parser import DSLParser
-from ast import Script, LabelNode, SayNode, WaitNode, IfNode, CallNode
+import os
+import json
+import asyncio
+from parser import DSLParser, split_template
+from script_ast import Script, LabelNode, SayNode, WaitNode, IfNode, CallNode
+from interpreter import Interpreter
+from compiler import compile_script, JUMP, JUMP_IF_FALSE
+from external import ExternalFunction
 
 def test_refund_dsl():
     # 注意：if 块只包含一条语句！
@@ -32,5 +38,216 @@ def test_refund_dsl():
 
     print("✅ All tests passed!")
 
+def check_refund(order_id: str) -> str:
+    return "eligible" if order_id in ["1001", "1002"] else "ineligible"
+
+
+RESUMABLE_DSL = (
+    "intent: refund\n"
+    "start:\n"
+    "say \"请提供订单号\"\n"
+    "wait user_order_id\n"
+    "call check_refund(user_order_id) as eligibility\n"
+    "if eligibility == \"eligible\":\n"
+    "  say \"可以退款\"\n"
+    "else:\n"
+    "  goto start\n"
+)
+
+
+def test_run_suspends_at_wait():
+    interpreter = Interpreter(DSLParser(RESUMABLE_DSL).parse(), {"check_refund": check_refund})
+    result = interpreter.run()
+
+    assert result.messages == ["请提供订单号"]
+    assert not result.done
+    assert result.continuation["waiting"] == "user_order_id"
+    # 续体可以序列化后在别处恢复
+    continuation = json.loads(json.dumps(result.continuation))
+
+    result = interpreter.feed(continuation, "1001")
+    assert result.messages == ["可以退款"]
+    assert result.done
+    print("✅ run/feed passed!")
+
+
+def test_goto_inside_branch_suspends_again():
+    interpreter = Interpreter(DSLParser(RESUMABLE_DSL).parse(), {"check_refund": check_refund})
+    result = interpreter.feed(interpreter.run().continuation, "9999")
+
+    assert result.messages == ["请提供订单号"]
+    assert result.continuation["waiting"] == "user_order_id"
+    assert result.continuation["context"]["eligibility"] == "ineligible"
+    print("✅ goto in branch passed!")
+
+
+def test_multiplex_many_suspended_scripts():
+    interpreter = Interpreter(DSLParser(RESUMABLE_DSL).parse(), {"check_refund": check_refund})
+    # 一个解释器同时挂起 5000 个会话，每个会话只是一个小字典
+    suspended = [interpreter.run().continuation for _ in range(5000)]
+    results = [interpreter.feed(c, "1002" if i % 2 else "0") for i, c in enumerate(suspended)]
+
+    assert sum(r.done for r in results) == 2500
+    assert all(r.continuation["waiting"] == "user_order_id" for r in results if not r.done)
+    print("✅ multiplex passed!")
+
+
+def test_indented_blocks():
+    dsl_text = (
+        "intent: refund\n"
+        "start:\n"
+        "  wait user_order_id\n"
+        "  if user_order_id == \"\":  # 空输入\n"
+        "    say \"订单号不能为空！\"\n"
+        "    goto start\n"
+        "  elif user_order_id == \"0\":\n"
+        "    say \"无效订单\"\n"
+        "  else:\n"
+        "    say \"收到\"\n"
+        "    say \"# 不是注释\"\n"
+        "  say \"结束\"\n"
+    )
+    script = DSLParser(dsl_text).parse()
+    if_node = script.statements[2]
+    assert len(script.statements) == 4
+    assert len(if_node.then_body) == 2
+    assert len(if_node.elif_clauses) == 1
+    assert [s.message for s in if_node.else_body] == ["收到", "# 不是注释"]
+
+    # 展平后只剩线性指令，goto 和各分支都变成绝对地址跳转
+    program = compile_script(script)
+    assert program.labels == {"start": 0}
+    jumps = [ins for ins in program.code if ins[0] in (JUMP, JUMP_IF_FALSE)]
+    assert all(0 <= (ins[1] if ins[0] == JUMP else ins[2]) <= len(program.code) for ins in jumps)
+
+    interpreter = Interpreter(script)
+    result = interpreter.feed(interpreter.run().continuation, "")
+    assert result.messages == ["订单号不能为空！"]
+    assert interpreter.feed(result.continuation, "0").messages == ["无效订单", "结束"]
+    assert interpreter.feed(result.continuation, "1").messages == ["收到", "# 不是注释", "结束"]
+    print("✅ indented blocks passed!")
+
+
+def test_refund_script_file():
+    path = os.path.join(os.path.dirname(__file__), "scripts", "refund.dsl")
+    with open(path, encoding="utf-8") as f:
+        script = DSLParser(f.read()).parse()
+
+    refunded = []
+    functions = {
+        "check_refund_eligibility": lambda order_id: {"ORD1": "eligible", "ORD2": "ineligible"}.get(order_id, "not_found"),
+        "process_refund": refunded.append,
+    }
+    interpreter = Interpreter(script, functions)
+
+    result = interpreter.run()
+    assert len(result.messages) == 1
+    result = interpreter.feed(result.continuation, "")        # 空输入 → 提示后回到 start
+    assert result.messages[0] == "订单编号不能为空，请重新输入。"
+    result = interpreter.feed(result.continuation, "ORD9")    # 未找到 → 回到 start
+    assert result.messages[0] == "未找到订单 ORD9，请确认编号是否正确。"
+    result = interpreter.feed(result.continuation, "ORD1")
+    assert result.done and refunded == ["ORD1"]
+    assert result.messages[-1] == "退款已提交，预计3-5个工作日到账。感谢您的理解！"
+    print("✅ refund.dsl passed!")
+
+
+def test_say_template_and_linking():
+    assert split_template("订单 ${order_id} 已提交") == [(False, "订单 "), (True, "order_id"), (False, " 已提交")]
+    assert split_template("${a}${b}") == [(True, "a"), (True, "b")]
+    assert split_template("") == [(False, "")]
+
+    dsl_text = (
+        "intent: refund\n"
+        "say \"订单 ${order_id} / ${missing}\"\n"
+        "call lookup(order_id)\n"
+    )
+    script = DSLParser(dsl_text).parse()
+    result = Interpreter(script, {"lookup": len}).run({"order_id": "1001"})
+    assert result.messages == ["订单 1001 / ${missing}"]
+
+    # 函数在加载时解析，缺失时立即报错，而不是等到执行到 call
+    try:
+        Interpreter(script, {})
+        assert False, "expected RuntimeError"
+    except RuntimeError as e:
+        assert "lookup" in str(e)
+    print("✅ say template / linking passed!")
+
+
+ASYNC_DSL = (
+    "intent: refund\n"
+    "wait user_order_id\n"
+    "call check(user_order_id) as eligibility\n"
+    "say \"${user_order_id}: ${eligibility}\"\n"
+)
+
+
+def test_async_calls_run_concurrently():
+    active = {"now": 0, "max": 0}
+    finished = []
+    finished_when_slow_cancelled = []
+
+    async def check(order_id):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        try:
+            if order_id == "slow":
+                await asyncio.Event().wait()  # 永远不返回，只能等超时
+            await asyncio.sleep(0)
+            finished.append(order_id)
+            return "eligible"
+        except asyncio.CancelledError:
+            finished_when_slow_cancelled.append(len(finished))
+            raise
+        finally:
+            active["now"] -= 1
+
+    check_fn = ExternalFunction(check, timeout=0.2, cacheable=True, max_concurrency=4)
+    interpreter = Interpreter(DSLParser(ASYNC_DSL).parse(), {"check": check_fn})
+    suspended = interpreter.run().continuation
+
+    async def main():
+        inputs = ["slow"] + [f"{i}" for i in range(8)] + ["0"]
+        return await asyncio.gather(*(interpreter.feed_async(suspended, x) for x in inputs))
+
+    results = asyncio.run(main())
+
+    # 慢后端超时只影响自己那一个脚本：它被放弃时其余调用都已完成（耗时对比见 benchmark.py external）
+    assert results[0].messages == ["slow: timeout"]
+    assert results[1].messages == ["0: eligible"]
+    assert finished_when_slow_cancelled == [check_fn.stats["calls"] - 1]
+    assert active["max"] == 4
+    assert check_fn.stats["timeouts"] == 1
+
+    # 幂等检查按参数缓存，第二次不再调用后端
+    calls = check_fn.stats["calls"]
+    result = asyncio.run(interpreter.feed_async(suspended, "3"))
+    assert result.messages == ["3: eligible"]
+    assert check_fn.stats["calls"] == calls
+    print("✅ async calls passed!")
+
+
+def test_sync_run_rejects_coroutine():
+    async def check(order_id):
+        return "eligible"
+
+    interpreter = Interpreter(DSLParser(ASYNC_DSL).parse(), {"check": check})
+    try:
+        interpreter.feed(interpreter.run().continuation, "1")
+        assert False, "expected RuntimeError"
+    except RuntimeError as e:
+        assert "run_async" in str(e)
+    print("✅ sync run rejects coroutine passed!")
+
+
 if __name__ == "__main__":
-    test_refund_dsl()
\ No newline at end of file
+    test_refund_dsl()
+    test_run_suspends_at_wait()
+    test_goto_inside_branch_suspends_again()
+    test_multiplex_many_suspended_scripts()
+    test_indented_blocks()
+    test_refund_script_file()
+    test_say_template_and_linking()
+    test_async_calls_run_concurrently()
+    test_sync_run_rejects_coroutine()
@@ -0,0 +1,208 @@
+# benchmark.py
+# 本地性能基准，不调用真实 LLM。用法：
+#   python benchmark.py            运行全部基准
+#   python benchmark.py keywords   只运行指定基准
+import os
+import sys
+import time
+import re
+import random
+import string
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from keyword_matcher import KeywordIndex, naive_match
+from regex_matcher import RegexIndex, naive_search
+
+# 生成关键词和用户输入用的汉字（CJK 统一汉字区的前 3000 个字）
+CHARS = [chr(0x4e00 + i) for i in range(3000)]
+
+
+def _keyword_catalog(rng, intents, keywords):
+    return [([''.join(rng.choices(CHARS, k=rng.randint(2, 4))) for _ in range(keywords)],
+             f"intent_{i}") for i in range(intents)]
+
+
+def _utterance(rng, catalog):
+    """随机汉字中间夹一到两个目录里的关键词，模拟真实的用户输入"""
+    parts = [''.join(rng.choices(CHARS, k=rng.randint(4, 12)))]
+    for _ in range(rng.randint(1, 2)):
+        parts.append(rng.choice(rng.choice(catalog)[0]))
+        parts.append(''.join(rng.choices(CHARS, k=rng.randint(2, 8))))
+    return ''.join(parts)
+
+
+def _timed(fn, inputs):
+    start = time.perf_counter()
+    results = [fn(text) for text in inputs]
+    return time.perf_counter() - start, results
+
+
+def bench_keywords(intents=3_000, keywords=30, utterances=200):
+    """KeywordsMatch：逐个关键词 in 扫描 vs Aho-Corasick 一遍扫描"""
+    rng = random.Random(0)
+    catalog = _keyword_catalog(rng, intents, keywords)
+    inputs = [_utterance(rng, catalog) for _ in range(utterances)]
+
+    start = time.perf_counter()
+    index = KeywordIndex(catalog)
+    build = time.perf_counter() - start
+
+    naive, expected = _timed(lambda text: naive_match(catalog, text), inputs)
+    fast, results = _timed(index.match, inputs)
+    assert results == expected, "Aho-Corasick 与朴素匹配结果不一致"
+    print(f"[keywords] {intents} 个意图 x {keywords} 个关键词: 编译 {build:.2f} s ({len(index.automaton)} 个状态), "
+          f"朴素 {naive / utterances * 1e3:.2f} ms/句, Aho-Corasick {fast / utterances * 1e3:.3f} ms/句 "
+          f"(x{naive / fast:.0f})")
+
+
+def _regex_catalog(rng, intents):
+    """
+    每个意图一个“前缀词 + 可选的命名分组”正则，和真实脚本里的写法类似；
+    约 10% 是没有字面子串的通用正则（如单号格式，首字符都是 [A-Z]，彼此不同），只能走合并分片；
+    约 1% 带局部标志 (?i:...)，不能预过滤也不能合并，单独 search
+    返回 (目录, 能让对应正则命中的词)
+    """
+    shapes = [r"{w}(?P<order_id>\d{{6}})", r"{w}.{{0,4}}(?:吗|呢)", r"(?:{w}|{v})(?P<reason>\w{{2,8}})", r"^{w}"]
+    generic = r"(?P<code>[A-Z]{{{k}}}[{c}]\d{{4,{m}}})"
+    flagged = r"(?i:{a}){w}(?P<order_id>\d{{6}})"
+    catalog, words, seen = [], [], set()
+    for i in range(intents):
+        while True:
+            w, v = (''.join(rng.choices(CHARS, k=rng.randint(2, 3))) for _ in range(2))
+            roll = rng.random()
+            if roll < 0.10:
+                c = ''.join(rng.sample(CHARS, 2))
+                k = rng.randint(2, 4)
+                pattern = generic.format(k=k, c=c, m=rng.randint(5, 12))
+                word = ''.join(rng.choices(string.ascii_uppercase, k=k)) + c[0]
+            elif roll < 0.11:
+                a = ''.join(rng.choices(string.ascii_lowercase, k=2))
+                pattern, word = flagged.format(a=a, w=w), a.upper() + w
+            else:
+                pattern, word = rng.choice(shapes).format(w=w, v=v), w
+            if pattern not in seen:
+                break
+        seen.add(pattern)
+        catalog.append((pattern, f"intent_{i}"))
+        words.append(word)
+    return catalog, words
+
+
+def check_inline_flags():
+    """局部标志的正则与 re.search 逐个匹配的结果必须一致（预过滤和首字符前瞻都按大小写精确匹配）"""
+    catalog = [(r"(?i:abc)\d", "scoped"), (r"x(?i:Y)z", "middle"), (r"(?i:订单)(?P<order_id>\d{6})", "cjk"),
+               (r"(?i)hello", "global"), (r"(?-i:Q)\d", "unset"), (r"[A-Z]\d{3}", "plain")]
+    index = RegexIndex(catalog)
+    for text in ["ABC1", "abc1", "aBc9", "xYz", "xyz", "XYZ", "订单123456", "HELLO", "Q1", "q1", "B123", "--"]:
+        expected = naive_search(catalog, text)
+        hit = next(index.search(text), None)
+        assert (hit and (hit.target, hit.slots)) == (expected and (expected.target, expected.slots)), text
+
+
+def bench_regex(sizes=(100, 1_000, 5_000), utterances=200):
+    """RegexMatch：逐个意图 re.search（已预编译）vs RegexIndex 一次扫描"""
+    check_inline_flags()
+    for n in sizes:
+        rng = random.Random(n)
+        catalog, words = _regex_catalog(rng, n)
+        inputs = [''.join(rng.choices(CHARS, k=rng.randint(0, 10))) + rng.choice(words) + "123456吗"
+                  for _ in range(utterances)]
+
+        start = time.perf_counter()
+        index = RegexIndex(catalog)
+        build = time.perf_counter() - start
+        compiled = [(re.compile(pattern), target) for pattern, target in catalog]
+
+        naive, expected = _timed(lambda text: naive_search(compiled, text), inputs)
+        fast, results = _timed(lambda text: next(index.search(text), None), inputs)
+        summary = lambda hits: [hit and (hit.target, hit.slots) for hit in hits]
+        assert summary(results) == summary(expected), "合并正则与逐个匹配结果不一致"
+        print(f"[regex] {n} 个正则意图: 编译 {build:.2f} s ({len(index.shards)} 个分片), "
+              f"逐个 search {naive / utterances * 1e3:.2f} ms/句, RegexIndex {fast / utterances * 1e3:.3f} ms/句 "
+              f"(x{naive / fast:.1f})")
+
+
+LLM_REPLY_DSL = '''
+intent apologize {
+    match: keywords: ["投诉"]
+    context: has(complaint_detail)
+    actions: [
+        llm_reply("很抱歉给您带来不便。{{complaint_detail}} 我们已记录您的反馈，并会尽快处理。")
+    ]
+}
+'''
+
+
+def fake_stream(first_token, interval, chunks):
+    """本地假的流式 LLM：first_token 秒后产出第一段，之后每 interval 秒一段，每段 2 个字"""
+    def stream(prompt, max_tokens, session, deadline):
+        time.sleep(first_token)
+        for i in range(chunks):
+            if i:
+                time.sleep(interval)
+            yield "好的"
+    return stream
+
+
+def bench_llm_reply(first_token=0.3, interval=0.02, chunks=40, turns=5):
+    """llm_reply：流式输出的首个片段耗时（TTFT）vs 整段生成完的耗时，缓存命中，以及 token / 时间预算截断"""
+    import asyncio
+    import contextlib
+    import io
+    from lexer import Lexer
+    from parser import Parser
+    from interpreter import Interpreter, Context
+    from llm_reply import LlmReplier
+
+    interpreter = Interpreter(Parser(Lexer(LLM_REPLY_DSL).tokenize()).parse_program())
+
+    async def turn(detail):
+        context = Context()
+        context.set("complaint_detail", detail)
+        start = time.perf_counter()
+        first = []
+        reply = await interpreter.run("我要投诉", context,
+                                      lambda chunk: first or first.append(time.perf_counter() - start))
+        return first[0], time.perf_counter() - start, len(reply)
+
+    async def measure(replier, details):
+        interpreter.replier = replier
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = [await turn(detail) for detail in details]
+        ttft, total, size = (sum(column) / len(results) for column in zip(*results))
+        return ttft, total, size
+
+    stream = fake_stream(first_token, interval, chunks)
+    replier = LlmReplier(stream)
+    details = [f"快递延误了 {i} 天。" for i in range(turns)]
+    ttft, total, size = asyncio.run(measure(replier, details))
+    print(f"[llm_reply] 假 LLM 首段 {first_token * 1e3:.0f} ms + {chunks} 段 x {interval * 1e3:.0f} ms: "
+          f"流式首个片段 {ttft * 1e3:.0f} ms, 整段生成完 {total * 1e3:.0f} ms（不流式时用户要等的时间），{size:.0f} 字")
+    ttft, total, _ = asyncio.run(measure(replier, details))
+    print(f"[llm_reply] 相同 prompt 命中缓存: {total * 1e3:.3f} ms, 命中 {replier.stats['cached']} 次")
+
+    limited = LlmReplier(stream, max_tokens=20)
+    _, total, size = asyncio.run(measure(limited, details[:1]))
+    print(f"[llm_reply] max_tokens=20: {total * 1e3:.0f} ms, {size:.0f} 字")
+    budget = first_token + interval * 10
+    timed = LlmReplier(stream, time_budget=budget)
+    _, total, size = asyncio.run(measure(timed, details[:1]))
+    print(f"[llm_reply] time_budget={budget * 1e3:.0f} ms: {total * 1e3:.0f} ms, {size:.0f} 字"
+          f"（超时 {timed.stats['timeout']} 次）")
+
+
+BENCHMARKS = {
+    'keywords': bench_keywords,
+    'regex': bench_regex,
+    'llm_reply': bench_llm_reply,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -17,7 +17,16 @@ class BinOpExpr:
     op: str   # '&&' or '||'
     right: 'Expr'
 
-Expr = Union[HasExpr, NotExpr, BinOpExpr]
+@dataclass
+class ValueExpr:
+    name: str   # 变量的值为真，如 if (api_result.ticket_id)
+
+@dataclass
+class EqExpr:
+    name: str
+    value: str  # switch 的 case 展开成 name == value
+
+Expr = Union[HasExpr, NotExpr, BinOpExpr, ValueExpr, EqExpr]
 
 # --- 动作 ---
 @dataclass
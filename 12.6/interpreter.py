@@ -1,19 +1,62 @@
 # interpreter.py
 import os
+import sys
+import time
 import asyncio
-from typing import Dict, Any, Optional, List
-
-import dashscope
-from dashscope import Generation
+import contextvars
+from http import HTTPStatus
+from typing import Dict, Any, Callable, Optional, List
 
 from dsl_ast import *
 from parser import Parser
 from lexer import Lexer
+from keyword_matcher import KeywordIndex
+from regex_matcher import RegexIndex
+from llm_reply import LlmReplier
+
+# 统一 IR、IR 运行时和预编译 bundle 的格式在 final_version 中（ir.py / ir_runtime.py / bundle.py）
+FINAL_VERSION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'final_version')
+
+_dashscope = None
+
+
+def dashscope_generation():
+    """
+    第一次调用 LLM 时才导入 DashScope SDK（导入要 0.3 s 左右），同时检查 API Key，
+    没有设置时抛 EnvironmentError。只用规则 / 关键词 / 正则匹配时不需要 SDK 和 Key。
+    """
+    global _dashscope
+    if _dashscope is None:
+        import dashscope
+        _dashscope = dashscope
+    if not _dashscope.api_key:
+        _dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not _dashscope.api_key:
+        raise EnvironmentError("请设置环境变量 DASHSCOPE_API_KEY")
+    return _dashscope.Generation
 
-# 设置 DashScope API Key
-dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
-if not dashscope.api_key:
-    raise EnvironmentError("请设置环境变量 DASHSCOPE_API_KEY")
+
+# llm_reply 发给 LLM 的指令，后面接渲染好的模板
+REPLY_INSTRUCTION = "你是电商客服。请参考下面的内容，用礼貌、简洁的中文直接回复用户，不要添加其他说明：\n"
+
+
+def dashscope_stream(prompt: str, max_tokens: int, session: Any, deadline: float):
+    """llm_reply 的生成后端：先在共享限流器里排队，再用 DashScope 流式生成，逐段产出新增的文本"""
+    rate_limiter = import_final_version('rate_limiter')
+    generation = dashscope_generation()
+    shared_rate_limiter().acquire(session, rate_limiter.estimate_tokens(prompt) + max_tokens, deadline)
+    responses = generation.call(
+        model="qwen-max",
+        prompt=REPLY_INSTRUCTION + prompt,
+        max_tokens=max_tokens,
+        stream=True,
+        incremental_output=True,  # 每个响应只包含新增的文本
+        timeout=10
+    )
+    for response in responses:
+        if response.status_code != HTTPStatus.OK:
+            raise RuntimeError(f"{response.code}: {response.message}")
+        yield response.output.text
 
 
 class Context:
@@ -32,20 +75,91 @@ class Context:
 
 
 class Interpreter:
-    def __init__(self, program: Program):
-        self.program = program
+    """
+    12.6 intent 语法的解释器。加载时把 Program 编译成 final_version 的统一 IR（ir.IRBuilder.add_intents），
+    动作由 IR 运行时（ir_runtime.IRRuntime）执行，和 [rule] 规则、预编译 bundle 用同一个执行器，
+    所以 .dsl 源文件和由它编译出的 bundle 回复一致：
+    - call_api 的结果写入 api_result（{{api_result.xxx}} 可以取字段），未提供实现的服务模拟调用
+    - goto 跳转到目标意图继续执行
+    - 没有任何回复时回复“已收到您的请求。”
+    意图识别（正则 / 关键词 / LLM）在 IR 入口上进行；functions 为 call_api 服务的实现（服务名 -> 函数）。
+    """
+    def __init__(self, program: Program, functions: Optional[Dict[str, Any]] = None):
+        builder = import_final_version('ir').IRBuilder()
+        builder.add_intents(program)
+        self.load(builder.build(), functions)
+
+    def load(self, ir_program, functions: Optional[Dict[str, Any]] = None):
+        ir = import_final_version('ir')
+        runtime_module = import_final_version('ir_runtime')
+        self.ir = ir_program
+        services = {ins[1] for ins in self.ir.code if ins[0] == ir.CALL_API}
+        self.functions = {name: self.mock_api(name) for name in services}
+        self.functions.update(functions or {})
+        # llm_reply：流式生成，相同 prompt 的回复缓存复用
+        self.replier = LlmReplier(dashscope_stream)
+        self.has_llm_reply = any(ins[0] == ir.LLM_REPLY for ins in self.ir.code)
+        self.runtime = runtime_module.IRRuntime(self.ir, self.functions, self.ir_llm_reply)
+        # 所有 KeywordsMatch 意图的关键词在加载时编译成一个 Aho-Corasick 自动机
+        self.keywords = KeywordIndex([(entry.match[1], entry) for entry in self.ir.entries
+                                      if entry.match and entry.match[0] == 'keywords'])
+        # 所有 RegexMatch 意图的正则在加载时检查回溯风险并合并成分片的大正则
+        self.regexes = RegexIndex([(entry.match[1], entry) for entry in self.ir.entries
+                                   if entry.match and entry.match[0] == 'regex'])
+
+    @staticmethod
+    def with_slots(context: Context, slots: Dict[str, Any]) -> Context:
+        """正则捕获到的槽位先叠加到一个临时上下文上判断 context 条件，选中后才写回"""
+        if not slots:
+            return context
+        view = Context()
+        view.slots = {**context.slots, **slots}
+        return view
 
-    async def detect_llm_intent(self, user_input: str) -> Optional[str]:
+    def match_regex(self, user_input: str, context: Context):
+        """返回 (入口, 捕获的槽位)：命中位置最靠前且 context 条件满足的正则意图"""
+        for hit in self.regexes.search(user_input):
+            guard = hit.target.guard_fn
+            if guard is None or guard(self.with_slots(context, hit.slots)):
+                print(f"[DEBUG] 正则命中意图: {hit.target.name}，槽位: {hit.slots}")
+                return hit.target, hit.slots
+        return None, {}
+
+    def match_keywords(self, user_input: str, context: Context):
+        """关键词命中的意图中，权重最高且 context 条件满足的那个"""
+        for entry, weight in self.keywords.match(user_input):
+            if entry.guard_fn is None or entry.guard_fn(context):
+                print(f"[DEBUG] 关键词命中意图: {entry.name}（权重 {weight}）")
+                return entry
+        return None
+
+    def match_llm_intent(self, name: str, context: Context):
+        """llm_intent 为 name 且 context 条件满足的第一个意图（同名的关键词 / 正则意图不算）"""
+        for i in self.ir.dispatch.get(('intent', name), ()):
+            entry = self.ir.entries[i]
+            if entry.match is None and (entry.guard_fn is None or entry.guard_fn(context)):
+                return entry
+        return None
+
+    @staticmethod
+    def mock_api(service: str):
+        def call(args):
+            print(f"[模拟调用API] service={service}, args={args}")
+            return {name: f"mock_value_{name}" for name in args}
+        return call
+
+    def ir_llm_reply(self, prompt: str) -> str:
+        """IR 运行时的 llm_reply 回调（在工作线程里调用）：回到事件循环流式生成，阻塞到生成结束"""
+        loop, session, on_chunk = _ir_turn.get()
+        return asyncio.run_coroutine_threadsafe(self.replier.reply(prompt, on_chunk, session), loop).result()
+
+    async def detect_llm_intent(self, user_input: str, session: Any = None) -> Optional[str]:
         """
         调用 LLM 判断用户意图，返回 llm_intent 名称（如 'query_logistics'）或 None。
         不再映射到具体 DSL 意图名。
+        调用前先在共享的限流器里按会话（session）排队，额度不足时按未识别处理。
         """
-        # 收集所有可用的 llm_intent 名称
-        available_intents = set()
-        for intent in self.program.intents:
-            if isinstance(intent.match, LlmIntentMatch):
-                available_intents.add(intent.match.intent_name)
-
+        available_intents = self.llm_intent_names()
         if not available_intents:
             return None
 
@@ -62,8 +176,13 @@ class Interpreter:
             f"意图："
         )
 
+        rate_limiter = import_final_version('rate_limiter')
         try:
-            response = Generation.call(
+            generation = dashscope_generation()
+            await asyncio.to_thread(shared_rate_limiter().acquire, session,
+                                    rate_limiter.estimate_tokens(prompt) + 10,
+                                    time.monotonic() + rate_limiter.QUEUE_DEADLINE)
+            response = generation.call(
                 model="qwen-max",
                 prompt=prompt,
                 temperature=0.1,
@@ -83,94 +202,75 @@ class Interpreter:
                     print(f"[DEBUG] LLM 意图识别为: {name}")
                     return name
 
+            return None
+        except rate_limiter.RateLimited as e:
+            print(f"[WARN] ⏳ {e}，跳过 LLM 意图识别")
             return None
         except Exception as e:
             print(f"[ERROR] LLM 调用失败: {e}")
             return None
 
-    def evaluate_expr(self, expr: Expr, context: Context) -> bool:
-        """求值布尔表达式（如 has(order_id), !has(x) 等）"""
-        if isinstance(expr, HasExpr):
-            return context.has(expr.field)
-        elif isinstance(expr, NotExpr):
-            return not self.evaluate_expr(expr.expr, context)
-        elif isinstance(expr, BinOpExpr):
-            left = self.evaluate_expr(expr.left, context)
-            right = self.evaluate_expr(expr.right, context)
-            if expr.op == '&&':
-                return left and right
-            elif expr.op == '||':
-                return left or right
-            else:
-                raise ValueError(f"未知操作符: {expr.op}")
+    def llm_intent_names(self) -> set:
+        """收集所有可用的 llm_intent 名称"""
+        return {key[1] for key, indices in self.ir.dispatch.items()
+                if key[0] == 'intent' and any(self.ir.entries[i].match is None for i in indices)}
+
+    async def run(self, user_input: str, context: Context,
+                  on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """
+        主入口：处理用户输入，返回系统回复。
+        正则和关键词意图在本地匹配，命中时不再调用 LLM；同一个 LLM 意图对应多个 DSL 意图时取第一个 context 条件满足的。
+        回复来自 llm_reply 时，生成的片段会先逐段交给 on_chunk。
+        """
+        entry, slots = self.match_regex(user_input, context)
+        for field, value in slots.items():
+            context.set(field, value)
+        if entry is None:
+            entry = self.match_keywords(user_input, context)
+        if entry is None:
+            matched_llm_intent = await self.detect_llm_intent(user_input, id(context))
+            if not matched_llm_intent:
+                return "抱歉，我不太明白您的意思。"
+
+            entry = self.match_llm_intent(matched_llm_intent, context)
+            if entry is None:
+                return "当前条件不满足，无法处理该请求。"
+            print(f"[DEBUG] 选中意图: {entry.name}")
+        if not self.has_llm_reply:
+            messages = self.runtime.run(entry, context)
         else:
-            raise TypeError(f"不支持的表达式类型: {type(expr)}")
+            # 含 llm_reply 的程序放到工作线程里执行，生成期间不阻塞事件循环
+            _ir_turn.set((asyncio.get_running_loop(), id(context), on_chunk))
+            messages = await asyncio.to_thread(self.runtime.run, entry, context)
+        return "\n".join(messages) or import_final_version('ir').DEFAULT_INTENT_REPLY
 
-    async def execute_action(self, action: Action, context: Context) -> Optional[str]:
-        """执行单个动作，返回要回复用户的文本（如果有）"""
-        if isinstance(action, AskAction):
-            if context.has(action.field):
-                return None
-            return action.prompt
-
-        elif isinstance(action, ReplyAction):
-            reply = action.template
-            for key, value in context.slots.items():
-                reply = reply.replace("{{" + key + "}}", str(value))
-            return reply
-
-        elif isinstance(action, CallApiAction):
-            print(f"[模拟调用API] service={action.service}, args={action.args}")
-            # 模拟将参数存入上下文（实际应调用真实 API）
-            for arg_name in action.args:
-                context.set(arg_name, f"mock_value_{arg_name}")
-            return None
 
-        elif isinstance(action, IfAction):
-            cond = self.evaluate_expr(action.condition, context)
-            actions_to_run = action.then_actions if cond else (action.else_actions or [])
-            for act in actions_to_run:
-                reply = await self.execute_action(act, context)
-                if reply is not None:
-                    return reply
-            return None
+def import_final_version(name: str):
+    if FINAL_VERSION_DIR not in sys.path:
+        sys.path.append(FINAL_VERSION_DIR)  # 追加在末尾，本目录的同名模块优先
+    return __import__(name)
 
-        elif isinstance(action, GotoAction):
-            print(f"[INFO] 跳转到意图: {action.target}（未实现）")
-            return None
 
-        else:
-            raise TypeError(f"未知动作类型: {type(action)}")
+_rate_limiter = None
 
-    async def run(self, user_input: str, context: Context) -> str:
-        """
-        主入口：处理用户输入，返回系统回复。
-        支持同一个 LLM 意图对应多个 DSL 意图，自动选择符合条件的。
-        """
-        # Step 1: LLM 意图识别
-        matched_llm_intent = await self.detect_llm_intent(user_input)
-        if not matched_llm_intent:
-            return "抱歉，我不太明白您的意思。"
-
-        # Step 2: 找出所有匹配该 LLM 意图且 context 条件满足的 DSL 意图
-        candidates = []
-        for intent in self.program.intents:
-            if isinstance(intent.match, LlmIntentMatch):
-                if intent.match.intent_name == matched_llm_intent:
-                    if self.evaluate_expr(intent.context, context):
-                        candidates.append(intent)
-
-        if not candidates:
-            return "当前条件不满足，无法处理该请求。"
-
-        # Step 3: 选择第一个符合条件的意图（未来可扩展优先级）
-        selected_intent = candidates[0]
-        print(f"[DEBUG] 选中意图: {selected_intent.name}")
-
-        # Step 4: 执行动作序列
-        for action in selected_intent.actions:
-            reply = await self.execute_action(action, context)
-            if reply is not None:
-                return reply
-
-        return "已收到您的请求。"
\ No newline at end of file
+
+def shared_rate_limiter():
+    """进程内所有解释器共用一个限流器（final_version/rate_limiter.py），第一次调用 LLM 时创建"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = import_final_version('rate_limiter').RateLimiter()
+    return _rate_limiter
+
+
+# IR 运行时在工作线程里执行，llm_reply 回调通过它找到本轮的事件循环、会话和输出片段的回调
+_ir_turn = contextvars.ContextVar('ir_turn', default=None)
+
+
+def is_bundle(path: str) -> bool:
+    return import_final_version('bundle').is_bundle(path)
+
+
+class BundleInterpreter(Interpreter):
+    """执行 final_version/bundle.py 编译出的预编译包，启动时不再解析 DSL；其余与 Interpreter 完全相同"""
+    def __init__(self, path: str, functions: Optional[Dict[str, Any]] = None):
+        self.load(import_final_version('bundle').load_program(path), functions)
@@ -0,0 +1,122 @@
+# keyword_matcher.py
+# KeywordsMatch 的匹配引擎：加载时把所有意图的关键词编译成一个 Aho-Corasick 自动机，
+# 对用户输入只扫描一遍，就能找出命中的全部意图。
+from collections import deque
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from dsl_ast import KeywordsMatch
+
+
+class AhoCorasick:
+    """
+    多模式串匹配自动机。
+    goto[状态] 是 {字符: 下一状态}，fail[状态] 是失配后回退到的状态，
+    output[状态] 是在该状态结束的全部模式串编号（已经合并了 fail 链上的输出）。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[int, ...]] = [()]
+        index: Dict[str, int] = {}
+        for pattern in patterns:
+            if pattern and pattern not in index:
+                index[pattern] = len(self.patterns)
+                self.patterns.append(pattern)
+                self._insert(pattern, index[pattern])
+        self._link()
+
+    def _insert(self, pattern: str, pid: int):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            node = nxt
+        self.output[node] += (pid,)
+
+    def _link(self):
+        """按 BFS 顺序计算 fail 指针（第一层的 fail 都是根），父节点总是先于子节点处理"""
+        goto, fail, output = self.goto, self.fail, self.output
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0)
+                output[child] += output[fail[child]]
+
+    def search(self, text: str) -> List[int]:
+        """返回 text 中出现的全部模式串编号（按出现位置，可能重复）"""
+        goto, fail, output = self.goto, self.fail, self.output
+        hits = []
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                hits.extend(output[node])
+        return hits
+
+    def __len__(self):
+        return len(self.goto)
+
+
+class KeywordIndex:
+    """
+    关键词 -> 意图的倒排索引。match(text) 扫描一遍输入，
+    按命中权重（命中的不同关键词的总字数，越长的词越具体）从高到低返回目标；
+    权重相同时按加载顺序。
+    """
+
+    def __init__(self, entries: Sequence[Tuple[Sequence[str], Any]]):
+        self.targets = [target for _, target in entries]
+        self.automaton = AhoCorasick(kw for keywords, _ in entries for kw in keywords)
+        self.owners: List[List[int]] = [[] for _ in self.automaton.patterns]
+        pid = {p: i for i, p in enumerate(self.automaton.patterns)}
+        for t, (keywords, _) in enumerate(entries):
+            for kw in set(keywords):
+                if kw:
+                    self.owners[pid[kw]].append(t)
+
+    @classmethod
+    def from_intents(cls, intents) -> 'KeywordIndex':
+        return cls([(intent.match.keywords, intent) for intent in intents
+                    if isinstance(intent.match, KeywordsMatch)])
+
+    def scores(self, text: str) -> Dict[int, int]:
+        patterns = self.automaton.patterns
+        scores: Dict[int, int] = {}
+        for pid in set(self.automaton.search(text)):
+            weight = len(patterns[pid])
+            for t in self.owners[pid]:
+                scores[t] = scores.get(t, 0) + weight
+        return scores
+
+    def match(self, text: str) -> List[Tuple[Any, int]]:
+        """返回 [(目标, 权重)]，权重从高到低"""
+        ranked = sorted(self.scores(text).items(), key=lambda item: (-item[1], item[0]))
+        return [(self.targets[t], weight) for t, weight in ranked]
+
+    def __bool__(self):
+        return bool(self.targets)
+
+
+def naive_match(entries, text):
+    """逐个关键词用 in 扫描的朴素实现，作为基准对照和正确性参照"""
+    scores = {}
+    for t, (keywords, _) in enumerate(entries):
+        weight = sum(len(kw) for kw in set(keywords) if kw and kw in text)
+        if weight:
+            scores[t] = weight
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [(entries[t][1], weight) for t, weight in ranked]
@@ -16,6 +16,9 @@ class TokenType(Enum):
     GOTO = "goto"
     IF = "if"
     ELSE = "else"
+    SWITCH = "switch"
+    CASE = "case"
+    DEFAULT = "default"
     IDENTIFIER = "IDENTIFIER"
     STRING = "STRING"
     REGEX = "REGEX"
@@ -41,7 +44,8 @@ class Token:
 KEYWORDS = {t.value: t for t in [
     TokenType.INTENT, TokenType.MATCH, TokenType.CONTEXT, TokenType.ACTIONS,
     TokenType.ASK, TokenType.CALL_API, TokenType.REPLY, TokenType.LLM_REPLY,
-    TokenType.GOTO, TokenType.IF, TokenType.ELSE
+    TokenType.GOTO, TokenType.IF, TokenType.ELSE,
+    TokenType.SWITCH, TokenType.CASE, TokenType.DEFAULT
 ]}
 
 class Lexer:
@@ -50,6 +54,13 @@ class Lexer:
         self.pos = 0
         self.line = 1
 
+    def in_name(self, i: int) -> bool:
+        """标识符可以带点号（ctx.order_id、api_result.ticket_id），点号后面必须紧跟字母或下划线"""
+        ch = self.text[i]
+        if ch.isalnum() or ch == '_':
+            return True
+        return ch == '.' and i + 1 < len(self.text) and (self.text[i + 1].isalpha() or self.text[i + 1] == '_')
+
     def tokenize(self) -> List[Token]:
         tokens = []
         while self.pos < len(self.text):
@@ -91,7 +102,7 @@ class Lexer:
                 self.pos = end + 1
             elif ch.isalpha() or ch == '_':
                 start = self.pos
-                while self.pos < len(self.text) and (self.text[self.pos].isalnum() or self.text[self.pos] == '_'):
+                while self.pos < len(self.text) and self.in_name(self.pos):
                     self.pos += 1
                 word = self.text[start:self.pos]
                 tok_type = KEYWORDS.get(word, TokenType.IDENTIFIER)
@@ -0,0 +1,137 @@
+# llm_reply.py
+# llm_reply 动作的执行：渲染好的 prompt 交给 LLM 流式生成，每收到一段就交给 on_chunk 输出给用户，
+# 首个片段到达即可显示，不用等整段生成完。
+# - 相同的渲染结果（prompt）只生成一次，完整生成的回复放进 LRU 缓存，之后直接返回
+# - 每次生成受 max_tokens（token 数）和 time_budget（秒）限制，超出后停止，已输出的部分作为回复
+# - 一段都没生成出来（未配置 Key、额度不足、超时、出错）时，回复渲染后的 prompt 原文
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+MAX_REPLY_TOKENS = 200     # 单次回复最多生成的 token 数
+REPLY_TIME_BUDGET = 8.0    # 单次回复（含排队）的总时间预算，秒
+CACHE_SIZE = 1024          # 缓存的回复条数
+
+# stream(prompt, max_tokens, session, deadline) -> 逐段产出新增文本的迭代器（阻塞式，在后台线程里消费）
+StreamFn = Callable[[str, int, Any, float], Iterable[str]]
+
+_DONE = object()
+PLACEHOLDER_RE = re.compile(r'\{\{\s*([\w.]+)\s*\}\}')
+
+
+def render_prompt(template: str, get: Callable[[str], Any]) -> str:
+    """
+    一遍替换模板里的 {{变量}}，get 为取槽位的函数（Context.get）；
+    支持 {{api_result.message}} 这样的点号访问，取不到的变量原样保留
+    """
+    def value(m):
+        name = m.group(1)
+        found = get(name)
+        if found is None and '.' in name:
+            base, _, attr = name.partition('.')
+            obj = get(base)
+            if isinstance(obj, dict):
+                found = obj.get(attr)
+        return m.group(0) if found is None else str(found)
+    return PLACEHOLDER_RE.sub(value, template)
+
+
+class LlmReplier:
+    """
+    async reply(prompt, on_chunk, session) 返回完整回复文本；on_chunk(text) 在事件循环线程里逐段调用。
+    stats 记录缓存命中、生成、截断（token / 时间预算）和失败次数。
+    """
+
+    def __init__(self, stream: StreamFn, max_tokens: int = MAX_REPLY_TOKENS,
+                 time_budget: float = REPLY_TIME_BUDGET, cache_size: int = CACHE_SIZE,
+                 count_tokens: Callable[[str], int] = len):
+        self.stream = stream
+        self.max_tokens = max_tokens
+        self.time_budget = time_budget
+        self.cache_size = cache_size
+        self.count_tokens = count_tokens
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {"cached": 0, "generated": 0, "token_limit": 0, "timeout": 0, "failed": 0}
+
+    def _remember(self, prompt: str, reply: str):
+        self.cache[prompt] = reply
+        self.cache.move_to_end(prompt)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _produce(self, prompt: str, session: Any, deadline: float, stop: threading.Event,
+                 loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        """后台线程：消费阻塞式的流，逐段转交给事件循环；stop 置位后不再继续读取"""
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # 事件循环已关闭，没有人在等了
+                pass
+
+        try:
+            for chunk in self.stream(prompt, self.max_tokens, session, deadline):
+                if stop.is_set():
+                    return
+                if chunk:
+                    put(chunk)
+        except Exception as e:
+            put(e)
+        else:
+            put(_DONE)
+
+    async def reply(self, prompt: str, on_chunk: Optional[Callable[[str], None]] = None,
+                    session: Any = None) -> str:
+        emit = on_chunk or (lambda text: None)
+        cached = self.cache.get(prompt)
+        if cached is not None:
+            self.cache.move_to_end(prompt)
+            self.stats["cached"] += 1
+            emit(cached)
+            return cached
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        deadline = time.monotonic() + self.time_budget
+        # 用守护线程而不是默认线程池：卡住的流不会拖住事件循环退出
+        threading.Thread(target=self._produce, args=(prompt, session, deadline, stop, loop, queue),
+                         daemon=True).start()
+
+        parts = []
+        tokens = 0
+        complete = False
+        try:
+            while True:
+                item = await asyncio.wait_for(queue.get(), max(0.0, deadline - time.monotonic()))
+                if item is _DONE:
+                    complete = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                parts.append(item)
+                emit(item)
+                tokens += self.count_tokens(item)
+                if tokens >= self.max_tokens:
+                    self.stats["token_limit"] += 1
+                    complete = True  # 按 token 上限截断的结果是确定的，可以缓存
+                    break
+        except asyncio.TimeoutError:
+            self.stats["timeout"] += 1
+            print(f"[WARN] ⏱️ llm_reply 超过 {self.time_budget:.1f}s 时间预算，已生成 {tokens} 个 token")
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"[ERROR] llm_reply 生成失败: {e}")
+        finally:
+            stop.set()
+
+        reply = "".join(parts)
+        if not reply:
+            emit(prompt)
+            return prompt
+        self.stats["generated"] += 1
+        if complete:
+            self._remember(prompt, reply)
+        return reply
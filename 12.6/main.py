@@ -1,8 +1,9 @@
 # main.py
+import sys
 import asyncio
 from lexer import Lexer
 from parser import Parser
-from interpreter import Interpreter, Context
+from interpreter import Interpreter, BundleInterpreter, Context, is_bundle
 
 dsl_code = '''
 intent ask_order_for_logistics {
@@ -26,15 +27,48 @@ intent ask_complaint_type {
     match: llm_intent: "start_complaint" 
 '''
 
-async def main():
+def load_interpreter(path=None):
+    """
+    path 可以是 .dsl 源文件，也可以是 final_version/bundle.py compile 生成的预编译包；
+    不传时解析上面内联的 dsl_code
+    """
+    if path and is_bundle(path):
+        return BundleInterpreter(path)
+    source = dsl_code
+    if path:
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
     # 解析 DSL
-    lexer = Lexer(dsl_code)
+    lexer = Lexer(source)
     tokens = lexer.tokenize()
     parser = Parser(tokens)
     program = parser.parse_program()
+    return Interpreter(program)
 
-    interpreter = Interpreter(program)
+
+class StreamPrinter:
+    """llm_reply 的片段一到就打印；本轮回复已经逐段打印过时，finish 只补一个换行"""
+    def __init__(self):
+        self.started = False
+
+    def __call__(self, chunk):
+        if not self.started:
+            print("🤖 系统: ", end="", flush=True)
+            self.started = True
+        print(chunk, end="", flush=True)
+
+    def finish(self, reply):
+        if self.started:
+            print()
+        else:
+            print(f"🤖 系统: {reply}")
+        self.started = False
+
+
+async def main(path=None):
+    interpreter = load_interpreter(path)
     context = Context()
+    printer = StreamPrinter()
 
     print("💬 对话系统已启动（输入 'quit' 退出）")
     while True:
@@ -44,8 +78,8 @@ async def main():
         if not user_input:
             continue
 
-        reply = await interpreter.run(user_input, context)
-        print(f"🤖 系统: {reply}")
+        reply = await interpreter.run(user_input, context, printer)
+        printer.finish(reply)
 
         # （可选）尝试从用户输入中提取 order_id（简单规则）
         if "订单" in user_input or user_input.isdigit():
@@ -60,4 +94,4 @@ async def main():
                     context.set("order_id", match.group())
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(*sys.argv[1:2]))
\ No newline at end of file
@@ -25,6 +25,11 @@ class Parser:
                 f"Line {tok.line}: Expected {expected_type.value}, got '{tok.value}' ({tok.type.value})"
             )
 
+    def parse_name(self) -> str:
+        """变量名；ctx.order_id 指上下文里的槽位 order_id，其余点号（api_result.ticket_id）保留给运行时按字段取值"""
+        name = self.consume(TokenType.IDENTIFIER).value
+        return name[len('ctx.'):] if name.startswith('ctx.') else name
+
     def parse_program(self) -> Program:
         intents = []
         while self.peek().type != TokenType.EOF:
@@ -106,9 +111,11 @@ class Parser:
               self.peek().value == "has"):
             self.consume(TokenType.IDENTIFIER)  # has
             self.consume(TokenType.LPAREN)
-            field = self.consume(TokenType.IDENTIFIER).value
+            field = self.parse_name()
             self.consume(TokenType.RPAREN)
             return HasExpr(field)
+        elif self.peek().type == TokenType.IDENTIFIER:
+            return ValueExpr(self.parse_name())
         else:
             tok = self.peek()
             raise SyntaxError(f"Line {tok.line}: Unexpected token in expression: {tok.value}")
@@ -117,11 +124,7 @@ class Parser:
         self.consume(TokenType.ACTIONS)
         self.consume(TokenType.COLON)
         self.consume(TokenType.LBRACK)
-        actions = []
-        while self.peek().type != TokenType.RBRACK:
-            actions.append(self.parse_action())
-            if self.peek().type == TokenType.COMMA:
-                self.consume(TokenType.COMMA)
+        actions = self.parse_action_list({TokenType.RBRACK})
         self.consume(TokenType.RBRACK)
         return actions
 
@@ -139,6 +142,8 @@ class Parser:
             return self.parse_goto_action()
         elif tok.type == TokenType.IF:
             return self.parse_if_action()
+        elif tok.type == TokenType.SWITCH:
+            return self.parse_switch_action()
         else:
             raise SyntaxError(f"Line {tok.line}: Unknown action: {tok.value}")
 
@@ -164,7 +169,9 @@ class Parser:
         self.consume(TokenType.LBRACE)
         d = {}
         while self.peek().type != TokenType.RBRACE:
-            key = self.consume(TokenType.STRING).value
+            # 键可以加引号，也可以直接写名字：{"order_id": ...} / {order_id: ...}
+            key_type = TokenType.IDENTIFIER if self.peek().type == TokenType.IDENTIFIER else TokenType.STRING
+            key = self.consume(key_type).value
             self.consume(TokenType.COLON)
             val = self.parse_value()
             d[key] = val
@@ -177,7 +184,7 @@ class Parser:
         if self.peek().type == TokenType.STRING:
             return self.consume(TokenType.STRING).value
         elif self.peek().type == TokenType.IDENTIFIER:
-            return self.consume(TokenType.IDENTIFIER).value
+            return self.parse_name()
         elif self.peek().type == TokenType.LBRACE:
             return self.parse_dict()
         else:
@@ -210,13 +217,57 @@ class Parser:
         self.consume(TokenType.LPAREN)
         cond = self.parse_expr()
         self.consume(TokenType.RPAREN)
-        self.consume(TokenType.LBRACE)
-        then_actions = self.parse_actions_clause()
-        self.consume(TokenType.RBRACE)
+        then_actions = self.parse_block()
         else_actions = None
         if self.peek().type == TokenType.ELSE:
             self.consume(TokenType.ELSE)
-            self.consume(TokenType.LBRACE)
-            else_actions = self.parse_actions_clause()
-            self.consume(TokenType.RBRACE)
-        return IfAction(cond, then_actions, else_actions)
\ No newline at end of file
+            else_actions = self.parse_block()
+        return IfAction(cond, then_actions, else_actions)
+
+    def parse_block(self) -> List[Action]:
+        """{ 动作, ... }，里面也可以写成 { actions: [...] }"""
+        self.consume(TokenType.LBRACE)
+        if self.peek().type == TokenType.ACTIONS:
+            actions = self.parse_actions_clause()
+        else:
+            actions = self.parse_action_list({TokenType.RBRACE})
+        self.consume(TokenType.RBRACE)
+        return actions
+
+    def parse_action_list(self, end: set) -> List[Action]:
+        actions = []
+        while self.peek().type not in end:
+            actions.append(self.parse_action())
+            if self.peek().type == TokenType.COMMA:
+                self.consume(TokenType.COMMA)
+        return actions
+
+    def parse_switch_action(self) -> IfAction:
+        """
+        switch (变量) { case "值": 动作... default: 动作... }
+        展开成 if / else 链（变量 == 值），不会贯穿到下一个 case
+        """
+        tok = self.consume(TokenType.SWITCH)
+        self.consume(TokenType.LPAREN)
+        name = self.parse_name()
+        self.consume(TokenType.RPAREN)
+        self.consume(TokenType.LBRACE)
+        cases, default = [], None
+        stop = {TokenType.CASE, TokenType.DEFAULT, TokenType.RBRACE}
+        while self.peek().type != TokenType.RBRACE:
+            if self.peek().type == TokenType.DEFAULT:
+                self.consume(TokenType.DEFAULT)
+                self.consume(TokenType.COLON)
+                default = self.parse_action_list(stop)
+            else:
+                self.consume(TokenType.CASE)
+                value = self.consume(TokenType.STRING).value
+                self.consume(TokenType.COLON)
+                cases.append((value, self.parse_action_list(stop)))
+        self.consume(TokenType.RBRACE)
+        if not cases:
+            raise SyntaxError(f"Line {tok.line}: switch needs at least one case")
+        chain = default
+        for value, actions in reversed(cases):
+            chain = [IfAction(EqExpr(name, value), actions, chain)]
+        return chain[0]
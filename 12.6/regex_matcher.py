@@ -0,0 +1,389 @@
+# regex_matcher.py
+# RegexMatch 的匹配引擎：加载时检查全部意图的正则并编进一个索引，
+# 对用户输入扫描一次就能确定命中的意图并取出槽位（如 order_id）。
+import re
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:  # Python 3.10 及以前
+    import sre_parse
+    import sre_constants
+
+from dsl_ast import RegexMatch
+from keyword_matcher import AhoCorasick
+
+# 每个分片合并的正则个数。re 在首字符命中的位置要依次尝试每个分支，分片太大编译慢、也更容易退化；
+# 老版本 Python 的 re 最多 100 个分组，在那样的环境里需要调小
+SHARD_SIZE = 100
+
+# 原正则里的命名分组，合并时要改名避免重名（前面是偶数个反斜杠才是真正的分组）
+NAMED_GROUP_RE = re.compile(r'(?<!\\)((?:\\\\)*)\(\?P<(\w+)>')
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_GROUP_REFS = (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS)
+_ASSERTS = (sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+# (?>...) 和 a++ 是 Python 3.11 新增的，老版本里没有这两个操作码
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+
+
+class UnsafePatternError(ValueError):
+    """正则无法编译，或有灾难性回溯的风险（如 (a+)+、(.|x)*）"""
+
+
+class RegexHit(NamedTuple):
+    target: Any
+    slots: Dict[str, str]   # 命名分组捕获到的槽位
+    span: Tuple[int, int]
+
+
+def _scoped_flags(av):
+    """SUBPATTERN 的参数 (分组号, 加上的标志, 去掉的标志, 子模式)：是否带 (?i:...) 这样的局部标志"""
+    return bool(av[1] or av[2])
+
+
+def _first_chars(items):
+    """子模式可能匹配的第一个字符的粗略集合；None 表示任意字符"""
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            return {av}
+        if op == sre_constants.AT:
+            continue
+        if op == sre_constants.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op in _REPEATS and av[0] > 0:
+            return _first_chars(av[2])
+        if op == sre_constants.IN and all(o == sre_constants.LITERAL for o, _ in av):
+            return {a for _, a in av}
+        return None
+    return set()
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d', sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_WORD: r'\w', sre_constants.CATEGORY_NOT_WORD: r'\W',
+    sre_constants.CATEGORY_SPACE: r'\s', sre_constants.CATEGORY_NOT_SPACE: r'\S',
+}
+
+
+def _class_items(op, av):
+    """单个字符匹配项对应的字符类写法（放进 [...] 里），不支持时返回 None"""
+    if op == sre_constants.LITERAL:
+        return {re.escape(chr(av))}
+    if op == sre_constants.RANGE:
+        return {f"{re.escape(chr(av[0]))}-{re.escape(chr(av[1]))}"}
+    if op == sre_constants.CATEGORY:
+        return {_CATEGORIES[av]} if av in _CATEGORIES else None
+    if op == sre_constants.IN:
+        items = set()
+        for item in av:
+            sub = _class_items(*item)
+            if sub is None:
+                return None
+            items |= sub
+        return items
+    return None
+
+
+def first_class(items):
+    """
+    正则第一个字符所属字符类的写法集合，用来给合并后的分片加 (?=[...]) 前瞻：
+    分支外面包了命名分组后 re 就算不出首字符集合，没有前瞻时每个位置都要试一遍全部分支
+    """
+    for op, av in items:
+        if op == sre_constants.AT:
+            continue
+        if op == sre_constants.SUBPATTERN:
+            # 局部标志（如 (?i:...)）改变了字符的匹配方式，按原样写出的字符类不再准确
+            return None if _scoped_flags(av) else first_class(av[-1])
+        if op in _REPEATS and av[0] > 0:
+            return first_class(av[2])
+        if op == sre_constants.BRANCH:
+            options = [first_class(branch) for branch in av[1]]
+            return None if not all(options) else set().union(*options)
+        return _class_items(op, av)
+    return None
+
+
+def _overlapping_branches(branches):
+    seen = set()
+    for branch in branches:
+        chars = _first_chars(branch)
+        if chars is None or chars & seen:
+            return True
+        seen |= chars
+    return False
+
+
+def _children(op, av):
+    """带子模式的节点（分组、量词、分支、前后断言、条件分组等）下的各个子模式"""
+    if op in _REPEATS or op == _POSSESSIVE_REPEAT:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == _ATOMIC_GROUP:
+        return [av]
+    if op == sre_constants.BRANCH:
+        return av[1]
+    if op in _ASSERTS:
+        return [av[1]]
+    if op == sre_constants.GROUPREF_EXISTS:
+        return [av[1], av[2]] if av[2] else [av[1]]
+    return []
+
+
+def _check_backtracking(items, outer=None):
+    """
+    找出会导致指数级回溯的结构，返回问题描述或 None。outer 为外层可重复多次的量词：
+    None / 'counted'（如 {12}）/ 'unbounded'（如 +、*）
+    - 可重复多次的量词里套着无上限量词，如 (a+)+、(\\w*)*、(.*a){12}
+    - 无上限量词内部的分支可能以同一个字符开头，如 (.|x)+、(\\w|\\d\\d)*
+    前瞻 / 后顾里的子模式同样会回溯，一并检查，如 (?=(a+)+$)
+    """
+    for op, av in items:
+        if op in _REPEATS:
+            unbounded = av[1] == sre_constants.MAXREPEAT
+            if unbounded and outer:
+                return "嵌套的无上限量词" if outer == 'unbounded' else "有次数的量词里套着无上限量词"
+            if unbounded:
+                inner = 'unbounded'
+            elif av[1] > 1:
+                inner = outer or 'counted'
+            else:
+                inner = outer
+            problem = _check_backtracking(av[2], inner)
+        elif op == sre_constants.BRANCH:
+            if outer == 'unbounded' and _overlapping_branches(av[1]):
+                return "量词内的分支开头重叠"
+            problem = next(filter(None, (_check_backtracking(branch, outer) for branch in av[1])), None)
+        else:
+            problem = next(filter(None, (_check_backtracking(sub, outer) for sub in _children(op, av))), None)
+        if problem:
+            return problem
+    return None
+
+
+def _walk(items):
+    """逐个产出全部节点 (op, av)，包括前瞻 / 后顾等断言里的子模式"""
+    for op, av in items:
+        yield op, av
+        for sub in _children(op, av):
+            yield from _walk(sub)
+
+
+def validate_pattern(pattern: str, name: str = '?'):
+    """加载时检查正则，返回解析结果；不合法或有回溯风险时抛 UnsafePatternError"""
+    try:
+        parsed = sre_parse.parse(pattern)
+        re.compile(pattern)
+    except re.error as e:
+        raise UnsafePatternError(f"意图 {name} 的正则 /{pattern}/ 无法编译: {e}") from None
+    problem = _check_backtracking(parsed.data)
+    if problem:
+        raise UnsafePatternError(f"意图 {name} 的正则 /{pattern}/ 有灾难性回溯风险: {problem}")
+    return parsed
+
+
+def _literal_runs(items):
+    """
+    顶层顺序里连续的字面字符串（每一段都是匹配成功时必然出现的子串）。
+    带局部标志（如 (?i:...)）的正则不做预过滤：自动机按大小写精确匹配，会漏掉 ABC 这样的输入
+    """
+    if any(op == sre_constants.SUBPATTERN and _scoped_flags(av) for op, av in _walk(items)):
+        return []
+    runs, current = [], []
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            current.append(chr(av))
+            continue
+        if current:
+            runs.append({''.join(current)})
+            current = []
+        if op == sre_constants.SUBPATTERN:
+            inner = required_literals(av[-1])
+            if inner:
+                runs.append(inner)
+        elif op == sre_constants.BRANCH:
+            options = [required_literals(branch) for branch in av[1]]
+            if all(options):
+                runs.append(set().union(*options))
+        elif op in _REPEATS and av[0] > 0:
+            inner = required_literals(av[2])
+            if inner:
+                runs.append(inner)
+    if current:
+        runs.append({''.join(current)})
+    return runs
+
+
+def required_literals(items):
+    """
+    匹配成功时至少出现其中一个的字面子串集合（取最短串最长的那组，过滤效果最好）；
+    找不到时返回 None
+    """
+    runs = _literal_runs(items)
+    if not runs:
+        return None
+    return max(runs, key=lambda options: min(map(len, options)))
+
+
+class _Alternative(NamedTuple):
+    pattern: str
+    targets: List[int]                  # 同一个正则可能对应多个意图（按 context 区分）
+    groups: Optional[Dict[str, str]]    # 合并后的分组名 -> 槽位名；None 表示不能合并
+
+
+class RegexIndex:
+    """
+    entries 为 [(正则, 目标)]，按加载顺序。一次 search 分两步：
+    - 预过滤：每个正则必然包含的字面子串（如“订单(?P<order_id>\\d{6})”里的“订单”）
+      编译进一个 Aho-Corasick 自动机，一遍扫描找出可能命中的少数正则，再逐个确认
+    - 没有字面子串的正则合并成带命名分组的大分支 (?=[首字符])(?:(?P<_a0>...)|(?P<_a1>...))，
+      首字符类相同的放在一起，每 shard_size 个一片；
+      引用了分组编号 / 带全局标志 (?i) 或局部标志 (?i:...) / 算不出首字符的不合并，单独 search
+    相同的正则只编译一次，命中后它的全部目标都是候选。
+    search(text) 按“命中位置靠前、加载顺序靠前”的顺序逐个产出 RegexHit：
+    第一个候选来自上面的一次扫描；调用方不满意（如 context 不满足）时才继续检查其他正则。
+    """
+
+    def __init__(self, entries: Sequence[Tuple[str, Any]], shard_size: int = SHARD_SIZE):
+        self.targets = [target for _, target in entries]
+        self.alternatives: List[_Alternative] = []
+        by_pattern: Dict[str, int] = {}
+        literals: Dict[int, set] = {}
+        classes: Dict[int, frozenset] = {}
+        for t, (pattern, target) in enumerate(entries):
+            if pattern in by_pattern:
+                self.alternatives[by_pattern[pattern]].targets.append(t)
+                continue
+            parsed = validate_pattern(pattern, getattr(target, 'name', target))
+            a = by_pattern[pattern] = len(self.alternatives)
+            self.alternatives.append(self._prepare(a, pattern, parsed, t))
+            if not parsed.state.flags & ~re.UNICODE:
+                options = required_literals(parsed.data)
+                if options:
+                    literals[a] = options
+                else:
+                    first = first_class(parsed.data)
+                    if first:
+                        classes[a] = frozenset(first)
+
+        patterns = sorted({lit for options in literals.values() for lit in options})
+        self.prefilter = AhoCorasick(patterns)
+        self.owners: List[List[int]] = [[] for _ in self.prefilter.patterns]
+        pid = {lit: i for i, lit in enumerate(self.prefilter.patterns)}
+        for a, options in literals.items():
+            for lit in options:
+                self.owners[pid[lit]].append(a)
+
+        by_class: Dict[frozenset, List[int]] = {}
+        self.solo = []
+        for a, alt in enumerate(self.alternatives):
+            if a in literals:
+                continue
+            if alt.groups is None or a not in classes:
+                self.solo.append(a)
+            else:
+                by_class.setdefault(classes[a], []).append(a)
+        self.shards = [self._compile_shard(members[i:i + shard_size], first)
+                       for first, members in by_class.items()
+                       for i in range(0, len(members), shard_size)]
+        self.compiled = [re.compile(alt.pattern) for alt in self.alternatives]
+
+    @classmethod
+    def from_intents(cls, intents, shard_size: int = SHARD_SIZE) -> 'RegexIndex':
+        return cls([(intent.match.pattern, intent) for intent in intents
+                    if isinstance(intent.match, RegexMatch)], shard_size)
+
+    @staticmethod
+    def _prepare(a, pattern, parsed, target):
+        """把第 a 个正则改写成可以合并的分支；不能合并时 groups 为 None"""
+        mergeable = (not parsed.state.flags & ~re.UNICODE
+                     and not any(op in _GROUP_REFS or (op == sre_constants.SUBPATTERN and _scoped_flags(av))
+                                 for op, av in _walk(parsed.data)))
+        if not mergeable:
+            return _Alternative(pattern, [target], None)
+
+        groups = {}
+
+        def rename(m):
+            new = f"_a{a}_{len(groups)}"
+            groups[new] = m.group(2)
+            return f"{m.group(1)}(?P<{new}>"
+
+        rewritten = NAMED_GROUP_RE.sub(rename, pattern)
+        if sorted(groups.values()) != sorted(parsed.state.groupdict):
+            return _Alternative(pattern, [target], None)
+        return _Alternative(rewritten, [target], groups)
+
+    def _compile_shard(self, members, first):
+        combined = '|'.join(f"(?P<_a{a}>{self.alternatives[a].pattern})" for a in members)
+        return re.compile(f"(?=[{''.join(sorted(first))}])(?:{combined})")
+
+    def _hit(self, a, m):
+        groups = self.alternatives[a].groups
+        if groups is None:
+            slots = {k: v for k, v in m.groupdict().items() if v is not None}
+        else:
+            slots = {slot: m.group(g) for g, slot in groups.items() if m.group(g) is not None}
+        return [RegexHit(self.targets[t], slots, m.span()) for t in self.alternatives[a].targets]
+
+    def candidates(self, text: str):
+        """预过滤：字面子串出现在 text 中的正则"""
+        found = set()
+        for pid in set(self.prefilter.search(text)):
+            found.update(self.owners[pid])
+        return found
+
+    def first(self, text: str) -> List[RegexHit]:
+        """一次扫描：返回最先命中的那个正则的全部目标"""
+        best = None
+        for a in self.candidates(text):
+            m = self.compiled[a].search(text)
+            if m is not None and (best is None or (m.start(), a) < best[0]):
+                best = ((m.start(), a), m)
+        for shard in self.shards:
+            m = shard.search(text)
+            if m is not None:
+                a = int(m.lastgroup[2:])
+                if best is None or (m.start(), a) < best[0]:
+                    best = ((m.start(), a), m)
+        for a in self.solo:
+            m = self.compiled[a].search(text)
+            if m is not None and (best is None or (m.start(), a) < best[0]):
+                best = ((m.start(), a), m)
+        if best is None:
+            return []
+        (_, a), m = best
+        return self._hit(a, m)
+
+    def search(self, text: str) -> Iterator[RegexHit]:
+        first = self.first(text)
+        yield from first
+        if not first:
+            return
+        # 第一个候选被调用方拒绝时才会走到这里：逐个检查其余正则（不常见的慢路径）
+        rest = []
+        for a, compiled in enumerate(self.compiled):
+            m = compiled.search(text)
+            if m is not None:
+                rest.append(((m.start(), a), m))
+        rest.sort(key=lambda item: item[0])
+        for (_, a), m in rest[1:]:
+            yield from self._hit(a, m)
+
+    def __bool__(self):
+        return bool(self.targets)
+
+
+def naive_search(entries, text) -> Optional[RegexHit]:
+    """逐个意图调用 re.search 的朴素实现，作为基准对照：返回命中位置最靠前（其次加载顺序靠前）的目标"""
+    best = None
+    for t, (pattern, target) in enumerate(entries):
+        m = re.search(pattern, text)
+        if m is not None and (best is None or (m.start(), t) < best[0]):
+            best = ((m.start(), t), RegexHit(target, {k: v for k, v in m.groupdict().items() if v is not None},
+                                             m.span()))
+    return best and best[1]
@@ -0,0 +1,180 @@
+# test_interpreter.py
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from lexer import Lexer
+from parser import Parser
+from interpreter import Interpreter, BundleInterpreter, Context, import_final_version
+from llm_reply import LlmReplier
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), 'scripts')
+
+# 只用关键词和正则意图，不需要 LLM 和 API Key
+REFUND_DSL = '''
+intent start_refund {
+    match: keywords: ["退款"]
+    context: !has(order_id)
+    actions: [
+        ask("order_id", "请提供订单号")
+    ]
+}
+
+intent refund_with_id {
+    match: /订单(?P<order_id>\\d{6})/
+    context: has(order_id)
+    actions: [
+        call_api("refund_service", {"order_id": order_id}),
+        goto(refund_status)
+    ]
+}
+
+intent refund_status {
+    match: keywords: ["进度"]
+    context: has(order_id)
+    actions: [
+        if (has(api_result)) {
+            actions: [reply("订单 {{order_id}} {{api_result.status}}")]
+        } else {
+            actions: [reply("订单 {{order_id}} 还没有提交退款")]
+        }
+    ]
+}
+
+intent note {
+    match: keywords: ["备注"]
+    context: has(order_id)
+    actions: [
+        call_api("note_service", {"text": "备注"})
+    ]
+}
+'''
+
+INPUTS = ["我要退款", "进度如何", "订单123456", "进度如何", "备注一下", "随便说说"]
+
+
+def refund_service(args):
+    return {"status": f"退款已受理（{args['order_id']}）"}
+
+
+def converse(interpreter, inputs):
+    async def main():
+        context = Context()
+        return [await interpreter.run(text, context) for text in inputs]
+    return asyncio.run(main())
+
+
+class TestInterpreter(unittest.TestCase):
+    """.dsl 源文件和由它编译出的 bundle 都在 IR 运行时上执行，回复一致"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, 'refund.dsl')
+        with open(self.source, 'w', encoding='utf-8') as f:
+            f.write(REFUND_DSL)
+        self.bundle = os.path.join(tmp.name, 'refund.bundle')
+        import_final_version('bundle').compile_bundle([self.source], self.bundle)
+
+    def test_source_and_bundle_reply_the_same(self):
+        functions = {"refund_service": refund_service}
+        program = Parser(Lexer(REFUND_DSL).tokenize()).parse_program()
+        from_source = converse(Interpreter(program, functions), INPUTS)
+        from_bundle = converse(BundleInterpreter(self.bundle, functions), INPUTS)
+        self.assertEqual(from_source, from_bundle)
+        self.assertEqual(from_source, [
+            "请提供订单号",
+            "抱歉，我不太明白您的意思。",         # 没有订单号时 refund_status 的 context 不满足
+            "订单 123456 退款已受理（123456）",  # call_api 的结果写入 api_result，goto 继续执行目标意图
+            "订单 123456 退款已受理（123456）",
+            "已收到您的请求。",                    # 没有任何回复时的默认回复
+            "抱歉，我不太明白您的意思。",
+        ])
+
+    def test_unimplemented_service_is_mocked_into_api_result(self):
+        program = Parser(Lexer(REFUND_DSL).tokenize()).parse_program()
+        replies = converse(Interpreter(program), ["订单654321"])
+        self.assertEqual(replies, ["订单 654321 {{api_result.status}}"])
+
+
+def load_script(name, functions=None):
+    with open(os.path.join(SCRIPTS_DIR, name), encoding='utf-8') as f:
+        program = Parser(Lexer(f.read()).tokenize()).parse_program()
+    return Interpreter(program, functions)
+
+
+class TestScripts(unittest.TestCase):
+    """scripts/ 下的脚本（点号变量、不加引号的键、switch）可以加载，llm_reply 经假的流式后端逐段输出"""
+
+    def setUp(self):
+        self.prompts = []
+        self.api_calls = []
+
+    def fake_stream(self, prompt, max_tokens, session, deadline):
+        self.prompts.append(prompt)
+        yield "很抱歉"
+        yield "，已为您记录"
+
+    def service(self, result):
+        def call(args):
+            self.api_calls.append(args)
+            return result
+        return call
+
+    def turn(self, interpreter, llm_intent, slots, text="我要投诉"):
+        async def detect_llm_intent(user_input, session=None):
+            return llm_intent
+
+        interpreter.detect_llm_intent = detect_llm_intent
+        interpreter.replier = LlmReplier(self.fake_stream)
+        context = Context()
+        for field, value in slots.items():
+            context.set(field, value)
+        chunks = []
+        reply = asyncio.run(interpreter.run(text, context, chunks.append))
+        return reply, chunks
+
+    def test_complaint_without_ticket_streams_llm_reply(self):
+        interpreter = load_script('complaint.dsl', {"complaint_service": self.service({})})
+        reply, chunks = self.turn(interpreter, "make_complaint", {"order_id": "123456", "complaint_detail": "快递丢了"})
+        self.assertEqual(chunks, ["很抱歉", "，已为您记录"])
+        self.assertEqual(reply, "很抱歉，已为您记录")
+        self.assertEqual(self.prompts, ["很抱歉给您带来不便。快递丢了 我们已记录您的反馈，并会尽快处理。"])
+        # ctx.order_id 取上下文里的槽位
+        self.assertEqual(self.api_calls[0]["order_id"], "123456")
+        self.assertEqual(self.api_calls[0]["complaint"], "快递丢了")
+
+    def test_complaint_with_ticket_replies_without_llm(self):
+        interpreter = load_script('complaint.dsl', {"complaint_service": self.service({"ticket_id": "T42"})})
+        reply, chunks = self.turn(interpreter, "make_complaint", {"order_id": "123456", "complaint_detail": "快递丢了"})
+        self.assertIn("工单号为 T42", reply)
+        self.assertEqual((chunks, self.prompts), ([], []))
+
+    def test_refund_switch(self):
+        slots = {"order_id": "123456", "refund_reason": "发错货"}
+        interpreter = load_script('refund.dsl', {"refund_service": self.service({"status": "approved"})})
+        reply, _ = self.turn(interpreter, "request_refund", slots, "退款")
+        self.assertIn("已通过", reply)
+
+        interpreter = load_script('refund.dsl', {"refund_service": self.service(
+            {"status": "rejected", "message": "超过退款期限"})})
+        reply, chunks = self.turn(interpreter, "request_refund", slots, "退款")
+        self.assertEqual(reply, "很抱歉，已为您记录")
+        self.assertEqual(len(chunks), 2)
+        self.assertIn("原因：超过退款期限。", self.prompts[0])
+
+    def test_scripts_compile_to_bundle(self):
+        bundle = import_final_version('bundle')
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('complaint.dsl', 'logistics.dsl', 'refund.dsl'):
+                path = os.path.join(tmp, name + '.bundle')
+                bundle.compile_bundle([os.path.join(SCRIPTS_DIR, name)], path)
+                BundleInterpreter(path)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
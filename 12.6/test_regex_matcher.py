@@ -0,0 +1,104 @@
+# test_regex_matcher.py
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from regex_matcher import RegexIndex, UnsafePatternError, naive_search, validate_pattern
+
+# 覆盖三条路径：字面子串预过滤、合并分片、单独 search（分组引用 / 全局或局部标志 / 前后断言）
+CATALOG = [
+    (r"订单(?P<order_id>\d{6})", "order"),
+    (r"退款|退货", "refund"),
+    (r"(?P<code>[A-Z]{2}\d{4,8})", "code"),
+    (r"(?P<phone>1[3-9]\d{9})", "phone"),
+    (r"\d{3}", "digits"),
+    (r"[xy]\d", "xy"),
+    (r"([ab])(?=\1)", "double"),
+    (r"x(?P<n>b)(?=(?P=n))", "xbb"),
+    (r"(?<=#)(?P<tag>\w+)", "tag"),
+    (r"(?![xy])[a-c]\d", "abc_digit"),
+    (r"(?i)hello", "hello"),
+    (r"(?i:sf)(?P<waybill>\d{6})", "waybill"),
+    (r"(a)?(?(1)b|c)d", "conditional"),
+    (r"\d{3}", "digits_again"),  # 相同的正则只编译一次，两个目标都是候选
+]
+
+INPUTS = [
+    "", "订单123456", "我要退款", "AB12345 再说", "手机 13812345678", "x1", "aab", "xbb", "xb",
+    "#标签 内容", "c7", "x7", "HeLLo", "SF123456", "sf654321", "bd", "cd", "ad", "abd",
+    "随便说点什么", "订单12345", "aa 123 xbb", "y2 退货 订单654321",
+]
+
+
+def first_hit(index, text):
+    return next(index.search(text), None)
+
+
+class TestRegexIndex(unittest.TestCase):
+    """RegexIndex 一次扫描的结果与逐个 re.search 一致"""
+
+    def assert_same_as_naive(self, entries, inputs, **kwargs):
+        index = RegexIndex(entries, **kwargs)
+        for text in inputs:
+            self.assertEqual(first_hit(index, text), naive_search(entries, text), text)
+        return index
+
+    def test_matches_naive_search(self):
+        index = self.assert_same_as_naive(CATALOG, INPUTS)
+        self.assertTrue(index.shards)
+        self.assertTrue(index.solo)
+
+    def test_matches_naive_search_with_small_shards(self):
+        self.assert_same_as_naive(CATALOG, INPUTS, shard_size=1)
+        self.assert_same_as_naive(CATALOG, INPUTS, shard_size=2)
+
+    def test_random_inputs(self):
+        rng = random.Random(20251219)
+        alphabet = "abcxyAB#SFsf订单退款0123456789 "
+        inputs = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20))) for _ in range(500)]
+        self.assert_same_as_naive(CATALOG, inputs, shard_size=3)
+
+    def test_group_refs_inside_lookarounds_are_not_merged(self):
+        for pattern in (r"([ab])(?=\1)", r"x(?P<n>b)(?=(?P=n))", r"(a)(?!\1)\w"):
+            entries = [(r"\d{3}", "digits"), (pattern, "ref")]
+            index = self.assert_same_as_naive(entries, ["aab", "xbb", "ab", "a1 123"])
+            self.assertIsNone(index.alternatives[1].groups, pattern)
+
+    def test_inline_flags(self):
+        entries = [(r"(?i:abc)\d", "scoped"), (r"x(?i:Y)z", "middle"), (r"(?i)hello", "global"),
+                   (r"(?-i:Q)\d", "unset"), (r"[A-Z]\d{3}", "plain")]
+        self.assert_same_as_naive(entries, ["ABC1", "abc1", "xyz", "xYz", "HELLO", "Q1", "q1", "A123", "a123"])
+
+    def test_search_continues_after_first_hit(self):
+        index = RegexIndex(CATALOG)
+        targets = [hit.target for hit in index.search("aa 123 xbb")]
+        self.assertEqual(targets[:3], ["double", "digits", "digits_again"])
+        self.assertIn("xbb", targets)
+
+
+class TestValidatePattern(unittest.TestCase):
+    """加载时拒绝无法编译和有灾难性回溯风险的正则"""
+
+    def test_rejects_catastrophic_patterns(self):
+        for pattern in (r"(a+)+$", r"(\w*)*x", r"(.|x)+y", r"(?=(a+)+$)", r"(?!(\d+)*z)",
+                        r"(.*a){12}$", r"(?:\s*\w+){2,5}!", r"(?<=(?:b)?)(a|a)+c"):
+            with self.assertRaises(UnsafePatternError, msg=pattern):
+                validate_pattern(pattern)
+        with self.assertRaises(UnsafePatternError):
+            RegexIndex([(r"\d{3}", "ok"), (r"(?=(a+)+$)", "bad")])
+
+    def test_rejects_invalid_pattern(self):
+        with self.assertRaisesRegex(UnsafePatternError, "无法编译"):
+            validate_pattern(r"(", "broken")
+
+    def test_accepts_bounded_patterns(self):
+        for pattern in (r"(?P<order_id>\d{6})", r"(\d{3}){2}", r"(?:a|b){3}", r"(a{1,3}){1,3}",
+                        r"订单.*(?P<order_id>\d+)", r"(?=\d{6})\d+"):
+            validate_pattern(pattern)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
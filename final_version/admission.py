@@ -0,0 +1,148 @@
+# admission.py
+# 对话前端的准入控制：同时处理的轮次不超过 max_in_flight，其余进入有界的 FIFO 队列。
+# 队列已满、预计排队时间超过排队 SLO、或者排队途中超过 SLO 的轮次直接拒绝，
+# 回复规则文件里 system/busy 规则的模板（见 turn_handler.busy_reply），不让请求堆在 LLM 后面超时。
+# 排队 SLO = 单轮目标耗时 - 近期单轮处理耗时的 p95（主要是 LLM 耗时），LLM 变慢时自动收紧。
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from llm_policy import LatencyTracker
+from logger import setup_logger
+from turn_handler import handle_turn, busy_reply
+
+MAX_IN_FLIGHT = 8       # 同时处理的轮次上限
+MAX_QUEUE = 32          # 排队轮次上限
+TURN_SLO = 8.0          # 单轮总耗时（排队 + 处理）目标，秒
+MIN_QUEUE_WAIT = 0.1    # 排队时间预算的上下限，秒
+MAX_QUEUE_WAIT = 5.0
+
+logger = setup_logger()
+
+
+class Overloaded(Exception):
+    """队列已满或排队超过 SLO，本轮被拒绝"""
+
+
+class AdaptiveSLO:
+    """
+    根据观测到的单轮处理耗时计算排队时间预算：turn_slo - p95，限制在 [min_wait, max_wait]。
+    还没有观测数据时按 max_wait。
+    """
+
+    def __init__(self, turn_slo=TURN_SLO, min_wait=MIN_QUEUE_WAIT, max_wait=MAX_QUEUE_WAIT, window=200):
+        self.turn_slo = turn_slo
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.service = LatencyTracker(window)
+
+    def observe(self, seconds):
+        self.service.add(seconds)
+
+    def queue_budget(self):
+        p95 = self.service.percentile(95)
+        if p95 is None:
+            return self.max_wait
+        return min(self.max_wait, max(self.min_wait, self.turn_slo - p95))
+
+    def typical_service(self):
+        """单轮处理耗时的 p50，用来估计排队时间；没有数据时为 None"""
+        return self.service.percentile(50)
+
+
+class AdmissionController:
+    """
+    有界并发 + 有界队列。用法：
+
+        admission = AdmissionController(max_in_flight=4)
+        replies = admission.handle(runtime, session, user_input, classify, predictor)
+
+    handle 在拿到处理名额后调用 handle_turn；被拒绝时返回 busy_reply，调用方不需要区分。
+    只关心名额时可以直接用 with admission.slot(): ...，被拒绝时抛 Overloaded。
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, slo=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.slo = slo or AdaptiveSLO()
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = deque()
+        self.waits = LatencyTracker()
+        self.metrics = {"admitted": 0, "shed_queue_full": 0, "shed_slo": 0, "max_queue_depth": 0}
+
+    def _shed(self, reason, message):
+        self.metrics[reason] += 1
+        raise Overloaded(message)
+
+    def _acquire(self):
+        with self.cond:
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                self.metrics["admitted"] += 1
+                self.waits.add(0.0)
+                return
+            if len(self.waiting) >= self.max_queue:
+                self._shed("shed_queue_full", f"排队轮次已达上限 {self.max_queue}")
+            budget = self.slo.queue_budget()
+            # 前面的轮次按 max_in_flight 个一批处理，每批约一个 p50 处理耗时
+            service = self.slo.typical_service()
+            if service is not None and (len(self.waiting) // self.max_in_flight + 1) * service > budget:
+                self._shed("shed_slo", f"预计排队超过 {budget:.2f}s")
+
+            ticket = object()
+            enqueued = time.monotonic()
+            deadline = enqueued + budget
+            self.waiting.append(ticket)
+            self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], len(self.waiting))
+            try:
+                while not (self.waiting[0] is ticket and self.in_flight < self.max_in_flight):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._shed("shed_slo", f"排队超过 {budget:.2f}s")
+                    self.cond.wait(remaining)
+            except BaseException:
+                self.waiting.remove(ticket)
+                self.cond.notify_all()
+                raise
+            self.waiting.popleft()
+            self.in_flight += 1
+            self.metrics["admitted"] += 1
+            self.waits.add(time.monotonic() - enqueued)
+            self.cond.notify_all()  # 还有空闲名额时，下一个排头也可以进入
+
+    def _release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self._acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.slo.observe(time.monotonic() - start)
+            self._release()
+
+    def handle(self, runtime, session, user_input, classify, predictor=None, turn_log=None):
+        start = time.perf_counter()
+        try:
+            with self.slot():
+                return handle_turn(runtime, session, user_input, classify, predictor, turn_log)
+        except Overloaded as e:
+            logger.warning(f"🚦 系统繁忙（{e}），本轮直接回复繁忙提示")
+            return busy_reply(runtime, session, turn_log, user_input, time.perf_counter() - start)
+
+    def snapshot(self):
+        """指标快照：处理中 / 排队中的轮次数，放行和拒绝次数，排队耗时 p50 / p95，当前排队预算（秒）"""
+        with self.cond:
+            data = dict(self.metrics)
+            data["in_flight"] = self.in_flight
+            data["queue_depth"] = len(self.waiting)
+        data["wait_p50"] = self.waits.percentile(50)
+        data["wait_p95"] = self.waits.percentile(95)
+        data["queue_budget"] = self.slo.queue_budget()
+        return data
@@ -0,0 +1,213 @@
+# analyzer.py
+# 加载时对 IR 做静态检查：
+#   malformed-line     源文件中被忽略的行（来自 load_dsl）
+#   shadowed-rule      同一分发键下被前面的入口完全遮蔽、永远不会匹配的规则
+#   undefined-target   goto 的目标、[slot] 校验失败后的 invalid / unknown 状态不存在
+#   unset-placeholder  模板里的 {{变量}} 没有任何 ask / wait / call 或槽位会写入
+#   unreachable-code   入口中执行不到的动作
+#   cycle              一轮之内不经过 ask / wait 就能绕回来的循环
+# 每项检查都只遍历一次指令或分发表，规则再多也是线性时间。
+import sys
+from typing import NamedTuple
+
+from ir import (
+    SAY, SAY_TEMPLATE, ASK, WAIT, CALL, CALL_API,
+    LLM_REPLY, JUMP, JUMP_IF_FALSE, HALT, load_ir,
+)
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+class Diagnostic(NamedTuple):
+    level: str
+    code: str
+    message: str
+
+    def __str__(self):
+        return f"[{self.level}] {self.code}: {self.message}"
+
+
+def successors(code, pc):
+    """
+    返回 (本轮内的后继地址, 下一轮才会执行的后继地址)。
+    ASK 只有在“槽位已有值就跳过”时才会继续往下走；WAIT 要等下一轮输入。
+    """
+    op, a, b, c = code[pc]
+    if op == HALT:
+        return (), ()
+    if op == JUMP:
+        return ((a,) if a >= 0 else ()), ()
+    if op == JUMP_IF_FALSE:
+        return (pc + 1, b), ()
+    if op == WAIT:
+        return (), (pc + 1,)
+    if op == ASK:
+        return ((pc + 1,) if c else ()), ()
+    return (pc + 1,), ()
+
+
+def entry_owners(program):
+    """每条指令属于哪个入口（入口的代码是连续的一段）"""
+    owners = [0] * len(program.code)
+    entries = program.entries
+    for i, entry in enumerate(entries):
+        end = entries[i + 1].start if i + 1 < len(entries) else len(program.code)
+        owners[entry.start:end] = [i] * (end - entry.start)
+    return owners
+
+
+def check_shadowed(program):
+    diagnostics = []
+    entries = program.entries
+    for key, indices in program.dispatch.items():
+        guards = {}
+        catch_all = None
+        for i in indices:
+            entry = entries[i]
+            shadow = catch_all if catch_all is not None else guards.get(entry.guard)
+            if shadow is not None:
+                diagnostics.append(Diagnostic(
+                    WARNING, 'shadowed-rule',
+                    f"[{entry.name}] 永远不会匹配：被前面的 [{entries[shadow].name}] 遮蔽"))
+                continue
+            guards[entry.guard] = i
+            if entry.guard is None:
+                catch_all = i
+    return diagnostics
+
+
+def check_targets(program, owners):
+    return [Diagnostic(ERROR, 'undefined-target',
+                       f"[{program.entries[owners[addr]].name}] 中 goto 的"
+                       f"{'标签' if kind == 'label' else '意图'} '{target}' 不存在")
+            for addr, kind, target in program.unresolved]
+
+
+def check_slot_targets(program):
+    diagnostics = []
+    for name, spec in program.slots.items():
+        for kind in ('invalid', 'unknown'):
+            target = spec.get(kind)
+            if target and ('state', *target) not in program.dispatch:
+                diagnostics.append(Diagnostic(
+                    ERROR, 'undefined-target', f"[slot {name}] 的 {kind} 状态 {target[0]}/{target[1]} 没有对应的规则"))
+    return diagnostics
+
+
+def check_placeholders(program, owners, slots=()):
+    produced = set(slots)
+    for op, a, b, c in program.code:
+        if op in (ASK, WAIT):
+            produced.add(a)
+        elif op in (CALL, CALL_API) and c:
+            produced.add(c)
+
+    diagnostics = []
+    reported = set()
+    for addr, (op, a, b, c) in enumerate(program.code):
+        if op not in (SAY_TEMPLATE, LLM_REPLY):
+            continue
+        for var, _ in a:
+            if var is None or var.partition('.')[0] in produced:
+                continue
+            entry = program.entries[owners[addr]]
+            if (entry.name, var) not in reported:
+                reported.add((entry.name, var))
+                diagnostics.append(Diagnostic(
+                    WARNING, 'unset-placeholder',
+                    f"[{entry.name}] 中的 {{{{{var}}}}} 没有任何 ask / 槽位会写入"))
+    return diagnostics
+
+
+def check_reachability(program, owners):
+    code = program.code
+    reached = bytearray(len(code))
+    stack = [entry.start for entry in program.entries]
+    for pc in stack:
+        reached[pc] = 1
+    while stack:
+        now, later = successors(code, stack.pop())
+        for nxt in now + later:
+            if not reached[nxt]:
+                reached[nxt] = 1
+                stack.append(nxt)
+
+    # 只报告用户写的动作；HALT / JUMP 和前端补上的默认回复执行不到是正常的
+    counts = {}
+    for addr, (op, a, b, c) in enumerate(code):
+        if reached[addr] or op in (HALT, JUMP) or (op == SAY and c):
+            continue
+        counts[owners[addr]] = counts.get(owners[addr], 0) + 1
+    return [Diagnostic(WARNING, 'unreachable-code',
+                       f"[{program.entries[i].name}] 中有 {n} 个动作永远执行不到")
+            for i, n in counts.items()]
+
+
+def check_cycles(program, owners):
+    """在“一轮之内”的控制流图上找回边（迭代 DFS，三色标记）"""
+    code = program.code
+    WHITE, GREY, BLACK = 0, 1, 2
+    color = bytearray(len(code))
+    roots = [entry.start for entry in program.entries]
+    roots += [pc + 1 for pc, ins in enumerate(code) if ins[0] == WAIT]
+
+    diagnostics = []
+    reported = set()
+    for root in roots:
+        if color[root] != WHITE:
+            continue
+        color[root] = GREY
+        stack = [(root, iter(successors(code, root)[0]))]
+        while stack:
+            pc, it = stack[-1]
+            nxt = next(it, None)
+            if nxt is None:
+                color[pc] = BLACK
+                stack.pop()
+            elif color[nxt] == WHITE:
+                color[nxt] = GREY
+                stack.append((nxt, iter(successors(code, nxt)[0])))
+            elif color[nxt] == GREY and nxt not in reported:
+                reported.add(nxt)
+                src, dst = program.entries[owners[pc]], program.entries[owners[nxt]]
+                where = f"[{src.name}]" if src is dst else f"[{src.name}] -> [{dst.name}]"
+                diagnostics.append(Diagnostic(
+                    WARNING, 'cycle', f"{where} 存在不经过 ask / wait 的循环，可能死循环"))
+    return diagnostics
+
+
+def analyze(program, load_errors=(), slots=()):
+    """
+    对 IRProgram 做全部检查，返回 Diagnostic 列表（错误在前）。
+    load_errors 为 load_dsl / load_ir 收集到的诊断信息，slots 为 LLM 可能直接提取的槽位名。
+    """
+    owners = entry_owners(program)
+    diagnostics = [Diagnostic(ERROR, 'malformed-line', message) for message in load_errors]
+    diagnostics += check_targets(program, owners)
+    diagnostics += check_slot_targets(program)
+    diagnostics += check_shadowed(program)
+    diagnostics += check_placeholders(program, owners, slots)
+    diagnostics += check_reachability(program, owners)
+    diagnostics += check_cycles(program, owners)
+    diagnostics.sort(key=lambda d: d.level != ERROR)
+    return diagnostics
+
+
+def log_diagnostics(diagnostics, logger):
+    for d in diagnostics:
+        if d.level == ERROR:
+            logger.error(f"❌ {d.code}: {d.message}")
+        else:
+            logger.warning(f"⚠️ {d.code}: {d.message}")
+
+
+if __name__ == "__main__":
+    # 用法: python analyzer.py rules.txt ../12.5/scripts/refund.dsl ...
+    load_errors = []
+    program = load_ir(sys.argv[1:] or ['rules.txt'], load_errors)
+    diagnostics = analyze(program, load_errors)
+    for d in diagnostics:
+        print(d)
+    print(f"共 {len(program.entries)} 个入口，{len(diagnostics)} 条诊断")
+    sys.exit(1 if any(d.level == ERROR for d in diagnostics) else 0)
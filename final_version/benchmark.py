@@ -0,0 +1,513 @@
+# benchmark.py
+# 本地性能基准，不调用真实 LLM。用法：
+#   python benchmark.py            运行全部基准
+#   python benchmark.py session    只运行指定基准
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from context import Context
+from dsl_loader import load_dsl
+from session import Session, SlotSchema, ROLE_USER, ROLE_ASSISTANT
+from logger import setup_logger
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'rules.txt')
+
+
+def load_rules():
+    with open(RULES_PATH, encoding='utf-8') as f:
+        return load_dsl(f.read())
+
+
+def _measure(build, n):
+    """返回构造 n 个对象后平均每个对象占用的字节数"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [build(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / n
+
+
+def bench_session(n=100_000):
+    """每个会话的内存占用：Context + dict 历史 vs Session"""
+    schema = SlotSchema.from_rules(load_rules())
+    # 会话里的文本通常是各自独立的字符串，这里构造一次后复用，只统计会话结构本身
+    texts = ["查物流，订单号888999", "正在查询 888999 的物流信息..."]
+
+    def old_session(i):
+        context = Context()
+        context.set("order_id", "888999")
+        history = [{"role": "user", "content": texts[0]},
+                   {"role": "assistant", "content": texts[1]}]
+        return context, history
+
+    def new_session(i):
+        session = Session(schema)
+        session.set("order_id", "888999")
+        session.add_message(ROLE_USER, texts[0])
+        session.add_message(ROLE_ASSISTANT, texts[1])
+        return session
+
+    old = _measure(old_session, n)
+    new = _measure(new_session, n)
+    print(f"[session] {n} 个会话: Context+dict 历史 {old:.0f} B/会话, Session {new:.0f} B/会话, "
+          f"节省 {(1 - new / old) * 100:.0f}%")
+
+
+FAKE_LLM_OUTPUT = json.dumps({"scene": "logistics", "status": "ready_to_query",
+                              "slots": {"order_id": "888999"}}, ensure_ascii=False)
+
+
+def fake_classify(user_input):
+    """本地假 LLM：只做解析 / JSON 处理这类纯 CPU 工作，用来衡量 GIL 之外的扩展性"""
+    state = None
+    for _ in range(200):
+        state = json.loads(FAKE_LLM_OUTPUT)
+    return state
+
+
+def bench_worker_pool(turns=20_000, sessions=1_000):
+    """多进程会话池吞吐：1 个进程 vs 多个工作进程"""
+    from worker_pool import WorkerPool
+    from turn_handler import handle_turn
+    from ir import lower_rules
+    from ir_runtime import IRRuntime
+
+    setup_logger().setLevel(logging.WARNING)
+    rules = load_rules()
+    batch = [(f"s{i % sessions}", "查物流，订单号888999") for i in range(turns)]
+
+    runtime = IRRuntime(lower_rules(rules))
+    schema = SlotSchema.from_rules(rules)
+    local = {}
+    start = time.perf_counter()
+    for session_id, text in batch:
+        session = local.get(session_id) or local.setdefault(session_id, Session(schema))
+        handle_turn(runtime, session, text, fake_classify)
+    base = turns / (time.perf_counter() - start)
+    print(f"[worker_pool] 单进程: {base:.0f} 轮/秒")
+
+    for n in sorted({1, 2, 4, os.cpu_count() or 1}):
+        with WorkerPool(rules, classify=fake_classify, num_workers=n) as pool:
+            pool.handle_batch(batch[:n])  # 预热
+            start = time.perf_counter()
+            pool.handle_batch(batch)
+            rate = turns / (time.perf_counter() - start)
+        print(f"[worker_pool] {n} 个工作进程: {rate:.0f} 轮/秒 (x{rate / base:.2f})")
+
+
+def bench_prompt(n=100_000):
+    """system prompt：每次调用重新构建 vs PromptCache"""
+    from qwen_client import PromptCache, build_system_prompt
+    from dsl_loader import RuleSchema
+    rules = load_rules()
+    cache = PromptCache()
+
+    start = time.perf_counter()
+    for _ in range(n):
+        build_system_prompt(RuleSchema(rules))
+    rebuild = (time.perf_counter() - start) / n * 1e6
+
+    start = time.perf_counter()
+    for _ in range(n):
+        cache.get(rules)
+    cached = (time.perf_counter() - start) / n * 1e6
+    print(f"[prompt] 每次重建 {rebuild:.2f} us/次, 缓存（每次比较指纹）{cached:.2f} us/次, "
+          f"prompt 约 {cache.tokens} tokens（规则不变时可命中服务端前缀缓存）")
+
+
+def bench_decoder():
+    """模型输出解析：贪婪 DOTALL 正则 vs raw_decode"""
+    import re
+    from response_decoder import extract_json_object
+
+    def regex_extract(raw_text):
+        m = re.search(r'\{.*\}', raw_text, re.DOTALL)
+        if m:
+            try:
+                return json.loads(m.group())
+            except json.JSONDecodeError:
+                return None
+        return None
+
+    cases = {
+        '正常输出': FAKE_LLM_OUTPUT,
+        '代码块+多个对象': "```json\n" + FAKE_LLM_OUTPUT + "\n```\n备选：" + FAKE_LLM_OUTPUT,
+        '长说明文字': "分析：" * 50_000 + FAKE_LLM_OUTPUT,
+        '未闭合花括号': "{" * 5_000,
+    }
+    for name, text in cases.items():
+        timings = []
+        for fn in (regex_extract, extract_json_object):
+            n = 3 if len(text) > 10_000 or '}' not in text else 10_000
+            start = time.perf_counter()
+            for _ in range(n):
+                result = fn(text)
+            timings.append((time.perf_counter() - start) / n * 1e6)
+        print(f"[decoder] {name}: 正则 {timings[0]:.1f} us, raw_decode {timings[1]:.1f} us")
+
+    # 超长输出只测 raw_decode（没有 '}' 时贪婪正则是平方级的）：输入放大 10 倍，耗时最多放大约 10 倍
+    long_cases = {
+        '连续 "{"': lambda n: "{" * n,
+        '长说明+JSON+多余 "}"': lambda n: "说明" * n + FAKE_LLM_OUTPUT + "}" * n,
+    }
+    for name, make in long_cases.items():
+        timings = []
+        for n in (20_000, 200_000):
+            text = make(n)
+            start = time.perf_counter()
+            extract_json_object(text)
+            timings.append((time.perf_counter() - start) * 1e3)
+        print(f"[decoder] {name}: 2 万 {timings[0]:.2f} ms, 20 万 {timings[1]:.2f} ms "
+              f"（{timings[1] / max(timings[0], 1e-3):.1f} 倍）")
+
+
+def bench_analyzer(sizes=(5_000, 50_000)):
+    """加载时静态检查：规则数放大 10 倍，analyze 耗时也应只放大约 10 倍（线性）"""
+    from ir import lower_rules
+    from analyzer import analyze
+    timings = []
+    for n in sizes:
+        # 每对规则分发键相同，第二条被第一条遮蔽
+        text = "".join(f"[rule]\nscene: s{i % 1000}\nstatus: t{i}\nask: f{i}\n"
+                       f"[rule]\nscene: s{i % 1000}\nstatus: t{i}\nreply: {{{{f{i}}}}}\n"
+                       for i in range(n))
+        program = lower_rules(load_dsl(text))
+        start = time.perf_counter()
+        diagnostics = analyze(program)
+        timings.append(time.perf_counter() - start)
+        print(f"[analyzer] {2 * n} 条规则 / {len(program.code)} 条指令: {timings[-1] * 1000:.1f} ms, "
+              f"{len(diagnostics)} 条诊断")
+    print(f"[analyzer] 规则数 x{sizes[-1] // sizes[0]}，耗时 x{timings[-1] / max(timings[0], 1e-6):.1f}")
+
+
+def _generate_rules_file(path, n):
+    """生成按 SKU 展开的大规则文件，每条约 150 字节"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            f.write(f"[rule]\nscene: sku_{i}\nstatus: price\ndesc: 询问商品 {i} 的价格\n"
+                     f"reply: \"商品 SKU{i:08d} 当前售价 {i % 997}.00 元，库存充足\"\n\n")
+
+
+def _load_full(path):
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for _ in load_dsl(f.read()))
+
+
+def _load_streaming(path):
+    from dsl_loader import iter_dsl_file
+    return sum(1 for _ in iter_dsl_file(path))
+
+
+def _peak_rss_child(conn, loader, path):
+    import resource
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    count = loader(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((count, elapsed, (peak - base) * 1024))  # Linux 下 ru_maxrss 单位是 KB
+    conn.close()
+
+
+def bench_loader(n=500_000):
+    """
+    大规则文件加载：f.read() + load_dsl vs mmap 流式加载（逐条处理不保留）。
+    流式加载的 RSS 里包含 mmap 映射进来的文件页（页缓存，内存紧张时内核可以直接回收），
+    Python 对象本身的占用只有单条规则大小。
+    """
+    import tempfile
+    import multiprocessing as mp
+    ctx = mp.get_context('fork')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'rules.txt')
+        _generate_rules_file(path, n)
+        size = os.path.getsize(path) / 2**20
+        for name, loader in (("load_dsl", _load_full), ("iter_dsl_file", _load_streaming)):
+            # 每种方式在独立的子进程里测量，峰值 RSS 互不影响
+            parent_conn, child_conn = ctx.Pipe()
+            p = ctx.Process(target=_peak_rss_child, args=(child_conn, loader, path))
+            p.start()
+            count, elapsed, rss = parent_conn.recv()
+            p.join()
+            print(f"[loader] {name}: {size:.0f} MB / {count} 条规则, 耗时 {elapsed:.2f} s, "
+                  f"峰值 RSS 增量 {rss / 2**20:.1f} MB")
+
+
+def bench_bundle(n=100_000):
+    """启动加载：解析规则源文件并编译成 IR vs 读取预编译 bundle"""
+    import tempfile
+    from dsl_loader import iter_dsl_file
+    from ir import lower_rules
+    from bundle import compile_bundle, read_bundle
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'rules.txt')
+        path = os.path.join(tmp, 'rules.bundle')
+        _generate_rules_file(source, n)
+        compile_bundle([source], path)
+
+        start = time.perf_counter()
+        lower_rules(iter_dsl_file(source))
+        parse = time.perf_counter() - start
+        start = time.perf_counter()
+        read_bundle(path)
+        load = time.perf_counter() - start
+        print(f"[bundle] {n} 条规则: 源文件 {os.path.getsize(source) / 2**20:.1f} MB 解析 {parse:.2f} s, "
+              f"bundle {os.path.getsize(path) / 2**20:.1f} MB 加载 {load:.2f} s (x{parse / load:.1f})")
+
+
+# 模拟 LLM 标注过的对话：(模板, scene, status, 是否带槽位)；{id} 为订单号，{x} 为随机填充
+LABELED_TEMPLATES = [
+    ("{x}帮我查一下物流", "logistics", "need_order_id", False),
+    ("我的快递到哪了{x}", "logistics", "need_order_id", False),
+    ("包裹怎么还没到{x}", "logistics", "need_order_id", False),
+    ("查物流，订单号{id}", "logistics", "ready_to_query", True),
+    ("{x}快递单号是{id}帮我看看", "logistics", "ready_to_query", True),
+    ("订单{id}的包裹到哪了", "logistics", "ready_to_query", True),
+    ("查物流单号SF{id}{x}", "logistics", "invalid_order_id", True),
+    ("我要投诉{x}", "complaint", "need_type", False),
+    ("{x}我想投诉一下", "complaint", "need_type", False),
+    ("投诉快递员态度太差了{x}", "complaint", "recorded", True),
+    ("我要投诉商品质量有问题{x}", "complaint", "recorded", True),
+    ("我要退款{x}", "refund", "need_reason", False),
+    ("{x}申请退钱", "refund", "need_reason", False),
+    ("退款，因为发错货了{x}", "refund", "processing", True),
+    ("不想要了申请退款{x}", "refund", "processing", True),
+    ("你好{x}", "other", "greeting", False),
+    ("在吗{x}", "other", "greeting", False),
+    ("今天天气怎么样{x}", "other", "unknown", False),
+    ("{x}给我讲个笑话", "other", "unknown", False),
+]
+FILLERS = ["", "", "请问", "麻烦", "谢谢", "急", "。", "？", "啊", "呢", "哈"]
+
+
+def labeled_turns(n, seed=0):
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(n):
+        template, scene, status, has_slots = rng.choice(LABELED_TEMPLATES)
+        text = template.format(x=rng.choice(FILLERS), id=rng.randint(100000, 999999))
+        samples.append((text, scene, status, has_slots))
+    return samples
+
+
+def bench_intent_model(n=5_000):
+    """本地意图分类器：训练耗时、对 LLM 标注的准确率、单条 / 批量打分耗时"""
+    from intent_model import train, evaluate, format_report
+
+    samples = labeled_turns(n)
+    n_test = n // 5
+    start = time.perf_counter()
+    model = train(samples[n_test:])
+    print(f"[intent_model] 训练 {n - n_test} 条 {time.perf_counter() - start:.2f} s, {len(model.labels)} 个类别")
+    print(f"[intent_model] {format_report(evaluate(model, samples[:n_test]))}")
+
+
+def _offered_load(handle, rate, n, seed):
+    """按泊松到达（平均每秒 rate 个）开启 n 个轮次，返回每轮 (回复, 耗时)"""
+    import threading
+    rng = random.Random(seed)
+    results = [None] * n
+
+    def turn(i):
+        start = time.perf_counter()
+        replies = handle()
+        results[i] = (replies, time.perf_counter() - start)
+
+    threads = []
+    for i in range(n):
+        t = threading.Thread(target=turn, args=(i,))
+        t.start()
+        threads.append(t)
+        time.sleep(rng.expovariate(rate))
+    for t in threads:
+        t.join()
+    return results
+
+
+def bench_admission(upstream=4, llm_latency=0.02, n=300, loads=(0.5, 1.0, 2.0, 4.0)):
+    """
+    过载测试：假 LLM 最多同时处理 upstream 个请求、每个耗时 llm_latency，处理能力约 upstream / llm_latency 轮/秒。
+    负载超过处理能力后，不做准入控制时排队无限增长；准入控制下延迟有上界，多出的请求回复繁忙提示。
+    """
+    import threading
+    from admission import AdmissionController, AdaptiveSLO
+    from ir import lower_rules
+    from ir_runtime import IRRuntime
+    from turn_handler import handle_turn
+
+    setup_logger().setLevel(logging.ERROR)
+    rules = load_rules()
+    runtime = IRRuntime(lower_rules(rules))
+    schema = SlotSchema.from_rules(rules)
+    llm = threading.Semaphore(upstream)
+
+    def classify(text):
+        with llm:
+            time.sleep(llm_latency)
+        return {"scene": "logistics", "status": "need_order_id", "slots": {}}
+
+    capacity = upstream / llm_latency
+    for load in loads:
+        admission = AdmissionController(max_in_flight=upstream, max_queue=upstream * 4,
+                                        slo=AdaptiveSLO(turn_slo=llm_latency * 5, min_wait=llm_latency,
+                                                        max_wait=llm_latency * 4))
+        runs = {
+            "无准入控制": lambda: handle_turn(runtime, Session(schema), "查物流", classify),
+            "准入控制": lambda: admission.handle(runtime, Session(schema), "查物流", classify),
+        }
+        for name, handle in runs.items():
+            results = _offered_load(handle, capacity * load, n, seed=int(load * 10))
+            latencies = sorted(latency for _, latency in results)
+            busy = sum(1 for replies, _ in results if "请稍后再试" in replies[0])
+            print(f"[admission] 负载 x{load:.1f}（{capacity * load:.0f} 轮/秒）{name}: "
+                  f"p50 {latencies[n // 2] * 1e3:.0f} ms, p99 {latencies[int(n * 0.99)] * 1e3:.0f} ms, "
+                  f"最大 {latencies[-1] * 1e3:.0f} ms, 繁忙 {busy / n:.0%}")
+
+
+def bench_turn_log(n=2_000_000):
+    """列式对话日志：逐轮追加写入的吞吐，以及 memmap 读取后各项统计的耗时"""
+    import tempfile
+    from turn_log import TurnLogWriter, TurnLog
+    from turn_query import rule_hits, unmatched_rates, latency_percentiles, latency_by_rule
+
+    rng = random.Random(0)
+    pairs = [(rule.get('scene'), rule.get('status')) for rule in load_rules()]
+    unmatched = [("invoice", "need_title"), ("refund", "partial")]  # 没有对应规则的组合
+    pairs += unmatched
+    rows = [(rng.choice(pairs), rng.expovariate(2.0), rng.choice(FILLERS)) for _ in range(10_000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'turn_log')
+        start = time.perf_counter()
+        with TurnLogWriter(path) as writer:
+            for i in range(n):
+                (scene, status), latency, text = rows[i % len(rows)]
+                rule = None if (scene, status) in unmatched else f"{scene}/{status}"
+                writer.append(latency + 0.01, latency, scene, status, rule, text)
+        write = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        print(f"[turn_log] 写入 {n} 轮: {n / write:.0f} 轮/秒, {size / n:.1f} B/轮")
+
+        log = TurnLog(path)
+        for name, query in [("规则命中", lambda: rule_hits(log)),
+                            ("未匹配率", lambda: unmatched_rates(log)),
+                            ("耗时分位数", lambda: latency_percentiles(log, 'classify_latency')),
+                            ("按规则耗时分位数", lambda: latency_by_rule(log))]:
+            start = time.perf_counter()
+            query()
+            print(f"[turn_log] {name}: {(time.perf_counter() - start) * 1e3:.0f} ms")
+        del log
+
+
+def bench_known_ids(n=10_000_000, lookups=100_000, set_sample=1_000_000):
+    """已知订单号快照：n 个 ID 的构建 / 加载耗时、占用，以及单次查找耗时（对照 Python set）"""
+    import tempfile
+    from slot_validator import KnownIdIndex
+
+    rng = random.Random(0)
+    ids = [str(x) for x in rng.sample(range(10 ** 11, 10 ** 12), n)]  # 12 位订单号
+    probes = [rng.choice(ids) if i % 2 else str(rng.randrange(10 ** 11, 10 ** 12)) for i in range(lookups)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'known_orders.idx')
+        start = time.perf_counter()
+        KnownIdIndex.from_ids(ids).save(path)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = KnownIdIndex.load(path)
+        load = time.perf_counter() - start
+        start = time.perf_counter()
+        results = [p in index for p in probes]
+        hit = time.perf_counter() - start
+        assert all(results[1::2]), "快照漏掉了已知 ID"
+        print(f"[known_ids] {n} 个 ID: 构建 {build:.1f} s, 快照 {os.path.getsize(path) / n:.1f} B/个, "
+              f"加载 {load * 1e3:.2f} ms（memmap）, 查找 {hit / lookups * 1e6:.2f} µs/次")
+        del index
+
+    sample = ids[:set_sample]
+    start = time.perf_counter()
+    tracemalloc.start()
+    known = set(sample)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    load = time.perf_counter() - start
+    print(f"[known_ids] 对照 Python set（{set_sample} 个，ID 字符串已在内存中）: "
+          f"{(size + sum(sys.getsizeof(x) for x in sample)) / set_sample:.0f} B/个, 构建 {load * 1e3:.0f} ms")
+    del known
+
+
+# 入口 -> (命令, 首个提示 / 首行测试输出中的标记)
+STARTUP_ENTRIES = {
+    'main.py': (['-u', 'main.py'], '👤 用户'),
+    'test_unit.py': (['-u', '-m', 'unittest', '-v', 'test_unit'], ' ... '),
+}
+
+
+def _time_to_marker(args, marker, env, timeout=60):
+    """启动子进程，返回从启动到输出中出现 marker 的秒数（stdout / stderr 合并读取）"""
+    import subprocess
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, *args], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = b''
+    try:
+        while marker.encode('utf-8') not in output:
+            chunk = os.read(proc.stdout.fileno(), 4096)
+            if not chunk or time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{' '.join(args)} 没有输出 {marker!r}:\n{output.decode('utf-8', 'replace')}")
+            output += chunk
+        return time.perf_counter() - start
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdin.close()
+        proc.stdout.close()
+
+
+def bench_startup(repeat=5):
+    """各入口冷启动到首个提示的耗时（不设置 DASHSCOPE_API_KEY），以及启动过程中是否导入了 DashScope SDK / NumPy"""
+    import subprocess
+    env = {k: v for k, v in os.environ.items() if k not in ('DASHSCOPE_API_KEY', 'INTENT_LABEL_LOG', 'TURN_LOG')}
+    env['PYTHONIOENCODING'] = 'utf-8'
+    for entry, (args, marker) in STARTUP_ENTRIES.items():
+        times = sorted(_time_to_marker(args, marker, env) for _ in range(repeat))
+        module = entry[:-3]
+        probe = subprocess.run([sys.executable, '-c', f"import sys, {module}; "
+                                "print(*('dashscope' in sys.modules, 'numpy' in sys.modules))"],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               capture_output=True, text=True, check=True).stdout.split()
+        print(f"[startup] {entry}: 首个提示 p50 {times[len(times) // 2] * 1e3:.0f} ms, "
+              f"最快 {times[0] * 1e3:.0f} ms, 导入 dashscope: {probe[0]}, 导入 numpy: {probe[1]}")
+
+
+BENCHMARKS = {
+    'session': bench_session,
+    'worker_pool': bench_worker_pool,
+    'prompt': bench_prompt,
+    'decoder': bench_decoder,
+    'loader': bench_loader,
+    'bundle': bench_bundle,
+    'analyzer': bench_analyzer,
+    'intent_model': bench_intent_model,
+    'admission': bench_admission,
+    'turn_log': bench_turn_log,
+    'known_ids': bench_known_ids,
+    'startup': bench_startup,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,341 @@
+# bundle.py
+# 预编译规则包：把 IRProgram 存成二进制文件，启动时一次读入，不再做词法 / 语法分析。
+#
+# 文件布局（全部为小端，包括各段里的 i32 / u32 数组；大端机器上读写时交换字节序）：
+#   头部   magic 'DSLB' | 版本 u16 | 保留 u16 | 负载 crc32 u32 | 源文件 sha256 (32 字节)
+#   负载   依次为以下各段，每段前有 u32 长度
+#          strings     字符串池：字符偏移表 (u32 数组) + 全部字符串拼接后的 UTF-8
+#          code        指令表：每条指令 4 个 i32 (op, a, b, c)，操作数按 OPERAND_KINDS 编码
+#          templates   模板表：偏移表 + (变量名, 文本) 字符串下标对
+#          entries     入口表：每个入口 6 个 i32 (name, guard, start, match, desc, expect)；入口的分发键从分发表还原
+#          dispatch    分发表：(key 三元组, 入口数, 入口下标...)
+#          unresolved  未解析的 goto：(地址, 类型, 目标名)
+#          sources     编译时的源文件路径，用于检查 bundle 是否过期
+#          slots       [slot] 槽位校验配置（JSON 字符串下标，没有时为 NONE）
+# 分发键 ('state', scene, status) / ('intent', 名称) 存成三个字符串下标，不足三项的补 KEY_ABSENT。
+# 除字符串池外全是 i32 数组，用 array.frombytes 整段读入（array 按本机字节序，见 _pack / _ints）。
+import os
+import sys
+import json
+import struct
+import hashlib
+import zlib
+from array import array
+
+from ir import (
+    SAY, SAY_TEMPLATE, ASK, WAIT, CALL, CALL_API,
+    LLM_REPLY, JUMP, JUMP_IF_FALSE, HALT,
+    IREntry, IRProgram, compile_predicate, load_ir,
+)
+
+MAGIC = b'DSLB'
+VERSION = 3
+HEADER = struct.Struct('<4sHHI32s')
+SECTION_LEN = struct.Struct('<I')
+NONE = -1
+KEY_ABSENT = -2
+
+# 每种指令 (a, b, c) 三个操作数的编码方式：
+#   S 字符串下标  B 布尔  I 整数  T 模板下标  E 谓词 / 元组（JSON 字符串下标）  J 字典（JSON 字符串下标）
+#   F JUMP_IF_FALSE 的谓词闭包，不存储，加载时由 c 重新编译   - 恒为 None
+OPERAND_KINDS = {
+    SAY: 'S-B',
+    SAY_TEMPLATE: 'T--',
+    ASK: 'SSB',
+    WAIT: 'S--',
+    CALL: 'SSS',
+    CALL_API: 'SJS',
+    LLM_REPLY: 'T--',
+    JUMP: 'I-S',
+    JUMP_IF_FALSE: 'FIE',
+    HALT: '---',
+}
+
+
+class BundleError(ValueError):
+    pass
+
+
+def _pack(values):
+    """i32 / u32 数组按小端输出；array.tobytes 用本机字节序，大端机器上先交换"""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _ints(view, typecode='i'):
+    values = array(typecode)
+    values.frombytes(view)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def sources_checksum(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+        digest.update(b'\0')
+    return digest.digest()
+
+
+def _tuplify(value):
+    """JSON 读出来的列表还原成 IR 里的元组"""
+    if isinstance(value, list):
+        return tuple(_tuplify(v) for v in value)
+    return value
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.templates = []
+        self.template_ids = {}
+
+    def string(self, s):
+        if s is None:
+            return NONE
+        i = self.string_ids.get(s)
+        if i is None:
+            i = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def json(self, value):
+        if value is None:
+            return NONE
+        return self.string(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+
+    def key(self, key):
+        return tuple(self.string(part) for part in key) + (KEY_ABSENT,) * (3 - len(key))
+
+    def template(self, segments):
+        i = self.template_ids.get(segments)
+        if i is None:
+            i = self.template_ids[segments] = len(self.templates)
+            self.templates.append(segments)
+        return i
+
+    def operand(self, kind, value):
+        if kind in '-F':
+            return NONE
+        if kind == 'S':
+            return self.string(value)
+        if kind == 'B':
+            return NONE if value is None else int(bool(value))
+        if kind == 'I':
+            return value
+        if kind == 'T':
+            return self.template(value)
+        return self.json(value)  # E / J
+
+    def string_pool(self):
+        offsets = array('I', [0])
+        for s in self.strings:
+            offsets.append(offsets[-1] + len(s))
+        return SECTION_LEN.pack(len(self.strings)) + _pack(offsets) + "".join(self.strings).encode('utf-8')
+
+
+def encode_program(program, sources=()):
+    enc = _Encoder()
+
+    code = array('i')
+    for op, a, b, c in program.code:
+        kinds = OPERAND_KINDS[op]
+        code.extend((op, enc.operand(kinds[0], a), enc.operand(kinds[1], b), enc.operand(kinds[2], c)))
+
+    entries = array('i')
+    for e in program.entries:
+        entries.extend((enc.string(e.name), enc.json(e.guard), e.start, enc.json(e.match),
+                        enc.string(e.desc), enc.string(e.expect)))
+
+    dispatch = array('i')
+    for key, indices in program.dispatch.items():
+        dispatch.extend(enc.key(key))
+        dispatch.append(len(indices))
+        dispatch.extend(indices)
+
+    unresolved = array('i')
+    for addr, kind, target in program.unresolved:
+        unresolved.extend((addr, enc.string(kind), enc.string(target)))
+
+    source_ids = array('i', [enc.string(os.path.abspath(p)) for p in sources])
+    slots = array('i', [enc.json(program.slots or None)])
+
+    # 模板要在所有字符串入池之后再编码（模板本身也会往池里加字符串）
+    template_offsets = array('i', [0])
+    template_data = array('i')
+    for segments in enc.templates:
+        for var, text in segments:
+            template_data.extend((enc.string(var), enc.string(text)))
+        template_offsets.append(len(template_data))
+    templates = SECTION_LEN.pack(len(enc.templates)) + _pack(template_offsets) + _pack(template_data)
+
+    sections = [enc.string_pool(), _pack(code), templates, _pack(entries),
+                _pack(dispatch), _pack(unresolved), _pack(source_ids), _pack(slots)]
+    return b"".join(SECTION_LEN.pack(len(s)) + s for s in sections)
+
+
+def write_bundle(path, program, sources):
+    payload = encode_program(program, sources)
+    header = HEADER.pack(MAGIC, VERSION, 0, zlib.crc32(payload), sources_checksum(sources))
+    with open(path, 'wb') as f:
+        f.write(header + payload)
+
+
+def compile_bundle(sources, path):
+    """编译源文件（可混用三种方言）并写出 bundle，返回编译得到的 IRProgram"""
+    program = load_ir(sources)
+    write_bundle(path, program, sources)
+    return program
+
+
+def decode_program(payload):
+    view = memoryview(payload)
+    sections = []
+    pos = 0
+    while pos < len(view):
+        (length,) = SECTION_LEN.unpack_from(view, pos)
+        sections.append(view[pos + 4:pos + 4 + length])
+        pos += 4 + length
+    if len(sections) != 8:
+        raise BundleError("bundle 段数量不正确")
+    pool, code_raw, templates_raw, entries_raw, dispatch_raw, unresolved_raw, sources_raw, slots_raw = sections
+
+    # 字符串池：整段解码一次，再按字符偏移切片
+    (count,) = SECTION_LEN.unpack_from(pool, 0)
+    offsets = _ints(pool[4:8 + 4 * count], 'I')
+    text = bytes(pool[8 + 4 * count:]).decode('utf-8')
+    strings = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    json_cache = {}
+
+    def S(i):
+        return None if i == NONE else strings[i]
+
+    def J(i):
+        if i == NONE:
+            return None
+        value = json_cache.get(i)
+        if value is None:
+            value = json_cache[i] = _tuplify(json.loads(strings[i]))
+        return value
+
+
+    (count,) = SECTION_LEN.unpack_from(templates_raw, 0)
+    t_offsets = _ints(templates_raw[4:8 + 4 * count])
+    t_data = _ints(templates_raw[8 + 4 * count:])
+    templates = [tuple((S(t_data[k]), strings[t_data[k + 1]]) for k in range(t_offsets[i], t_offsets[i + 1], 2))
+                 for i in range(count)]
+
+    # 每种指令三个操作数的解码函数，恒为 None 的操作数不调用函数
+    decoders = {
+        '-': None, 'F': None, 'S': S, 'I': int,
+        'B': lambda v: None if v == NONE else bool(v),
+        'T': templates.__getitem__, 'E': J,
+        'J': lambda v: None if v == NONE else json.loads(strings[v]),
+    }
+    kinds = [None] * len(OPERAND_KINDS)
+    for op, ks in OPERAND_KINDS.items():
+        kinds[op] = tuple(decoders[k] for k in ks)
+    raw = iter(_ints(code_raw))
+    code = []
+    for op, a, b, c in zip(raw, raw, raw, raw):
+        da, db, dc = kinds[op]
+        code.append((op, da and da(a), db and db(b), dc and dc(c)))
+    for pc, (op, a, b, c) in enumerate(code):
+        if op == JUMP_IF_FALSE:
+            code[pc] = (op, compile_predicate(c), b, c)
+
+    raw = _ints(dispatch_raw)
+    dispatch = {}
+    entry_keys = {}
+    k = 0
+    while k < len(raw):
+        key = tuple(S(i) for i in raw[k:k + 3] if i != KEY_ABSENT)
+        n = raw[k + 3]
+        indices = dispatch[key] = tuple(raw[k + 4:k + 4 + n])
+        for i in indices:
+            entry_keys[i] = key
+        k += 4 + n
+
+    raw = iter(_ints(entries_raw))
+    entries = [IREntry(strings[name], entry_keys[i], J(guard), start, J(match), S(desc), S(expect))
+               for i, (name, guard, start, match, desc, expect) in enumerate(zip(raw, raw, raw, raw, raw, raw))]
+
+    raw = _ints(unresolved_raw)
+    unresolved = [(raw[k], strings[raw[k + 1]], strings[raw[k + 2]]) for k in range(0, len(raw), 3)]
+    sources = [strings[i] for i in _ints(sources_raw)]
+    (slots,) = _ints(slots_raw)
+    slots = None if slots == NONE else json.loads(strings[slots])
+    return IRProgram(code, entries, dispatch, unresolved, slots), sources
+
+
+def read_bundle(path):
+    """读取 bundle，返回 (IRProgram, 编译时的源文件列表, 源文件 sha256)；格式或校验不对时抛 BundleError"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise BundleError(f"{path} 不是有效的 bundle")
+    magic, version, _, crc, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise BundleError(f"{path} 不是有效的 bundle")
+    if version != VERSION:
+        raise BundleError(f"bundle 版本 {version} 与当前版本 {VERSION} 不一致，请重新编译")
+    payload = memoryview(data)[HEADER.size:]
+    if zlib.crc32(payload) != crc:
+        raise BundleError(f"{path} 校验失败，文件可能已损坏")
+    program, sources = decode_program(payload)
+    return program, sources, checksum
+
+
+def is_bundle(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def is_stale(sources, checksum):
+    """编译时的源文件仍然存在且内容有变化时，bundle 视为过期"""
+    if not sources or not all(os.path.exists(p) for p in sources):
+        return False
+    return sources_checksum(sources) != checksum
+
+
+def load_program(path, logger=None):
+    """
+    入口程序统一用它加载规则：path 可以是源文件，也可以是 bundle。
+    bundle 过期（源文件改过但没有重新编译）时改为直接编译源文件。
+    """
+    if not is_bundle(path):
+        return load_ir([path])
+    program, sources, checksum = read_bundle(path)
+    if is_stale(sources, checksum):
+        if logger:
+            logger.warning(f"⚠️ {path} 已过期，改为从源文件编译: {', '.join(sources)}")
+        return load_ir(sources)
+    return program
+
+
+if __name__ == "__main__":
+    # 用法:
+    #   python bundle.py compile rules.txt [更多源文件...] -o rules.bundle
+    #   python bundle.py info rules.bundle
+    args = sys.argv[1:]
+    if args[:1] == ['compile']:
+        out = 'rules.bundle'
+        if '-o' in args:
+            i = args.index('-o')
+            out = args[i + 1]
+            del args[i:i + 2]
+        program = compile_bundle(args[1:] or ['rules.txt'], out)
+        print(f"✅ 已编译 {len(program.entries)} 个入口、{len(program.code)} 条指令 -> {out} "
+              f"({os.path.getsize(out)} 字节)")
+    elif args[:1] == ['info'] and len(args) == 2:
+        program, sources, checksum = read_bundle(args[1])
+        print(f"📦 {args[1]}: 版本 {VERSION}, {len(program.entries)} 个入口, {len(program.code)} 条指令")
+        print(f"   源文件: {', '.join(sources)} ({'已过期' if is_stale(sources, checksum) else '最新'})")
+    else:
+        print("用法: python bundle.py compile 源文件... [-o 输出] | python bundle.py info 文件")
+        sys.exit(2)
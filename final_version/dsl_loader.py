@@ -1,32 +1,219 @@
 #dsl_loader.py
+import os
+import re
+import mmap
+import string
+
+PLACEHOLDER_RE = re.compile(r'\{\{([^{}]+)\}\}')
+# 保留给系统回复（如过载时的 system/busy）的 scene，不交给 LLM 识别
+SYSTEM_SCENE = 'system'
+# [slot] 的 charset 可以写这些名字，也可以直接列出允许的字符
+SLOT_CHARSETS = {
+    'digits': string.digits,
+    'letters': string.ascii_letters,
+    'alnum': string.digits + string.ascii_letters,
+    'hex': string.hexdigits,
+}
+LENGTH_RE = re.compile(r'(\d+)(?:\s*-\s*(\d+))?')
+
+
+def load_dsl(dsl_text: str, diagnostics=None, slots=None):
+    """
+    解析 [rule] 规则。无法解析的行会被跳过；传入 diagnostics 列表时，
+    每个问题以 "第 N 行: ..." 的形式追加进去（见 analyzer.py）。
+    [slot] 槽位校验不是规则，传入 slots 字典时按槽位名写进去（见 slot_validator.py），否则忽略。
+    """
+    return list(iter_rules(dsl_text.split('\n'), diagnostics, slots))
+
+
+def iter_dsl_file(path, diagnostics=None, slots=None):
+    """
+    流式加载规则文件：mmap 映射文件，逐行解码，每解析完一条规则就 yield 出来。
+    不会把整个文件读成字符串，也不会生成全部行的列表，
+    调用方逐条处理时内存占用只与单条规则的大小有关。
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)  # 顺序读，提示内核预读并尽早回收读过的页
+            yield from iter_rules(_mmap_lines(mm), diagnostics, slots)
+
+
+def _mmap_lines(mm):
+    pos, end = 0, len(mm)
+    while pos < end:
+        nl = mm.find(b'\n', pos)
+        if nl == -1:
+            nl = end
+        yield mm[pos:nl].decode('utf-8')
+        pos = nl + 1
+
+
+def parse_slot_field(spec, key, val):
+    """
+    解析 [slot] 的一个字段写入 spec，返回错误信息（None 表示成功）：
+      name     槽位名
+      pattern  整个值必须匹配的正则
+      length   长度，6 或 6-10
+      charset  允许的字符：digits / letters / alnum / hex，或直接列出字符
+      known    已知 ID 快照文件（slot_validator.py build 生成）
+      invalid  格式不对时转到的 scene/status
+      unknown  格式正确但不在快照里时转到的 scene/status（默认同 invalid）
+    """
+    if key in ('name', 'known'):
+        spec[key] = val
+    elif key == 'pattern':
+        try:
+            re.compile(val)
+        except re.error as e:
+            return f"pattern 不是合法的正则，已忽略: {e}"
+        spec['pattern'] = val
+    elif key == 'length':
+        m = LENGTH_RE.fullmatch(val)
+        if m is None:
+            return f"length 应为 N 或 N-M，已忽略: {val}"
+        lo = int(m.group(1))
+        spec['length'] = [lo, int(m.group(2) or lo)]
+    elif key == 'charset':
+        spec['charset'] = SLOT_CHARSETS.get(val, val)
+    elif key in ('invalid', 'unknown'):
+        scene, sep, status = val.partition('/')
+        if not (scene and sep and status):
+            return f"{key} 应为 scene/status，已忽略: {val}"
+        spec[key] = [scene.strip(), status.strip()]
+    else:
+        return f"[slot] 未知字段 '{key}'，已忽略"
+    return None
+
+
+def iter_rules(lines, diagnostics=None, slots=None):
+    """逐行解析规则，一条规则结束（遇到下一个 [section] 或输入结束）时 yield；[slot] 写进 slots，不 yield"""
+    def report(message):
+        if diagnostics is not None:
+            diagnostics.append(f"第 {line_no} 行: {message}")
+
+    def finish(item):
+        """规则返回 True；[slot] 在这里收进 slots，返回 False"""
+        if item['type'] == 'slot':
+            if item.get('name') is None:
+                report("[slot] 缺少 name，已忽略")
+            elif slots is not None:
+                slots[item['name']] = {k: v for k, v in item.items() if k not in ('type', 'name')}
+            return False
+        if diagnostics is not None and (item['scene'] is None or item['status'] is None):
+            diagnostics.append(f"规则缺少 scene 或 status: [{item['scene']}/{item['status']}]")
+        return True
 
-def load_dsl(dsl_text: str):
-    rules = []
     current = None
-    for line in dsl_text.strip().split('\n'):
+    for line_no, line in enumerate(lines, 1):
         line = line.strip()
         if not line or line.startswith('#'):
             continue
 
         if line.startswith('[') and line.endswith(']'):
+            if current is not None and finish(current):
+                yield current
             section = line[1:-1].strip()
-            current = {'type': section, 'scene': None, 'status': None, 'actions': []}
-            rules.append(current)
+            if section == 'slot':
+                current = {'type': section}
+            else:
+                current = {'type': section, 'scene': None, 'status': None, 'actions': []}
             continue
 
-        if ':' not in line or current is None:
+        if current is None:
+            report(f"规则外的内容，已忽略: {line}")
+            continue
+        if ':' not in line:
+            report(f"无法解析的行，已忽略: {line}")
             continue
 
         key, val = line.split(':', 1)
         key, val = key.strip(), val.strip()
 
-        if key in ('scene', 'status'):
+        if current['type'] == 'slot':
+            error = parse_slot_field(current, key, val)
+            if error:
+                report(error)
+        elif key in ('scene', 'status', 'desc'):
             current[key] = val
         elif key == 'ask':
             current['actions'].append({'type': 'ask', 'field': val})
         elif key == 'prompt':
+            if not current['actions'] or current['actions'][-1]['type'] != 'ask':
+                report("prompt 前面没有对应的 ask，已忽略")
+                continue
             current['actions'][-1]['prompt'] = val
+        elif key == 'expect':
+            # ask 字段的格式（正则），用户回答匹配时可以不经过 LLM 直接推断下一状态，见 predictor.py
+            if not current['actions'] or current['actions'][-1]['type'] != 'ask':
+                report("expect 前面没有对应的 ask，已忽略")
+                continue
+            try:
+                re.compile(val)
+            except re.error as e:
+                report(f"expect 不是合法的正则，已忽略: {e}")
+                continue
+            current['actions'][-1]['expect'] = val
         elif key == 'reply':
             current['actions'].append({'type': 'reply', 'message': val})
+        else:
+            report(f"未知字段 '{key}'，已忽略")
+
+    if current is not None and finish(current):
+        yield current
+
+
+def collect_slot_names(rules):
+    """按出现顺序收集规则用到的槽位名：ask 字段和 reply 模板中的 {{变量}}"""
+    names = []
+    for rule in rules:
+        for action in rule['actions']:
+            if action['type'] == 'ask':
+                names.append(action['field'])
+            elif action['type'] == 'reply':
+                names.extend(m.strip() for m in PLACEHOLDER_RE.findall(action['message']))
+    return list(dict.fromkeys(names))
+
+
+class RuleSchema:
+    """
+    从规则中推导出的 LLM 输出约束：合法的 (scene, status) 组合与槽位名。
+    构建一次后复用，validate 只做集合查找。
+    """
+
+    def __init__(self, rules):
+        self.scenes = {}
+        self.descriptions = {}
+        for rule in rules:
+            scene, status = rule.get('scene'), rule.get('status')
+            if not scene or not status or scene == SYSTEM_SCENE:
+                continue
+            statuses = self.scenes.setdefault(scene, [])
+            if status not in statuses:
+                statuses.append(status)
+                self.descriptions[(scene, status)] = rule.get('desc')
+        self.pairs = frozenset(self.descriptions)
+        self.slots = tuple(collect_slot_names(rules))
+        # ask 的提示语可以作为槽位说明写进 prompt
+        self.slot_hints = {}
+        for rule in rules:
+            for action in rule['actions']:
+                if action['type'] == 'ask' and action.get('prompt'):
+                    self.slot_hints.setdefault(action['field'], action['prompt'].strip('"'))
+        self.slot_set = frozenset(self.slots)
 
-    return rules
\ No newline at end of file
+    def validate(self, state):
+        """
+        校验并规整 response_decoder.decode_state 的结果，返回 (state 字典, errors)。
+        规则之外的槽位直接丢弃，不算错误；errors 为空表示合法。
+        """
+        if state is None:
+            return None, ["输出不是 JSON 对象"]
+        errors = []
+        if (state.scene, state.status) not in self.pairs:
+            errors.append(f"scene/status 组合 {state.scene}/{state.status} 不在规则表中")
+        slots = {k: str(v) for k, v in state.slots.items()
+                 if k in self.slot_set and v not in (None, "")}
+        return {"scene": state.scene, "status": state.status, "slots": slots}, errors
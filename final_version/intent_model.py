@@ -0,0 +1,277 @@
+# intent_model.py
+# 本地意图分类器：用 LLM 标注过的对话 (utterance, scene, status) 离线训练，
+# 特征是哈希到固定维度的字符 n-gram TF-IDF，每个 (scene, status) 一个质心，全部存成 NumPy 数组。
+# 运行时放在 call_qwen_with_state 前面，置信度足够高时不再调用 LLM。
+# 用法:
+#   python intent_model.py train llm_labels.jsonl [-o intent_model.npz] [--holdout 0.2]
+#   python intent_model.py evaluate intent_model.npz llm_labels.jsonl [--threshold 0.8]
+import sys
+import json
+import time
+import zlib
+import random
+from collections import Counter
+
+import numpy as np
+
+from logger import setup_logger
+
+N_FEATURES = 1 << 16       # 哈希特征维度
+NGRAM_RANGE = (1, 3)       # 字符 n-gram 的长度范围
+SCALE = 20.0               # softmax 前对余弦相似度的放大倍数，越大置信度越“尖”
+DEFAULT_THRESHOLD = 0.8    # 本地结果的最低置信度，低于它交给 LLM
+SLOT_RATE_LIMIT = 0.5      # 训练数据里超过这个比例带槽位的类别，本地不处理（槽位只能由 LLM 提取）
+
+logger = setup_logger()
+
+
+# 半角 / 全角数字统一成 0：订单号各不相同，只保留“这里有几位数字”这一信息
+DIGITS = str.maketrans('0123456789０１２３４５６７８９', '0' * 20)
+
+
+def normalize(text):
+    return text.strip().lower().translate(DIGITS)
+
+
+def read_labeled(path):
+    """读取 LLM 标注文件（每行一个 JSON：utterance / scene / status / slots），返回样本列表"""
+    samples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                samples.append((item['utterance'], item['scene'], item['status'], bool(item.get('slots'))))
+    return samples
+
+
+class IntentModel:
+    """
+    weights: (特征维度, 类别数) float32，每一列是一个类别 L2 归一化后的质心
+    idf:     (特征维度,) float32
+    labels:  每个类别的 "scene/status"
+    slot_rate: 每个类别的训练样本中 LLM 提取出槽位的比例
+    """
+
+    # n-gram -> 哈希下标的缓存上限，超过后清空重来
+    CACHE_SIZE = 1 << 18
+
+    def __init__(self, weights, idf, labels, slot_rate, ngram_range=NGRAM_RANGE, scale=SCALE):
+        self.weights = weights
+        self.idf = idf
+        self.labels = [str(label) for label in labels]
+        self.slot_rate = slot_rate
+        self.ngram_range = tuple(int(n) for n in ngram_range)
+        self.scale = float(scale)
+        self.states = [tuple(label.split('/', 1)) for label in self.labels]
+        self._ids = {}
+
+    @property
+    def n_features(self):
+        return self.idf.shape[0]
+
+    def ngram_ids(self, text):
+        """
+        字符 n-gram 的哈希下标（用 crc32，不受 PYTHONHASHSEED 影响，训练和运行时一致），
+        常见 n-gram 的哈希结果缓存起来
+        """
+        cache = self._ids
+        if len(cache) > self.CACHE_SIZE:
+            cache.clear()
+        text = normalize(text)
+        lo, hi = self.ngram_range
+        ids = []
+        for n in range(lo, hi + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                h = cache.get(gram)
+                if h is None:
+                    h = cache[gram] = zlib.crc32(gram.encode('utf-8')) % self.n_features
+                ids.append(h)
+        return ids
+
+    def features(self, texts):
+        """
+        一批文本的稀疏 TF-IDF 特征 (行号, 特征下标, 取值)，按行号、下标排序：
+        次线性 TF（1 + log 次数）x IDF，每行 L2 归一化。空文本没有任何特征。
+        """
+        id_lists = [self.ngram_ids(text) for text in texts]
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), [len(ids) for ids in id_lists])
+        ids = np.fromiter((h for ids in id_lists for h in ids), np.int64, len(rows))
+        keys, counts = np.unique(rows * self.n_features + ids, return_counts=True)
+        rows, ids = np.divmod(keys, self.n_features)
+        values = (1.0 + np.log(counts)).astype(np.float32) * self.idf[ids]
+        norms = np.sqrt(np.bincount(rows, values * values, minlength=len(texts)))
+        values /= norms[rows]
+        return rows, ids, values
+
+    def scores(self, texts):
+        """一批文本对全部类别的余弦相似度，形状 (len(texts), 类别数)"""
+        if len(texts) == 1:
+            return self._score_one(texts[0])[None, :]
+        rows, ids, values = self.features(texts)
+        out = np.zeros((len(texts), len(self.labels)), np.float32)
+        if len(rows):
+            present, starts = np.unique(rows, return_index=True)
+            out[present] = np.add.reduceat(self.weights[ids] * values[:, None], starts, axis=0)
+        return out
+
+    def _score_one(self, text):
+        """单条文本的快速路径，省掉批量版本里按行分组的开销"""
+        ids = self.ngram_ids(text)
+        if not ids:
+            return np.zeros(len(self.labels), np.float32)
+        counts = Counter(ids)
+        ids = np.fromiter(counts, np.int64, len(counts))
+        values = (1.0 + np.log(np.fromiter(counts.values(), np.float32, len(counts)))) * self.idf[ids]
+        return (values / np.sqrt(values @ values)) @ self.weights[ids]
+
+    def predict(self, texts):
+        """返回 (类别下标数组, 置信度数组)；置信度是放大后余弦相似度的 softmax 最大值"""
+        logits = self.scores(texts) * self.scale
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        return best, probs.max(axis=1)
+
+    def local_ok(self, label):
+        return self.slot_rate[label] <= SLOT_RATE_LIMIT
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, idf=self.idf, labels=np.array(self.labels),
+                 slot_rate=self.slot_rate, ngram_range=np.array(self.ngram_range), scale=np.array(self.scale))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['weights'], data['idf'], data['labels'], data['slot_rate'],
+                       data['ngram_range'], data['scale'])
+
+
+def train(samples, n_features=N_FEATURES, ngram_range=NGRAM_RANGE, scale=SCALE):
+    """samples 为 [(utterance, scene, status, 是否带槽位)]，返回 IntentModel"""
+    labels = sorted({f"{scene}/{status}" for _, scene, status, _ in samples})
+    label_index = {label: i for i, label in enumerate(labels)}
+    targets = np.array([label_index[f"{scene}/{status}"] for _, scene, status, _ in samples], np.int64)
+    has_slots = np.array([bool(slots) for *_, slots in samples], np.float32)
+    texts = [text for text, *_ in samples]
+
+    model = IntentModel(np.zeros((n_features, len(labels)), np.float32), np.ones(n_features, np.float32),
+                        labels, np.zeros(len(labels), np.float32), ngram_range, scale)
+    # 先按 idf 全为 1 取出特征，只用来统计每个特征出现在多少条样本里
+    rows, ids, _ = model.features(texts)
+    df = np.bincount(ids, minlength=n_features)
+    model.idf = (np.log((1 + len(samples)) / (1 + df)) + 1).astype(np.float32)
+
+    rows, ids, values = model.features(texts)
+    np.add.at(model.weights, (ids, targets[rows]), values)
+    norms = np.linalg.norm(model.weights, axis=0)
+    model.weights /= np.where(norms > 0, norms, 1)
+    counts = np.bincount(targets, minlength=len(labels))
+    model.slot_rate = (np.bincount(targets, has_slots, minlength=len(labels)) / np.maximum(counts, 1)).astype(np.float32)
+    return model
+
+
+def evaluate(model, samples, threshold=DEFAULT_THRESHOLD, batch_size=256):
+    """以 LLM 标注为准的准确率，以及本地能接管的比例和单条 / 批量的耗时"""
+    texts = [text for text, *_ in samples]
+    truth = [f"{scene}/{status}" for _, scene, status, _ in samples]
+    best, confidence = model.predict(texts)
+    predicted = [model.labels[i] for i in best]
+    local = [conf >= threshold and model.local_ok(i) for i, conf in zip(best, confidence)]
+    correct = [p == t for p, t in zip(predicted, truth)]
+
+    single = []
+    for text in texts[:1000]:
+        start = time.perf_counter()
+        model.predict([text])
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        model.predict(texts[i:i + batch_size])
+    batch = (time.perf_counter() - start) / len(texts)
+
+    n_local = sum(local)
+    return {
+        "samples": len(samples),
+        "accuracy": sum(correct) / len(samples),
+        "coverage": n_local / len(samples),
+        "local_accuracy": sum(c for c, l in zip(correct, local) if l) / n_local if n_local else None,
+        "single_p50_us": float(np.percentile(single, 50)) * 1e6,
+        "single_p95_us": float(np.percentile(single, 95)) * 1e6,
+        "batch_us": batch * 1e6,
+    }
+
+
+def format_report(report):
+    local = report["local_accuracy"]
+    return (f"📊 {report['samples']} 条样本: 准确率 {report['accuracy']:.1%}, "
+            f"本地接管 {report['coverage']:.1%}（其中准确率 {'-' if local is None else f'{local:.1%}'}）, "
+            f"单条 p50 {report['single_p50_us']:.0f} µs / p95 {report['single_p95_us']:.0f} µs, "
+            f"批量 {report['batch_us']:.1f} µs/条")
+
+
+class LocalIntentClassifier:
+    """
+    放在 call_qwen_with_state 前面的意图识别函数，调用方式相同：classify(text)。
+    - 本地模型置信度 >= threshold，且该类别通常不需要从这句话里提取槽位：直接返回，不调用 LLM
+    - 否则调用 LLM；LLM 的结果追加写入 log_path，作为下一次离线训练的标注数据
+    model 为 None 时只调用 LLM 并记录标注。stats 记录本地处理和交给 LLM 的次数。
+    """
+
+    def __init__(self, model, classify, threshold=DEFAULT_THRESHOLD, log_path=None):
+        self.model = model
+        self.classify = classify
+        self.threshold = threshold
+        self.log_path = log_path
+        self.stats = {"local": 0, "llm": 0}
+
+    def __call__(self, user_input):
+        if self.model is not None:
+            best, confidence = self.model.predict([user_input])
+            label, confidence = int(best[0]), float(confidence[0])
+            if confidence >= self.threshold and self.model.local_ok(label):
+                self.stats["local"] += 1
+                scene, status = self.model.states[label]
+                logger.info(f"⚡ 本地意图: {scene}/{status}（置信度 {confidence:.2f}）")
+                return {"scene": scene, "status": status, "slots": {}}
+
+        self.stats["llm"] += 1
+        state = self.classify(user_input)
+        if self.log_path:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"utterance": user_input, **state}, ensure_ascii=False) + "\n")
+        return state
+
+
+def _option(args, name, default):
+    if name in args:
+        i = args.index(name)
+        value = args[i + 1]
+        del args[i:i + 2]
+        return value
+    return default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    threshold = float(_option(args, '--threshold', DEFAULT_THRESHOLD))
+    if args[:1] == ['train'] and len(args) >= 2:
+        out = _option(args, '-o', 'intent_model.npz')
+        holdout = float(_option(args, '--holdout', 0))
+        samples = read_labeled(args[1])
+        random.Random(0).shuffle(samples)
+        n_test = int(len(samples) * holdout)
+        start = time.perf_counter()
+        model = train(samples[n_test:])
+        model.save(out)
+        print(f"✅ {len(samples) - n_test} 条样本、{len(model.labels)} 个类别，"
+              f"训练 {time.perf_counter() - start:.2f} s -> {out}")
+        if n_test:
+            print(format_report(evaluate(model, samples[:n_test], threshold)))
+    elif args[:1] == ['evaluate'] and len(args) == 3:
+        print(format_report(evaluate(IntentModel.load(args[1]), read_labeled(args[2]), threshold)))
+    else:
+        print("用法: python intent_model.py train 标注文件 [-o 输出] [--holdout 比例] | "
+              "python intent_model.py evaluate 模型 标注文件 [--threshold 置信度]")
+        sys.exit(2)
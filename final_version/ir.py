@@ -0,0 +1,417 @@
+# ir.py
+# 三种 DSL（final_version 的 [rule] 规则、12.5 的 label/goto 脚本、12.6 的 intent 语法）
+# 统一编译成同一种中间表示（IR），由 ir_runtime.IRRuntime 执行。
+import os
+import re
+import sys
+import importlib
+
+from dsl_loader import PLACEHOLDER_RE, load_dsl, iter_dsl_file
+
+# 操作码。所有入口的指令放在同一个线性数组里，每条指令是 (op, a, b, c)：
+#   SAY            a=消息（不含变量）  c=True 表示前端自动补上的默认回复
+#   SAY_TEMPLATE   a=模板片段 ((变量名或 None, 文本), ...)
+#   ASK            a=槽位  b=提示语  c=True 时槽位已有值就跳过；否则输出提示并结束本轮
+#   WAIT           a=变量名，挂起脚本，下一轮的用户输入写入该变量后从下一条指令继续
+#   CALL           a=函数名  b=参数变量  c=结果变量（可为 None）
+#   CALL_API       a=服务名  b=参数字典  c=结果变量
+#   LLM_REPLY      a=prompt 模板片段
+#   JUMP           a=目标地址（-1 表示目标不存在）  c=目标名（调试 / 报错用）
+#   JUMP_IF_FALSE  a=编译好的谓词 session -> bool  b=目标地址  c=谓词表达式
+#   HALT           结束本轮
+(SAY, SAY_TEMPLATE, ASK, WAIT, CALL, CALL_API,
+ LLM_REPLY, JUMP, JUMP_IF_FALSE, HALT) = range(10)
+
+OP_NAMES = ("SAY", "SAY_TEMPLATE", "ASK", "WAIT", "CALL", "CALL_API",
+            "LLM_REPLY", "JUMP", "JUMP_IF_FALSE", "HALT")
+
+# 12.5 脚本的变量写法是 ${var}，其余两种是 {{var}}
+DOLLAR_VAR_RE = re.compile(r'\$\{(\w+)\}')
+
+# 12.6 解释器在没有 reply 时的默认回复
+DEFAULT_INTENT_REPLY = "已收到您的请求。"
+
+
+def split_template(text, pattern=PLACEHOLDER_RE):
+    """把模板切分为 ((变量名或 None, 文本), ...)；变量片段的文本是原始占位符，变量缺失时原样输出"""
+    segments = []
+    pos = 0
+    for m in pattern.finditer(text):
+        if m.start() > pos:
+            segments.append((None, text[pos:m.start()]))
+        segments.append((m.group(1).strip(), m.group(0)))
+        pos = m.end()
+    if pos < len(text):
+        segments.append((None, text[pos:]))
+    return tuple(segments)
+
+
+def lookup(session, var):
+    """取变量值；支持 {{api_result.ticket_id}} 这样的点号访问"""
+    value = session.get(var)
+    if value is None and '.' in var:
+        base, _, attr = var.partition('.')
+        obj = session.get(base)
+        if isinstance(obj, dict):
+            value = obj.get(attr)
+    return value
+
+
+def _value(session, var):
+    value = lookup(session, var)
+    return "" if value is None else value
+
+
+def compile_predicate(expr):
+    """
+    把谓词表达式编译成闭包。表达式是可序列化的元组：
+    ('has', 槽位) / ('true', 变量) / ('not', e) / ('and', l, r) / ('or', l, r) / ('eq', 变量, 值) / ('ne', 变量, 值)
+    变量都可以用点号取字段（api_result.ticket_id）
+    """
+    if expr is None:
+        return None
+    kind = expr[0]
+    if kind == 'has':
+        field = expr[1]
+        return lambda s: lookup(s, field) is not None
+    if kind == 'true':
+        var = expr[1]
+        return lambda s: bool(lookup(s, var))
+    if kind == 'not':
+        inner = compile_predicate(expr[1])
+        return lambda s: not inner(s)
+    if kind in ('and', 'or'):
+        left, right = compile_predicate(expr[1]), compile_predicate(expr[2])
+        if kind == 'and':
+            return lambda s: left(s) and right(s)
+        return lambda s: left(s) or right(s)
+    if kind in ('eq', 'ne'):
+        var, val = expr[1], expr[2]
+        if kind == 'eq':
+            return lambda s: _value(s, var) == val
+        return lambda s: _value(s, var) != val
+    raise ValueError(f"未知谓词: {kind}")
+
+
+class IREntry:
+    """
+    一个可分发的入口（一条规则 / 一个脚本 / 一个 intent）。
+    key 为分发键：('state', scene, status) 或 ('intent', 名称)；
+    guard 为进入条件（谓词表达式，None 表示无条件）；start 为代码起始地址；
+    match 记录 12.6 的 keywords / regex 匹配方式，供匹配器使用；
+    desc 为 [rule] 的 desc，用于生成 LLM 的 system prompt；expect 为 ask 字段的格式正则。
+    """
+    __slots__ = ('name', 'key', 'guard', 'guard_fn', 'start', 'match', 'desc', 'expect')
+
+    def __init__(self, name, key, guard, start, match=None, desc=None, expect=None):
+        self.name = name
+        self.key = key
+        self.guard = guard
+        self.guard_fn = compile_predicate(guard)
+        self.start = start
+        self.match = match
+        self.desc = desc
+        self.expect = expect
+
+
+class IRProgram:
+    def __init__(self, code, entries, dispatch, unresolved=(), slots=None):
+        self.code = code
+        self.entries = entries
+        self.dispatch = dispatch      # 分发键 -> 入口下标元组（按定义顺序）
+        self.unresolved = list(unresolved)  # [(地址, 'label' | 'intent', 目标名)]
+        self.slots = dict(slots or {})  # 槽位名 -> [slot] 校验配置，见 slot_validator.py
+
+    def dump(self):
+        """反汇编，便于调试"""
+        starts = {entry.start: entry.name for entry in self.entries}
+        lines = []
+        for addr, (op, a, b, c) in enumerate(self.code):
+            if addr in starts:
+                lines.append(f"{starts[addr]}:")
+            if op == JUMP_IF_FALSE:
+                a, c = c, None
+            args = ", ".join(repr(x) for x in (a, b, c) if x is not None)
+            lines.append(f"{addr:6d}  {OP_NAMES[op]:<14}{args}")
+        return "\n".join(lines)
+
+
+class IRBuilder:
+    """
+    各前端共用的 IR 构建器。所有前端往同一个代码数组里追加指令，
+    build() 时统一回填跨入口的 goto，因此不同方言的规则可以混在一个程序里。
+    """
+
+    def __init__(self):
+        self.code = []
+        self.entries = []
+        self.dispatch = {}
+        self.intent_gotos = []  # [(地址, intent 名)]
+        self.unresolved = []
+        self.slots = {}
+
+    def emit(self, op, a=None, b=None, c=None):
+        self.code.append([op, a, b, c])
+        return len(self.code) - 1
+
+    def begin_entry(self, name, key, guard=None, match=None, desc=None):
+        self.dispatch.setdefault(key, []).append(len(self.entries))
+        self.entries.append(IREntry(name, key, guard, len(self.code), match, desc))
+
+    def emit_say(self, text, pattern=PLACEHOLDER_RE):
+        segments = split_template(text, pattern)
+        if any(var for var, _ in segments):
+            self.emit(SAY_TEMPLATE, segments)
+        else:
+            self.emit(SAY, text)
+
+    def emit_if(self, branches, else_body, emit_body):
+        """branches 为 [(谓词表达式, 语句块)]，编译成条件跳转链"""
+        end_jumps = []
+        for expr, body in branches:
+            skip = self.emit(JUMP_IF_FALSE, compile_predicate(expr), None, expr)
+            emit_body(body)
+            end_jumps.append(self.emit(JUMP))
+            self.code[skip][2] = len(self.code)
+        if else_body:
+            emit_body(else_body)
+        for addr in end_jumps:
+            self.code[addr][1] = len(self.code)
+
+    def build(self):
+        starts = {}
+        for entry in self.entries:
+            starts.setdefault(entry.name, entry.start)
+        for addr, target in self.intent_gotos:
+            if target in starts:
+                self.code[addr][1] = starts[target]
+            else:
+                self.unresolved.append((addr, 'intent', target))
+        code = [tuple(ins) for ins in self.code]
+        dispatch = {key: tuple(indices) for key, indices in self.dispatch.items()}
+        return IRProgram(code, self.entries, dispatch, self.unresolved, self.slots)
+
+    # ---------- 前端：final_version [rule] 规则 ----------
+
+    def add_rules(self, rules):
+        for rule in rules:
+            scene, status = rule.get('scene'), rule.get('status')
+            self.begin_entry(f"{scene}/{status}", ('state', scene, status), desc=rule.get('desc'))
+            for action in rule['actions']:
+                if action['type'] == 'ask':
+                    field = action['field']
+                    self.emit(ASK, field, action.get('prompt', f"请输入 {field}："), False)
+                    self.entries[-1].expect = action.get('expect')
+                    break
+                elif action['type'] == 'reply':
+                    self.emit_say(action['message'])
+            self.emit(HALT)
+
+    # ---------- 前端：12.5 label/goto 脚本（script_ast.Script） ----------
+
+    def add_script(self, script):
+        self.begin_entry(script.intent, ('intent', script.intent))
+        labels, gotos = {}, []
+        self._lower_statements(script.statements, labels, gotos)
+        self.emit(HALT)
+        for addr, label in gotos:
+            if label in labels:
+                self.code[addr][1] = labels[label]
+            else:
+                self.unresolved.append((addr, 'label', label))
+
+    def _lower_statements(self, statements, labels, gotos):
+        for stmt in statements:
+            kind = type(stmt).__name__
+            if kind == 'LabelNode':
+                labels[stmt.name] = len(self.code)
+            elif kind == 'SayNode':
+                self.emit_say(stmt.message, DOLLAR_VAR_RE)
+            elif kind == 'WaitNode':
+                self.emit(WAIT, stmt.var_name)
+            elif kind == 'GotoNode':
+                gotos.append((self.emit(JUMP, -1, None, stmt.target), stmt.target))
+            elif kind == 'CallNode':
+                self.emit(CALL, stmt.func_name, stmt.arg, stmt.result_var)
+            elif kind == 'IfNode':
+                branches = [(stmt.condition, stmt.then_body)] + list(stmt.elif_clauses)
+                self.emit_if(
+                    [(('eq' if op == '==' else 'ne', var, val), body) for (var, op, val), body in branches],
+                    stmt.else_body,
+                    lambda body: self._lower_statements(body, labels, gotos),
+                )
+            else:
+                raise TypeError(f"未知 12.5 语句类型: {kind}")
+
+    # ---------- 前端：12.6 intent 语法（dsl_ast.Program） ----------
+
+    def add_intents(self, program):
+        for intent in program.intents:
+            match_kind = type(intent.match).__name__
+            if match_kind == 'LlmIntentMatch':
+                key, match = ('intent', intent.match.intent_name), None
+            elif match_kind == 'KeywordsMatch':
+                key, match = ('intent', intent.name), ('keywords', tuple(intent.match.keywords))
+            elif match_kind == 'RegexMatch':
+                key, match = ('intent', intent.name), ('regex', intent.match.pattern)
+            else:
+                raise TypeError(f"未知匹配方式: {match_kind}")
+            self.begin_entry(intent.name, key, self._lower_expr(intent.context), match)
+            self._lower_actions(intent.actions)
+            self.emit(SAY, DEFAULT_INTENT_REPLY, None, True)
+            self.emit(HALT)
+
+    def _lower_expr(self, expr):
+        kind = type(expr).__name__
+        if kind == 'HasExpr':
+            return ('has', expr.field)
+        if kind == 'NotExpr':
+            return ('not', self._lower_expr(expr.expr))
+        if kind == 'BinOpExpr':
+            op = 'and' if expr.op == '&&' else 'or'
+            return (op, self._lower_expr(expr.left), self._lower_expr(expr.right))
+        if kind == 'ValueExpr':
+            return ('true', expr.name)
+        if kind == 'EqExpr':
+            return ('eq', expr.name, expr.value)
+        raise TypeError(f"未知表达式类型: {kind}")
+
+    def _lower_actions(self, actions):
+        for action in actions:
+            kind = type(action).__name__
+            if kind == 'AskAction':
+                self.emit(ASK, action.field, action.prompt, True)
+            elif kind == 'ReplyAction':
+                # 12.6 的语义：第一条回复即为本轮结果
+                self.emit_say(action.template)
+                self.emit(HALT)
+            elif kind == 'LlmReplyAction':
+                self.emit(LLM_REPLY, split_template(action.prompt_template))
+                self.emit(HALT)
+            elif kind == 'CallApiAction':
+                self.emit(CALL_API, action.service, action.args, 'api_result')
+            elif kind == 'GotoAction':
+                self.intent_gotos.append((self.emit(JUMP, -1, None, action.target), action.target))
+            elif kind == 'IfAction':
+                self.emit_if([(self._lower_expr(action.condition), action.then_actions)],
+                             action.else_actions, self._lower_actions)
+            else:
+                raise TypeError(f"未知动作类型: {kind}")
+
+
+# ---------- 源文件加载 ----------
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 方言 -> (所在目录, 需要导入的模块)
+FRONTENDS = {
+    'label_script': ('12.5', ('script_ast', 'parser')),
+    'intent': ('12.6', ('dsl_ast', 'lexer', 'parser')),
+}
+_frontend_modules = {}
+
+
+def import_frontend(dialect):
+    """
+    导入旧版本目录中的解析器。各版本的模块同名（parser.py 等），
+    导入时临时把同名模块移出 sys.modules，导入完成后恢复，互不干扰。
+    """
+    if dialect in _frontend_modules:
+        return _frontend_modules[dialect]
+    dirname, names = FRONTENDS[dialect]
+    path = os.path.join(REPO_ROOT, dirname)
+    saved = {name: sys.modules.pop(name) for name in names if name in sys.modules}
+    sys.path.insert(0, path)
+    try:
+        modules = {name: importlib.import_module(name) for name in names}
+    finally:
+        sys.path.remove(path)
+        for name in names:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+    _frontend_modules[dialect] = modules
+    return modules
+
+
+def detect_dialect(lines):
+    """根据第一行有效内容判断方言；lines 为可迭代的行（文件对象也可以）"""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('['):
+            return 'rules'
+        if line.startswith('intent:'):
+            return 'label_script'
+        if line.startswith('intent '):
+            return 'intent'
+        break
+    raise SyntaxError("无法识别的 DSL 格式")
+
+
+def add_source(builder, text, diagnostics=None):
+    dialect = detect_dialect(text.splitlines())
+    if dialect == 'rules':
+        builder.add_rules(load_dsl(text, diagnostics, builder.slots))
+    elif dialect == 'label_script':
+        parser = import_frontend(dialect)['parser']
+        builder.add_script(parser.DSLParser(text).parse())
+    else:
+        modules = import_frontend(dialect)
+        tokens = modules['lexer'].Lexer(text).tokenize()
+        builder.add_intents(modules['parser'].Parser(tokens).parse_program())
+
+
+def lower_rules(rules, slots=None):
+    builder = IRBuilder()
+    builder.add_rules(rules)
+    builder.slots.update(slots or {})
+    return builder.build()
+
+
+def rules_from_ir(program):
+    """
+    从 IR 还原 [rule] 规则（lower_rules 的逆过程），只还原 ('state', ...) 入口。
+    从 bundle 启动时没有源文件，LLM 的 system prompt 和槽位 schema 由还原出的规则生成。
+    """
+    rules = []
+    code = program.code
+    for entry in program.entries:
+        if entry.key[0] != 'state':
+            continue
+        rule = {'type': 'rule', 'scene': entry.key[1], 'status': entry.key[2], 'actions': []}
+        if entry.desc is not None:
+            rule['desc'] = entry.desc
+        pc = entry.start
+        while code[pc][0] != HALT:
+            op, a, b, c = code[pc]
+            if op == ASK:
+                rule['actions'].append({'type': 'ask', 'field': a, 'prompt': b})
+                if entry.expect is not None:
+                    rule['actions'][-1]['expect'] = entry.expect
+                break
+            if op == SAY:
+                rule['actions'].append({'type': 'reply', 'message': a})
+            elif op == SAY_TEMPLATE:
+                rule['actions'].append({'type': 'reply', 'message': "".join(text for _, text in a)})
+            pc += 1
+        rules.append(rule)
+    return rules
+
+
+def load_ir(paths, diagnostics=None):
+    """加载一个或多个源文件（可以混用三种方言），编译成一个 IRProgram"""
+    builder = IRBuilder()
+    for path in paths:
+        found = [] if diagnostics is not None else None
+        with open(path, encoding='utf-8') as f:
+            dialect = detect_dialect(f)
+            if dialect != 'rules':
+                f.seek(0)
+                add_source(builder, f.read(), found)
+        if dialect == 'rules':
+            # 规则文件可能很大（例如按 SKU 生成的回复），流式加载
+            builder.add_rules(iter_dsl_file(path, found, builder.slots))
+        if found:
+            diagnostics.extend(f"{path}: {message}" for message in found)
+    return builder.build()
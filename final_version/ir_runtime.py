@@ -0,0 +1,122 @@
+# ir_runtime.py
+from ir import (
+    SAY, SAY_TEMPLATE, ASK, WAIT, CALL, CALL_API,
+    LLM_REPLY, JUMP, JUMP_IF_FALSE, HALT, lookup,
+)
+from slot_validator import build_validators
+
+# 单轮内最多执行的跳转次数，防止 goto 成环时卡死
+MAX_JUMPS = 10_000
+
+
+def render(segments, session):
+    parts = []
+    for var, text in segments:
+        if var is None:
+            parts.append(text)
+        else:
+            value = lookup(session, var)
+            parts.append(text if value is None else str(value))
+    return "".join(parts)
+
+
+class IRRuntime:
+    """
+    IR 的执行器：final_version 的规则、用 load_ir / bundle 加载的 12.5 脚本和 12.6 intent 都由它执行，
+    12.6 的 Interpreter 也在它上面运行。12.5 目录自带的 Interpreter 是独立实现（可序列化续体、异步外部函数），不经过这里。
+    - dispatch(key, session): 按分发键取候选入口，返回第一个 guard 成立的入口
+    - run(entry, session):    从入口开始执行到 HALT / ASK / WAIT，返回本轮消息
+    - resume(session, text):  脚本停在 WAIT 时，把用户输入写入变量后继续执行
+    会话状态全部放在 session 里（槽位、pending_field、resume），运行时本身无状态，可被多个会话共享。
+
+    functions 为 call / call_api 用到的外部函数（名称 -> 函数）；
+    llm_reply 为 prompt -> 回复文本 的函数，未配置时直接输出渲染后的 prompt。
+    validators 为程序里 [slot] 编译出的槽位校验器（槽位名 -> slot_validator.SlotValidator），由 turn_handler 使用。
+    """
+
+    def __init__(self, program, functions=None, llm_reply=None):
+        self.program = program
+        self.functions = dict(functions or {})
+        self.llm_reply = llm_reply
+        self.validators = build_validators(program.slots)
+
+    def dispatch(self, key, session):
+        entries = self.program.entries
+        for i in self.program.dispatch.get(key, ()):
+            entry = entries[i]
+            if entry.guard_fn is None or entry.guard_fn(session):
+                return entry
+        return None
+
+    def run(self, entry, session):
+        return self.execute(entry.start, session)
+
+    def resume(self, session, user_input):
+        pc, var = session.resume
+        session.resume = None
+        session.set(var, user_input.strip())
+        return self.execute(pc, session)
+
+    def _function(self, name):
+        func = self.functions.get(name)
+        if func is None:
+            raise RuntimeError(f"Function '{name}' not defined")
+        return func
+
+    def execute(self, pc, session):
+        code = self.program.code
+        messages = []
+        jumps = 0
+
+        while True:
+            op, a, b, c = code[pc]
+            pc += 1
+
+            if op == SAY:
+                messages.append(a)
+
+            elif op == SAY_TEMPLATE:
+                messages.append(render(a, session))
+
+            elif op == JUMP_IF_FALSE:
+                if not a(session):
+                    pc = b
+
+            elif op == JUMP:
+                if a < 0:
+                    raise RuntimeError(f"Jump target '{c}' not found")
+                jumps += 1
+                if jumps > MAX_JUMPS:
+                    raise RuntimeError(f"Too many jumps (last target '{c}'), possible goto cycle")
+                pc = a
+
+            elif op == ASK:
+                if c and session.get(a) is not None:
+                    continue
+                messages.append(b)
+                session.pending_field = a
+                return messages
+
+            elif op == WAIT:
+                session.resume = (pc, a)
+                return messages
+
+            elif op == CALL:
+                result = self._function(a)(session.get(b, ""))
+                if c:
+                    session.set(c, result)
+
+            elif op == CALL_API:
+                # 参数值是已有槽位名时传槽位的值，否则按字面量传
+                args = {k: session.get(v, v) if isinstance(v, str) else v for k, v in b.items()}
+                session.set(c, self._function(a)(args))
+
+            elif op == LLM_REPLY:
+                prompt = render(a, session)
+                messages.append(self.llm_reply(prompt) if self.llm_reply else prompt)
+
+            elif op == HALT:
+                return messages
+
+            else:
+                raise RuntimeError(f"Unknown opcode: {op}")
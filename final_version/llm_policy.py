@@ -0,0 +1,238 @@
+# llm_policy.py
+# LLM 请求策略：对冲请求、降级模型、熔断。qwen_client 的每次请求都经过这里。
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from logger import setup_logger
+
+# 模型梯队：(模型, 单次超时秒数)。主模型超时或失败后降级到下一个更快、更便宜的模型
+DEFAULT_TIERS = (("qwen-max", 10.0), ("qwen-turbo", 5.0))
+
+logger = setup_logger()
+
+
+class UpstreamUnavailable(RuntimeError):
+    """所有梯队都失败，或熔断器处于打开状态；调用方应切换到纯规则模式"""
+
+
+class LatencyTracker:
+    """最近 window 次成功请求的耗时，用来估计 p50 / p95"""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        with self.lock:
+            data = sorted(self.samples)
+        if not data:
+            return None
+        return data[min(len(data) - 1, int(p / 100 * len(data)))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后打开，reset_timeout 秒内的请求直接拒绝；
+    之后进入半开状态放行一次试探请求，成功则关闭，失败则重新打开。
+    半开期间试探请求还没有结果时，其他请求照样拒绝；试探请求 reset_timeout 秒内没有报告结果时视为丢失，再放行一次。
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.probing = False
+        self.probe_started = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self.clock()
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+            elif self.probing and now - self.probe_started < self.reset_timeout:
+                return False
+            self.probing = True
+            self.probe_started = now
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opens += 1
+                    logger.warning("🔌 LLM 熔断器打开，切换到纯规则模式")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class LLMPolicy:
+    """
+    call(request) 执行一次 LLM 请求，request(model, cancel, timeout) 由调用方提供：
+    返回结果或抛异常；timeout 为本梯队剩余的秒数，调用方要把它作为上游请求的超时；
+    cancel 是 threading.Event，结果不再需要时置位（还没发出就不要发了）。
+    已经发出的 HTTP 请求无法中途取消，只能放弃结果、等它在 timeout 内结束，这类请求记为 abandoned。
+
+    - 对冲：主请求超过 hedge 延迟（最近成功耗时的 p95，不少于 min_hedge_delay）还没返回，
+      再发一个相同的请求，谁先成功用谁，另一个被放弃
+    - 降级：当前梯队超时或失败，换下一个梯队的模型
+    - 熔断：连续失败后直接抛 UpstreamUnavailable，不再请求上游
+    call 的 admit 参数（可选）在发出对冲请求、切换降级模型前调用，返回 False 时放弃这次额外请求
+    （用于上游额度不足时，见 rate_limiter.py）。
+    metrics 记录各策略的触发次数，snapshot() 额外给出各路径的耗时分位数。
+    """
+
+    def __init__(self, tiers=DEFAULT_TIERS, hedge=True, min_hedge_delay=0.2,
+                 default_hedge_delay=2.0, min_samples=20, breaker=None, max_workers=8):
+        self.tiers = tuple(tiers)
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="llm")
+        self.metrics = {
+            "requests": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0,
+            "timeouts": 0, "errors": 0, "short_circuited": 0, "rule_only": 0,
+            "not_admitted": 0, "abandoned": 0,
+        }
+        # 每种结果路径的耗时：primary 主请求 / hedge 对冲请求 / fallback 降级模型
+        self.path_latency = {"primary": LatencyTracker(), "hedge": LatencyTracker(),
+                             "fallback": LatencyTracker()}
+        self.lock = threading.Lock()
+
+    @property
+    def rule_only(self):
+        return self.breaker.state == CircuitBreaker.OPEN
+
+    def hedge_delay(self):
+        if len(self.latency) < self.min_samples:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, self.latency.percentile(95))
+
+    def _count(self, name):
+        with self.lock:
+            self.metrics[name] += 1
+
+    def call(self, request, admit=None):
+        self._count("requests")
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            self._count("rule_only")
+            raise UpstreamUnavailable("LLM 熔断中")
+
+        start = time.perf_counter()
+        last_error = None
+        for tier, (model, timeout) in enumerate(self.tiers):
+            if tier > 0:
+                if admit is not None and not admit():
+                    self._count("not_admitted")
+                    break
+                self._count("fallbacks")
+                logger.warning(f"⬇️ 降级到模型 {model}（{last_error}）")
+            try:
+                result, path = self._attempt(request, model, timeout, admit)
+            except TimeoutError as e:
+                self._count("timeouts")
+                last_error = e
+            except Exception as e:
+                self._count("errors")
+                last_error = e
+            else:
+                elapsed = time.perf_counter() - start
+                self.breaker.record_success()
+                if tier == 0:
+                    self.latency.add(elapsed)
+                self.path_latency["fallback" if tier > 0 else path].add(elapsed)
+                return result
+            self.breaker.record_failure()
+            if not self.breaker.allow():
+                break
+
+        self._count("rule_only")
+        raise UpstreamUnavailable(f"LLM 不可用: {last_error}")
+
+    def _attempt(self, request, model, timeout, admit=None):
+        """在一个梯队内请求（可能带对冲），返回 (结果, 'primary' | 'hedge')"""
+        deadline = time.perf_counter() + timeout
+        cancels = [threading.Event()]
+        pending = {self.executor.submit(request, model, cancels[0], timeout): "primary"}
+        hedge_at = time.perf_counter() + self.hedge_delay() if self.hedge else deadline
+        last_error = None
+        try:
+            while pending:
+                now = time.perf_counter()
+                if now >= deadline:
+                    raise TimeoutError(f"{model} 超过 {timeout:.1f}s 未返回")
+                until = hedge_at if len(cancels) == 1 and hedge_at < deadline else deadline
+                done, _ = wait(pending, timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if path == "hedge":
+                        self._count("hedge_wins")
+                    return result, path
+                if not pending and last_error is not None:
+                    raise last_error
+                if not done and len(cancels) == 1 and time.perf_counter() >= hedge_at:
+                    if admit is not None and not admit():
+                        self._count("not_admitted")
+                        hedge_at = deadline
+                        continue
+                    self._count("hedges")
+                    cancels.append(threading.Event())
+                    pending[self.executor.submit(request, model, cancels[1],
+                                                 max(0.0, deadline - time.perf_counter()))] = "hedge"
+            raise last_error
+        finally:
+            # 输掉的请求：未开始的直接取消；已经在跑的只能放弃，由传给上游的 timeout 限制占用线程和额度的时间
+            for future in pending:
+                if not future.cancel():
+                    self._count("abandoned")
+            for cancel in cancels:
+                cancel.set()
+
+    def snapshot(self):
+        """指标快照：各策略次数 + 各路径耗时的 p50 / p95（秒）"""
+        data = dict(self.metrics)
+        data["breaker"] = self.breaker.state
+        data["hedge_delay"] = self.hedge_delay()
+        for path, tracker in self.path_latency.items():
+            data[f"{path}_count"] = len(tracker)
+            data[f"{path}_p50"] = tracker.percentile(50)
+            data[f"{path}_p95"] = tracker.percentile(95)
+        return data
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
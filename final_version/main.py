@@ -1,92 +1,96 @@
 # main.py（修改部分）
-import json
+import os
+import sys
 from qwen_client import call_qwen_with_state
-from dsl_loader import load_dsl
-from context import Context
+from dsl_loader import iter_dsl_file
+from ir import lower_rules, rules_from_ir
+from bundle import is_bundle, load_program
+from analyzer import analyze, log_diagnostics
+from ir_runtime import IRRuntime
+from session import Session, SlotSchema
+from admission import AdmissionController
+from predictor import PendingFieldPredictor
 from logger import setup_logger  # 👈 新增导入
 
-EXIT_KEYWORDS = {'退出', '结束', '再见', 'bye', 'exit', 'quit'}
-
 # 初始化日志器
 logger = setup_logger()
-context = Context()
-
-def main_v2():
-    with open('rules.txt', encoding='utf-8') as f:
-        rules = load_dsl(f.read())
 
-    context = Context()
-    history = []
-    pending_field = None
+# 本地意图模型（intent_model.py train 生成），存在时放在 LLM 前面
+INTENT_MODEL_PATH = 'intent_model.npz'
+# 设置后把每次 LLM 的识别结果追加到这个文件，作为本地意图模型的训练数据
+LABEL_LOG_PATH = os.getenv('INTENT_LABEL_LOG')
+# 设置后每轮对话写入这个目录下的列式日志，用 turn_query.py 统计
+TURN_LOG_PATH = os.getenv('TURN_LOG')
+
+def load_rules(path):
+    """
+    只加载规则，不构造 LLM 客户端：返回 (rules, program)。
+    path 可以是规则源文件，也可以是 bundle.py compile 生成的预编译包
+    """
+    load_errors = []
+    if is_bundle(path):
+        program = load_program(path, logger)
+        rules = rules_from_ir(program)
+    else:
+        slot_specs = {}
+        rules = list(iter_dsl_file(path, load_errors, slot_specs))
+        program = lower_rules(rules, slot_specs)
+    log_diagnostics(analyze(program, load_errors), logger)
+    return rules, program
+
+
+def build_classifier(rules):
+    """
+    构造意图识别函数。DashScope SDK 在第一次真正调用 LLM 时才导入（见 qwen_client.load_sdk）；
+    没有本地意图模型、也不记录标注时不导入 intent_model，启动时不加载 NumPy
+    """
+    # 把当前规则传给客户端，规则变化时 system prompt 会自动重建
+    llm = lambda text: call_qwen_with_state(text, rules=rules)
+    if not os.path.exists(INTENT_MODEL_PATH) and not LABEL_LOG_PATH:
+        return llm
+    from intent_model import IntentModel, LocalIntentClassifier
+    model = IntentModel.load(INTENT_MODEL_PATH) if os.path.exists(INTENT_MODEL_PATH) else None
+    if model is not None:
+        logger.info(f"🧮 已加载本地意图模型: {len(model.labels)} 个类别")
+    return LocalIntentClassifier(model, llm, log_path=LABEL_LOG_PATH)
+
+
+def open_turn_log():
+    if not TURN_LOG_PATH:
+        return None
+    from turn_log import TurnLogWriter  # 只有开启对话日志才需要 NumPy
+    return TurnLogWriter(TURN_LOG_PATH)
+
+
+def main_v2(path='rules.txt'):
+    rules, program = load_rules(path)
+    runtime = IRRuntime(program)
+    schema = SlotSchema.from_rules(rules)
+    session = Session(schema)
+    classify = build_classifier(rules)
+    predictor = PendingFieldPredictor(rules)
+    # 同时处理的轮次和排队长度有上限，过载时直接回复 system/busy 规则的繁忙提示
+    admission = AdmissionController()
+    turn_log = open_turn_log()
 
     logger.info("🤖 客服机器人 v2 启动！")
 
-    while True:
-        try:
-            user_input = input("👤 用户: ").strip()
-        except EOFError:
-            break
-
-        if user_input in {'q'}:
-            logger.info("👋 用户主动退出")
-            break
-
-        if user_input in EXIT_KEYWORDS or user_input.lower() in EXIT_KEYWORDS:
-            logger.info("🔄 用户触发会话重置")
-            context.clear()
-            history.clear()
-            pending_field = None
-            print("用户退出会话，系统已重置状态。")
-            print("您好！请问是要查物流、投诉还是退款？")
-            continue
-
-        # 处理 pending 字段
-        if pending_field is not None:
-            context.set(pending_field, user_input)
-            logger.info(f"✅ 记录字段: {pending_field} = {user_input}")
-            pending_field = None
-
-        history.append({"role": "user", "content": user_input})
-
-        # 调用 Qwen
-        state = call_qwen_with_state(user_input)  # 注意：不再传 history（简化）
-        scene = state.get("scene", "other")
-        status = state.get("status", "unknown")
-        slots = state.get("slots", {})
-
-        # 自动将 LLM 提取的槽位写入上下文
-        for key, value in slots.items():
-            context.set(key, value)
-            logger.debug(f"📥 从 LLM 提取槽位: {key} = {value}")
-
-        logger.debug(f"🧠 Qwen 输出: scene='{scene}', status='{status}', slots={slots}")
-        logger.debug(f"📦 上下文: {context.data}")
+    try:
+        while True:
+            try:
+                user_input = input("👤 用户: ").strip()
+            except EOFError:
+                break
 
-        # 匹配规则
-        matched = False
-        for rule in rules:
-            if rule.get('scene') == scene and rule.get('status') == status:
-                matched = True
-                logger.info(f"🎯 匹配规则: [{scene}/{status}]")
-                for action in rule['actions']:
-                    if action['type'] == 'ask':
-                        field = action['field']
-                        prompt = action.get('prompt', f"请输入 {field}：")
-                        print(f"💬 系统: {prompt}")
-                        history.append({"role": "assistant", "content": prompt})
-                        pending_field = field
-                        break
-                    elif action['type'] == 'reply':
-                        msg = context.render(action['message'])
-                        print(f"💬 系统: {msg}")
-                        history.append({"role": "assistant", "content": msg})
+            if user_input in {'q'}:
+                logger.info("👋 用户主动退出")
                 break
 
-        if not matched:
-            msg = "我不太确定您的需求，请说明是要查物流、投诉还是退款？"
-            print(f"💬 系统: {msg}")
-            history.append({"role": "assistant", "content": msg})
-            logger.warning(f"❓ 未匹配任何规则: scene='{scene}', status='{status}'")
+            for msg in admission.handle(runtime, session, user_input, classify, predictor, turn_log):
+                print(f"💬 系统: {msg}")
+    finally:
+        if turn_log is not None:
+            turn_log.close()
 
 if __name__ == "__main__":
-    main_v2()
\ No newline at end of file
+    main_v2(*sys.argv[1:2])
\ No newline at end of file
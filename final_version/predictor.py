@@ -0,0 +1,132 @@
+# predictor.py
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import NamedTuple, Optional
+
+from dsl_loader import PLACEHOLDER_RE
+from logger import setup_logger
+
+# 本地推断不确定时，本轮同步等待 LLM 复核的最长时间（秒），超时按本地推断结果继续
+LLM_VERIFY_TIMEOUT = 3.0
+
+logger = setup_logger()
+
+
+class Prediction(NamedTuple):
+    state: dict       # 与 call_qwen_with_state 的返回值格式相同
+    confident: bool   # True 表示无需 LLM 复核
+
+
+class FieldPlan(NamedTuple):
+    """某个 ask 字段被回答之后的去向（由规则图推导）"""
+    scene: str
+    expect: Optional[re.Pattern]
+    on_match: Optional[str]     # 回答符合 expect（或没有 expect）时的下一状态
+    on_mismatch: Optional[str]  # 回答不符合 expect 时最可能的下一状态
+
+
+def build_plans(rules):
+    """
+    按规则图为每个 ask 字段推导下一状态：在提问规则所在的场景中，
+    除了再次询问该字段的规则以外，回复里用到 {{字段}} 的规则就是“回答合格”的去向，
+    其余的规则是“回答不合格”的去向；只有唯一候选时才会被采用。
+    同一字段在多个场景中被询问时无法区分，不做推断。
+    """
+    by_scene = {}
+    askers = {}
+    for rule in rules:
+        by_scene.setdefault(rule.get('scene'), []).append(rule)
+        for action in rule['actions']:
+            if action['type'] == 'ask':
+                askers.setdefault(action['field'], []).append((rule, action))
+                break
+
+    plans = {}
+    for field, asked in askers.items():
+        if len({rule.get('scene') for rule, _ in asked}) != 1:
+            continue
+        rule, action = asked[0]
+        consumers, others = [], []
+        for candidate in by_scene[rule.get('scene')]:
+            actions = candidate['actions']
+            if any(a['type'] == 'ask' and a['field'] == field for a in actions):
+                continue
+            uses_field = any(a['type'] == 'reply' and field in (m.strip() for m in PLACEHOLDER_RE.findall(a['message']))
+                             for a in actions)
+            (consumers if uses_field else others).append(candidate.get('status'))
+        if len(consumers) == 1:
+            on_match = consumers[0]
+        elif not consumers and len(others) == 1:
+            on_match = others[0]
+        else:
+            on_match = None
+        on_mismatch = others[0] if consumers and len(others) == 1 else None
+        expect = re.compile(action['expect']) if action.get('expect') else None
+        plans[field] = FieldPlan(rule.get('scene'), expect, on_match, on_mismatch)
+    return plans
+
+
+class PendingFieldPredictor:
+    """
+    pending_field 被回答时，先用规则图在本地推断下一个 (scene, status)：
+    - 回答符合 ask 的 expect 正则：推断确定，直接使用，不调用 LLM
+    - 其他情况（不符合格式 / 没有 expect）：推断不确定，同步调用 LLM 复核，本轮回复要等复核结果，
+      最多等 timeout 秒（调用放在线程池里只是为了能按时放弃等待），超时或调用失败时按本地推断继续
+    - 推断不出来（例如字段出现在多个场景）：照常同步调用 LLM
+    stats 记录本地推断、LLM、复核超时和复核失败各发生了多少次。
+    """
+
+    def __init__(self, rules, timeout=LLM_VERIFY_TIMEOUT, max_workers=4):
+        self.plans = build_plans(rules)
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._executor = None
+        self.stats = {"local": 0, "llm": 0, "timeouts": 0, "errors": 0}
+
+    def predict(self, field, value) -> Optional[Prediction]:
+        plan = self.plans.get(field)
+        if plan is None:
+            return None
+        if plan.expect is not None and plan.expect.search(value):
+            status, confident = plan.on_match, True
+        elif plan.expect is not None:
+            status, confident = plan.on_mismatch, False
+        else:
+            status, confident = plan.on_match, False
+        if status is None:
+            return None
+        return Prediction({"scene": plan.scene, "status": status, "slots": {}}, confident)
+
+    def resolve(self, field, value, classify):
+        """返回本轮的意图状态（格式与 classify 的返回值相同）"""
+        prediction = self.predict(field, value)
+        if prediction is not None and prediction.confident:
+            self.stats["local"] += 1
+            logger.info(f"⚡ 本地推断: {field} -> {prediction.state['scene']}/{prediction.state['status']}")
+            return prediction.state
+        if prediction is None:
+            self.stats["llm"] += 1
+            return classify(value)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="llm-verify")
+        # 在当前上下文里调用，限流器才知道请求属于哪个会话
+        future = self._executor.submit(contextvars.copy_context().run, classify, value)
+        try:
+            state = future.result(timeout=self.timeout)
+            self.stats["llm"] += 1
+            return state
+        except TimeoutError:
+            # 本轮不再等待；超时的调用无法取消，会在后台跑完，结果直接丢弃，不会再回头修正本轮状态
+            self.stats["timeouts"] += 1
+            logger.warning(f"⏱️ LLM 复核超时，按本地推断继续: {prediction.state['status']}")
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"❌ LLM 复核失败（{e}），按本地推断继续: {prediction.state['status']}")
+        return prediction.state
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
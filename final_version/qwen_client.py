@@ -1,15 +1,46 @@
 # qwen_client.py
 import os
-import json
-import re
+import time
+import threading
 from http import HTTPStatus
-import dashscope
+from concurrent.futures import CancelledError
 
-dashscope.api_key = os.getenv("DASHSCOPE_API_KEY")
+from dsl_loader import RuleSchema
+from response_decoder import decode_state
+from llm_policy import LLMPolicy, UpstreamUnavailable
+from rate_limiter import RateLimiter, current_session, estimate_tokens, QUEUE_DEADLINE
 
-def call_qwen_with_state(user_input: str, history=None):
+_sdk = None
+_sdk_lock = threading.Lock()
 
-    system_prompt = (
+
+class LLMNotConfigured(UpstreamUnavailable):
+    """没有设置 DASHSCOPE_API_KEY：不请求上游，本轮按纯规则模式处理"""
+
+
+def load_sdk():
+    """
+    第一次真正调用 LLM 时才导入 DashScope SDK（导入要 0.3 s 左右，纯规则模式和测试用不到）。
+    API Key 在每次调用前检查，启动后再设置环境变量也能生效。
+    """
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                import dashscope
+                _sdk = dashscope
+    if not _sdk.api_key:
+        _sdk.api_key = os.getenv("DASHSCOPE_API_KEY")
+    return _sdk
+
+
+def __getattr__(name):
+    # qwen_client.dashscope 照常可用（例如给 Generation.call 打补丁），第一次访问时才导入
+    if name == 'dashscope':
+        return load_sdk()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+SYSTEM_PROMPT = (
     "你是一个电商客服意图解析器。请根据用户的**最新一句话**，判断其意图、状态，并提取关键信息。\n\n"
     
     "【输出要求】\n"
@@ -58,42 +89,280 @@ def call_qwen_with_state(user_input: str, history=None):
     
     "用户输入：你好\n"
     "输出：{\"scene\":\"other\",\"status\":\"greeting\",\"slots\":{}}\n\n"
-    
-    "现在请处理用户的最新输入："
 )
+PROMPT_TAIL = "现在请处理用户的最新输入："
+# 一次识别的输出（一个 JSON 对象）大约消耗的 token 数，用于限流时预估
+OUTPUT_TOKENS_ESTIMATE = 50
+
+
+def rules_fingerprint(rules):
+    """规则集指纹：只取影响 prompt 的部分（scene / status / desc / ask 字段）"""
+    return hash(tuple(
+        (rule.get('scene'), rule.get('status'), rule.get('desc'),
+         tuple((a['field'], a.get('prompt')) for a in rule['actions'] if a['type'] == 'ask'))
+        for rule in rules
+    ))
+
+
+def build_system_prompt(schema=None):
+    """根据规则推导出的 RuleSchema 生成紧凑的 system prompt；没有规则时使用内置 prompt"""
+    if schema is None:
+        return SYSTEM_PROMPT + PROMPT_TAIL
+    pairs = "\n".join(
+        f"- {scene}/{status}：{schema.descriptions[(scene, status)] or status}"
+        for scene, statuses in schema.scenes.items() for status in statuses
+    )
+    slots = "\n".join(
+        f"- {name}：{schema.slot_hints[name]}" if name in schema.slot_hints else f"- {name}"
+        for name in schema.slots
+    )
+    return (
+        "你是一个电商客服意图解析器。请根据用户的**最新一句话**，判断 scene、status，并提取 slots。\n"
+        "只输出一个 JSON 对象，格式为 {\"scene\":...,\"status\":...,\"slots\":{...}}，"
+        "不要任何其他文字、解释或 markdown。\n\n"
+        "【scene/status 取值，只能从以下组合中选择】\n" + pairs + "\n\n"
+        "【slots 可提取的字段】\n" + slots + "\n"
+        "- 只提取用户这句话里明确给出的信息，原样摘录核心描述；没有则 slots 为 {}。\n"
+        "- 不要猜测！只根据用户当前这句话判断。\n\n"
+        + PROMPT_TAIL
+    )
+
+
+class PromptCache:
+    """
+    缓存 system prompt 及其 token 估计值，只在规则集变化时重建。
+    prompt 内容在规则不变时逐字节保持一致，服务端的前缀缓存（context cache）才能命中。
+    每次都比较规则指纹（十几条规则只要几微秒），原地修改规则（同一个列表、条数不变）也会重建。
+    """
+
+    def __init__(self):
+        self.fingerprint = None
+        self.schema = None
+        self.prompt = build_system_prompt()
+        self.tokens = estimate_tokens(self.prompt)
+        self.rebuilds = 0
+
+    def get(self, rules=None):
+        if rules is None:
+            if self.fingerprint is not None:
+                self._rebuild(None, None)
+            return self.prompt
+        fingerprint = rules_fingerprint(rules)
+        if fingerprint != self.fingerprint:
+            self._rebuild(rules, fingerprint)
+        return self.prompt
+
+    def _rebuild(self, rules, fingerprint):
+        self.schema = RuleSchema(rules) if rules else None
+        self.prompt = build_system_prompt(self.schema)
+        self.tokens = estimate_tokens(self.prompt)
+        self.fingerprint = fingerprint
+        self.rebuilds += 1
+
+
+prompt_cache = PromptCache()
+
+# 每次请求的 prompt token 统计，用于观察前缀缓存带来的节省
+prompt_stats = {
+    "requests": 0,
+    "input_tokens": 0,
+    "cached_tokens": 0,
+    "system_prompt_tokens": 0,
+}
+
+
+def _record_usage(response):
+    usage = getattr(response, "usage", None) or {}
+    details = usage.get("prompt_tokens_details") or {}
+    prompt_stats["requests"] += 1
+    prompt_stats["input_tokens"] += usage.get("input_tokens", 0) or 0
+    prompt_stats["cached_tokens"] += details.get("cached_tokens", 0) or 0
+    prompt_stats["system_prompt_tokens"] += prompt_cache.tokens
+
+
+def prompt_savings():
+    """返回输入 token 中命中前缀缓存的比例"""
+    if not prompt_stats["input_tokens"]:
+        return 0.0
+    return prompt_stats["cached_tokens"] / prompt_stats["input_tokens"]
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_input}
-    ]
 
-    response = dashscope.Generation.call(
-        model='qwen-max',
+# 对冲 / 降级模型 / 熔断策略，见 llm_policy.py
+llm_policy = LLMPolicy()
+# 每秒请求数 / 每分钟 token 数限流，按会话公平排队，见 rate_limiter.py
+rate_limiter = RateLimiter()
+
+
+def _request(messages, model, cancel, timeout, tokens=None):
+    """
+    发出一次请求。已发出的请求无法中途取消，用梯队剩余时间 timeout 作为 SDK 的请求超时，
+    被放弃的对冲 / 超时请求最多再占用 timeout 秒
+    """
+    if cancel.is_set():  # 在线程池里排队时已经输了，不再发出
+        raise CancelledError()
+    response = load_sdk().Generation.call(
+        model=model,
         messages=messages,
-        result_format='message'
+        result_format='message',
+        request_timeout=max(timeout, 0.1)
     )
 
     if response.status_code != HTTPStatus.OK:
         raise RuntimeError(f"Qwen API Error: {response.code} - {response.message}")
 
-    raw_text = response.output.choices[0].message.content.strip()
+    _record_usage(response)  # 被放弃的对冲请求也消耗了 token，同样计入
+    usage = getattr(response, "usage", None) or {}
+    if tokens is not None and usage.get("input_tokens"):
+        rate_limiter.settle(tokens, usage["input_tokens"] + (usage.get("output_tokens") or 0))
+    return response.output.choices[0].message.content.strip()
+
+
+def _generate(messages):
+    """
+    先在 rate_limiter 排队拿到额度，再经过 llm_policy 发出请求；
+    额度不足（rate_limiter.RateLimited）、没有配置 API Key（LLMNotConfigured）
+    或上游不可用时抛 llm_policy.UpstreamUnavailable。对冲和降级请求不排队，额度有空余时才发。
+    """
+    if not load_sdk().api_key:
+        raise LLMNotConfigured("未设置环境变量 DASHSCOPE_API_KEY")
+    tokens = prompt_cache.tokens + OUTPUT_TOKENS_ESTIMATE + sum(
+        estimate_tokens(m["content"]) for m in messages if m["role"] != "system")
+    rate_limiter.acquire(current_session.get(), tokens, time.monotonic() + QUEUE_DEADLINE)
+    return llm_policy.call(lambda model, cancel, timeout: _request(messages, model, cancel, timeout, tokens),
+                           admit=lambda: rate_limiter.try_acquire(tokens))
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'cancelled')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class SingleFlight:
+    """
+    合并相同的并发请求：同一个 key 已经有请求在进行中时，后来的调用不再请求上游，
+    等第一个调用（leader）完成后共享它的结果。
+    - leader 抛出普通异常：等待者收到同一个异常；key 随即移除，下一次调用会重新请求
+    - leader 被取消（CancelledError，或 KeyboardInterrupt 这类非 Exception 的异常）：
+      等待者不继承取消，其中一个重新成为 leader 发起请求
+    - 等待者可以设置 timeout，超时只影响自己（抛 TimeoutError），leader 照常完成
+    stats: calls 总调用数，upstream 实际请求上游次数，coalesced 被合并的次数，errors 上游失败次数。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key, fn, timeout=None):
+        while True:
+            with self.lock:
+                self.stats["calls"] += 1
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = _Flight()
+                    self.stats["upstream"] += 1
+                else:
+                    self.stats["coalesced"] += 1
+            if leader:
+                return self._lead(key, flight, fn)
+            if not flight.done.wait(timeout):
+                raise TimeoutError(f"等待合并的请求超过 {timeout}s")
+            if flight.cancelled:
+                with self.lock:
+                    self.stats["calls"] -= 1  # 重试不算一次新的调用
+                    self.stats["coalesced"] -= 1
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def _lead(self, key, flight, fn):
+        try:
+            flight.result = fn()
+            return flight.result
+        except CancelledError:
+            flight.cancelled = True
+            raise
+        except Exception as e:
+            flight.error = e
+            with self.lock:
+                self.stats["errors"] += 1
+            raise
+        except BaseException:
+            flight.cancelled = True
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def saved(self):
+        """被合并、没有请求上游的调用所占比例"""
+        calls = self.stats["calls"]
+        return self.stats["coalesced"] / calls if calls else 0.0
+
+
+# 相同 system prompt + 相同用户输入（规整空白后）的并发识别请求只调用一次 LLM
+single_flight = SingleFlight()
 
-    # 尝试提取 JSON（兼容可能的 markdown 包裹）
-    try:
-        # 去掉 ```json ... ``` 包裹
-        json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            result = json.loads(json_str)
-        else:
-            result = json.loads(raw_text)
 
+def normalize_input(user_input):
+    return " ".join(user_input.split())
+
+
+def _reask_message(schema, errors):
+    allowed = "、".join(f"{scene}/{status}" for scene, status in sorted(schema.pairs))
+    return (
+        f"上面的输出不符合要求：{'；'.join(errors)}。\n"
+        f"scene/status 只能是以下组合之一：{allowed}。\n"
+        "请重新只输出一个 JSON 对象。"
+    )
+
+
+def call_qwen_with_state(user_input: str, history=None, rules=None):
+    system_prompt = prompt_cache.get(rules)
+    schema = prompt_cache.schema
+    state = single_flight.do((system_prompt, normalize_input(user_input)),
+                             lambda: _classify(user_input, system_prompt, schema))
+    # 合并的调用共享同一个结果，每个调用方拿到自己的副本
+    return {**state, "slots": dict(state["slots"])}
+
+
+def _classify(user_input, system_prompt, schema):
+    # system prompt 放在最前且保持不变，只有最后的用户消息随请求变化，便于服务端前缀缓存
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_input}
+    ]
+
+    raw_text = _generate(messages)
+    result = decode_state(raw_text)
+
+    if schema is None:
+        if result is None:
+            print(f"⚠️ Qwen 返回格式错误，使用默认状态。原始输出：{raw_text}")
+            return {"scene": "other", "status": "unknown", "slots": {}}
         # 确保字段存在
-        result.setdefault("scene", "other")
-        result.setdefault("status", "unknown")
-        result.setdefault("slots", {})
-        return result
-
-    except (json.JSONDecodeError, KeyError) as e:
-        print(f"⚠️ Qwen 返回格式错误，使用默认状态。原始输出：{raw_text}")
-        return {"scene": "other", "status": "unknown", "slots": {}}
\ No newline at end of file
+        return {"scene": result.scene or "other",
+                "status": result.status or "unknown",
+                "slots": result.slots}
+
+    state, errors = schema.validate(result)
+    if errors:
+        # 输出不合法时带上约束重问一次，而不是直接退回 other/unknown
+        messages = messages + [
+            {"role": "assistant", "content": raw_text},
+            {"role": "user", "content": _reask_message(schema, errors)},
+        ]
+        raw_text = _generate(messages)
+        state, errors = schema.validate(decode_state(raw_text))
+        if errors:
+            print(f"⚠️ Qwen 返回格式错误，使用默认状态。原始输出：{raw_text}")
+            return {"scene": "other", "status": "unknown", "slots": {}}
+    return state
@@ -0,0 +1,180 @@
+# rate_limiter.py
+# 上游额度限流：每秒请求数、每分钟 token 数两个令牌桶，所有 LLM 调用发出前都要先拿到额度。
+# 排队按会话轮转（每个会话每轮只放行一个请求），一个话多的用户不会饿死其他人；
+# 预计等不到截止时间、或者排队超过截止时间的请求直接丢弃，调用方按上游不可用处理。
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from itertools import islice
+
+from llm_policy import UpstreamUnavailable, LatencyTracker
+
+# DashScope 的默认额度，按实际开通的额度调整
+REQUESTS_PER_SEC = 5.0
+TOKENS_PER_MIN = 100_000
+# 一次请求在队列里最多等待的时间（秒）
+QUEUE_DEADLINE = 10.0
+
+# 当前请求属于哪个会话（handle_turn 里设置），用来做公平排队
+current_session = contextvars.ContextVar('current_session', default=None)
+
+
+def estimate_tokens(text):
+    """粗略估计 token 数：中文约 1 字 1 token，其余字符约 4 个 1 token"""
+    cjk = sum(1 for ch in text if '\u4e00' <= ch <= '\u9fff')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class RateLimited(UpstreamUnavailable):
+    """额度不足、排队超过截止时间被丢弃"""
+
+
+class TokenBucket:
+    """容量 capacity、每秒补充 rate 个令牌的令牌桶（不加锁，由 RateLimiter 持锁调用）"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n):
+        """还要等多少秒才能取出 n 个令牌；超过容量的请求等到桶满即放行，否则永远等不到"""
+        self.refill()
+        return max(0.0, (min(n, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, n):
+        self.tokens -= n
+
+
+class _Ticket:
+    __slots__ = ('session', 'tokens', 'enqueued')
+
+    def __init__(self, session, tokens, enqueued):
+        self.session = session
+        self.tokens = tokens
+        self.enqueued = enqueued
+
+
+class RateLimiter:
+    """
+    acquire(session, tokens, deadline) 阻塞到拿到额度为止：
+    - 每个会话一个 FIFO 队列，会话之间轮转，只有轮到的那个请求会去取令牌
+    - 按队列里排在前面的请求估算等待时间，超过截止时间的直接抛 RateLimited；
+      排队途中到了截止时间同样丢弃
+    try_acquire 不排队，队列为空且额度足够时才成功，用于对冲 / 降级这类可有可无的额外请求。
+    settle 在拿到实际用量后修正 token 桶。
+    """
+
+    def __init__(self, requests_per_sec=REQUESTS_PER_SEC, tokens_per_min=TOKENS_PER_MIN,
+                 burst=None, clock=time.monotonic):
+        self.requests = TokenBucket(requests_per_sec, burst or max(1.0, requests_per_sec), clock)
+        self.tokens = TokenBucket(tokens_per_min / 60, tokens_per_min, clock)
+        self.cond = threading.Condition()
+        self.queues = OrderedDict()   # 会话 -> deque[_Ticket]，顺序即轮转顺序
+        self.depth = 0
+        self.waits = LatencyTracker()
+        self.metrics = {"granted": 0, "dropped": 0, "denied": 0, "max_queue_depth": 0}
+
+    def _head(self):
+        for queue in self.queues.values():
+            return queue[0]
+        return None
+
+    def _estimate(self, session, tokens):
+        """按轮转顺序，排在这个新请求前面的请求数和 token 数，换算成预计等待时间"""
+        own = len(self.queues.get(session, ()))
+        ahead = []
+        for s, queue in self.queues.items():
+            ahead.extend(islice(queue, own if s == session else own + 1))
+        ahead_requests = len(ahead)
+        ahead_tokens = sum(ticket.tokens for ticket in ahead)
+        self.requests.refill()
+        self.tokens.refill()
+        return max((ahead_requests + 1 - self.requests.tokens) / self.requests.rate,
+                   (ahead_tokens + tokens - self.tokens.tokens) / self.tokens.rate, 0.0)
+
+    def _remove(self, ticket):
+        queue = self.queues[ticket.session]
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[ticket.session]
+        self.depth -= 1
+        self.cond.notify_all()
+
+    def acquire(self, session=None, tokens=0, deadline=None):
+        """deadline 为 time.monotonic() 时刻，None 表示一直等"""
+        with self.cond:
+            if deadline is not None and time.monotonic() + self._estimate(session, tokens) > deadline:
+                self.metrics["dropped"] += 1
+                raise RateLimited("上游额度不足，预计排队超过截止时间")
+            ticket = _Ticket(session, tokens, time.monotonic())
+            self.queues.setdefault(session, deque()).append(ticket)
+            self.depth += 1
+            self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self.depth)
+            try:
+                while True:
+                    wait = None
+                    if self._head() is ticket:
+                        wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            self._grant(ticket)
+                            return
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.metrics["dropped"] += 1
+                        raise RateLimited("上游额度不足，排队超过截止时间")
+                    timeouts = [t for t in (wait, remaining) if t is not None]
+                    self.cond.wait(min(timeouts) if timeouts else None)
+            except BaseException:
+                if ticket in self.queues.get(session, ()):
+                    self._remove(ticket)
+                raise
+
+    def _grant(self, ticket):
+        self.requests.take(1)
+        self.tokens.take(ticket.tokens)
+        queue = self.queues[ticket.session]
+        queue.popleft()
+        if queue:
+            self.queues.move_to_end(ticket.session)  # 这个会话排到本轮最后
+        else:
+            del self.queues[ticket.session]
+        self.depth -= 1
+        self.metrics["granted"] += 1
+        self.waits.add(time.monotonic() - ticket.enqueued)
+        self.cond.notify_all()
+
+    def try_acquire(self, tokens=0):
+        with self.cond:
+            if not self.queues and self.requests.wait_time(1) <= 0 and self.tokens.wait_time(tokens) <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                return True
+            self.metrics["denied"] += 1
+            return False
+
+    def settle(self, estimated, actual):
+        """请求完成后按实际 token 用量多退少补"""
+        with self.cond:
+            self.tokens.refill()
+            self.tokens.tokens = min(self.tokens.capacity,
+                                     max(-self.tokens.capacity, self.tokens.tokens - (actual - estimated)))
+            self.cond.notify_all()
+
+    def snapshot(self):
+        """指标快照：当前排队请求数 / 会话数，放行、丢弃次数，排队耗时的 p50 / p95（秒）"""
+        with self.cond:
+            data = dict(self.metrics)
+            data["queue_depth"] = self.depth
+            data["queued_sessions"] = len(self.queues)
+        data["wait_p50"] = self.waits.percentile(50)
+        data["wait_p95"] = self.waits.percentile(95)
+        return data
@@ -0,0 +1,55 @@
+# response_decoder.py
+import json
+from typing import NamedTuple, Optional
+
+_decoder = json.JSONDecoder()
+
+# 最多尝试几个 '{' 起点（模型在 JSON 前输出了带花括号的说明文字时才会用到）
+MAX_ATTEMPTS = 16
+
+
+class IntentState(NamedTuple):
+    """LLM 意图解析结果；字段缺失或类型不对时 scene/status 为 None，slots 为空字典"""
+    scene: Optional[str]
+    status: Optional[str]
+    slots: dict
+
+    @classmethod
+    def from_obj(cls, obj):
+        scene = obj.get("scene")
+        status = obj.get("status")
+        slots = obj.get("slots")
+        return cls(
+            scene if isinstance(scene, str) else None,
+            status if isinstance(status, str) else None,
+            dict(slots) if isinstance(slots, dict) else {},
+        )
+
+
+def extract_json_object(raw_text):
+    """
+    从模型输出中取出第一个完整的 JSON 对象，找不到返回 None。
+    从 '{' 处用 raw_decode 解析：不依赖正则回溯，兼容 ```json 包裹、前后多余文字，
+    以及输出里出现多个对象的情况（只取第一个完整的）。任何输入都不会抛异常。
+    """
+    pos = raw_text.find('{')
+    attempts = 0
+    while pos != -1 and attempts < MAX_ATTEMPTS:
+        try:
+            obj, _ = _decoder.raw_decode(raw_text, pos)
+            if isinstance(obj, dict):
+                return obj
+        except (json.JSONDecodeError, RecursionError):
+            # 嵌套过深（例如模型输出了一长串 '['）时 raw_decode 会超出递归深度，按解析失败处理
+            pass
+        attempts += 1
+        pos = raw_text.find('{', pos + 1)
+    return None
+
+
+def decode_state(raw_text):
+    """解析模型输出为 IntentState，不是 JSON 对象时返回 None"""
+    obj = extract_json_object(raw_text)
+    if obj is None:
+        return None
+    return IntentState.from_obj(obj)
@@ -0,0 +1,106 @@
+# session.py
+import sys
+
+from dsl_loader import PLACEHOLDER_RE, collect_slot_names
+
+# 历史消息的角色用小整数表示，避免每条消息都存一个 "role" 字符串
+ROLE_USER = 0
+ROLE_ASSISTANT = 1
+ROLE_NAMES = ('user', 'assistant')
+
+# 每个会话最多保留的历史条数（超出后丢弃最早的消息）
+MAX_HISTORY = 32
+
+
+class SlotSchema:
+    """
+    所有会话共享的槽位表：槽位名 -> 下标。
+    槽位名来自规则（ask 字段和模板里的 {{变量}}），统一 intern 后只保存一份。
+    """
+    __slots__ = ('keys', 'index')
+
+    def __init__(self, keys):
+        self.keys = tuple(sys.intern(k) for k in dict.fromkeys(keys))
+        self.index = {}
+        for i, key in enumerate(self.keys):
+            self.index[key] = i
+            # 兼容 Context.render：{{order/runtime}} 也可以写成 {{order_runtime}}
+            if '/' in key:
+                self.index.setdefault(sys.intern(key.replace('/', '_')), i)
+
+    @classmethod
+    def from_rules(cls, rules):
+        return cls(collect_slot_names(rules))
+
+
+class Session:
+    """
+    内存紧凑的会话对象，接口与 Context 兼容（set / get / has / clear / render / data）。
+    - 已知槽位存放在定长列表里，按 SlotSchema 的下标访问
+    - 规则之外的槽位（例如 LLM 多返回的字段）才会用到 extra 字典
+    - 历史消息存成 (role, content) 元组，role 为 ROLE_USER / ROLE_ASSISTANT
+    - resume 为脚本停在 wait 时的续点 (指令地址, 变量名)，见 ir_runtime
+    """
+    __slots__ = ('schema', 'values', 'extra', 'history', 'pending_field', 'resume')
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.values = [None] * len(schema.keys)
+        self.extra = None
+        self.history = None
+        self.pending_field = None
+        self.resume = None
+
+    def set(self, key, value):
+        i = self.schema.index.get(key)
+        if i is not None:
+            self.values[i] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[sys.intern(key)] = value
+
+    def get(self, key, default=None):
+        i = self.schema.index.get(key)
+        if i is not None:
+            value = self.values[i]
+            return default if value is None else value
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        self.values = [None] * len(self.schema.keys)
+        self.extra = None
+        self.history = None
+        self.pending_field = None
+        self.resume = None
+
+    @property
+    def data(self):
+        """以字典形式返回当前槽位（仅用于日志和调试）"""
+        data = {k: v for k, v in zip(self.schema.keys, self.values) if v is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def render(self, text):
+        def replace(m):
+            value = self.get(m.group(1).strip())
+            return m.group(0) if value is None else str(value)
+        return PLACEHOLDER_RE.sub(replace, text)
+
+    def add_message(self, role, content):
+        if self.history is None:
+            self.history = []
+        self.history.append((role, content))
+        if len(self.history) > MAX_HISTORY:
+            del self.history[0]
+
+    def messages(self):
+        """还原成 LLM 接口需要的 [{"role": ..., "content": ...}] 格式"""
+        return [{"role": ROLE_NAMES[role], "content": content}
+                for role, content in self.history or ()]
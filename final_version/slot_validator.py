@@ -0,0 +1,173 @@
+# slot_validator.py
+# [slot] 槽位校验：长度、字符集、正则都在本地检查，格式不对的值直接转到 invalid 指定的状态，不再让 LLM 判断；
+# 配置了 known（已知 ID 快照）时，格式正确但快照里没有的 ID 转到 unknown 状态，不再去后端查询。
+#
+#   [slot]
+#   name: order_id
+#   length: 6
+#   charset: digits
+#   known: known_orders.idx
+#   invalid: logistics/invalid_order_id
+#
+# 快照是排好序、去重的 uint64 数组（python slot_validator.py build ids.txt -o known_orders.idx 生成），
+# 加载时用 np.memmap 映射，不读进内存也不解析，查找为二分。
+# 用法:
+#   python slot_validator.py build ids.txt [-o known_orders.idx]
+#   python slot_validator.py check known_orders.idx ID...
+import re
+import sys
+import struct
+import hashlib
+
+from logger import setup_logger
+
+INVALID = 'invalid'
+UNKNOWN = 'unknown'
+# 快照文件头：magic | 版本 u32 | ID 数 u64
+INDEX_MAGIC = b'KIDX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<4sIQ')
+# 纯数字且不超过 17 位的 ID 精确存储：位数放在第 58-62 位（区分 "000123" 和 "123"），数值放在低 58 位；
+# 其余 ID 存 blake2b 的 64 位哈希，最高位置 1 与数字 ID 区分
+MAX_NUMERIC_DIGITS = 17
+NUMERIC_BITS = 58
+HASHED_BIT = 1 << 63
+
+logger = setup_logger()
+
+
+def id_key(value):
+    if value.isdigit() and value.isascii() and len(value) <= MAX_NUMERIC_DIGITS:
+        return (len(value) << NUMERIC_BITS) | int(value)
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') | HASHED_BIT
+
+
+class KnownIdIndex:
+    """
+    已知 ID 集合（8 字节 / 个）。不在集合里的 ID 一定不存在；
+    在集合里的 ID 对纯数字 ID 是精确的，其余 ID 有极小的哈希碰撞概率（约 n / 2^63），碰撞只会放行去后端查询。
+    """
+
+    def __init__(self, keys):
+        self.keys = keys  # 升序 uint64 数组（np.ndarray 或 np.memmap）
+
+    @classmethod
+    def from_ids(cls, ids):
+        import numpy as np  # 只有配置了快照才需要 NumPy
+        keys = np.fromiter(map(id_key, ids), np.uint64)
+        keys.sort()
+        # 排序后相邻去重，比 np.unique 快得多
+        return cls(keys[np.concatenate(([True], keys[1:] != keys[:-1]))] if len(keys) else keys)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.keys)))
+            self.keys.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+        with open(path, 'rb') as f:
+            magic, version, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{path} 不是有效的已知 ID 快照")
+        if count == 0:
+            return cls(np.empty(0, np.uint64))
+        return cls(np.memmap(path, np.uint64, 'r', INDEX_HEADER.size, (count,)))
+
+    def __contains__(self, value):
+        import numpy as np
+        key = np.uint64(id_key(value))
+        i = int(self.keys.searchsorted(key))
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class SlotValidator:
+    """一个 [slot] 编译后的校验器；check 返回 None（通过）、INVALID 或 UNKNOWN"""
+
+    def __init__(self, name, spec, known=None):
+        self.name = name
+        self.min_len, self.max_len = spec.get('length') or (0, None)
+        self.charset = frozenset(spec['charset']) if spec.get('charset') else None
+        self.pattern = re.compile(spec['pattern']) if spec.get('pattern') else None
+        self.known = known
+        self.targets = {INVALID: spec.get('invalid'), UNKNOWN: spec.get('unknown') or spec.get('invalid')}
+
+    def plausible(self, value):
+        """
+        回答像不像这个槽位的值（用来区分“输错了订单号”和“换了话题”）：
+        配置了字符集时，至少一半的字符在字符集内；否则配置了正则时正则能在回答中找到匹配
+        """
+        if self.charset is not None:
+            return sum(ch in self.charset for ch in value) * 2 >= len(value) > 0
+        if self.pattern is not None:
+            return self.pattern.search(value) is not None
+        return True
+
+    def check(self, value):
+        n = len(value)
+        if n < self.min_len or (self.max_len is not None and n > self.max_len):
+            return INVALID
+        if self.charset is not None and not self.charset.issuperset(value):
+            return INVALID
+        if self.pattern is not None and self.pattern.fullmatch(value) is None:
+            return INVALID
+        if self.known is not None and value not in self.known:
+            return UNKNOWN
+        return None
+
+
+def build_validators(slots):
+    """IRProgram.slots -> {槽位名: SlotValidator}；快照文件打不开时只做格式校验"""
+    validators = {}
+    for name, spec in slots.items():
+        known = None
+        if spec.get('known'):
+            try:
+                known = KnownIdIndex.load(spec['known'])
+                logger.info(f"📇 已加载 {name} 的已知 ID 快照: {len(known)} 个")
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"⚠️ {name} 的已知 ID 快照加载失败（{e}），只做格式校验")
+        validators[name] = SlotValidator(name, spec, known)
+    return validators
+
+
+def check_slots(validators, values):
+    """
+    逐个校验 {槽位名: 值}，第一个不通过且配置了去向的槽位决定本轮状态：
+    返回 {"scene", "status", "slots": {}}；全部通过（或没有去向）时返回 None
+    """
+    for name, value in values.items():
+        validator = validators.get(name)
+        if validator is None:
+            continue
+        reason = validator.check(str(value))
+        if reason is None:
+            continue
+        target = validator.targets[reason]
+        logger.info(f"🚫 槽位 {name}={value!r} 未通过本地校验（{reason}）"
+                    + (f"，转到 {target[0]}/{target[1]}" if target else ""))
+        if target:
+            return {"scene": target[0], "status": target[1], "slots": {}}
+    return None
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ['build'] and len(args) in (2, 4):
+        out = args[3] if len(args) == 4 and args[2] == '-o' else 'known_orders.idx'
+        with open(args[1], encoding='utf-8') as f:
+            index = KnownIdIndex.from_ids(line.strip() for line in f if line.strip())
+        index.save(out)
+        print(f"✅ {len(index)} 个 ID -> {out}")
+    elif args[:1] == ['check'] and len(args) >= 3:
+        index = KnownIdIndex.load(args[1])
+        for value in args[2:]:
+            print(f"{value}: {'✅ 存在' if value in index else '❌ 不存在'}")
+    else:
+        print("用法: python slot_validator.py build ID文件 [-o 输出] | python slot_validator.py check 快照 ID...")
+        sys.exit(2)
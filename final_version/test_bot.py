@@ -1,7 +1,6 @@
 # test_bot.py
 import sys
 import os
-import time
 from io import StringIO
 from contextlib import redirect_stdout, redirect_stderr
 
@@ -41,9 +40,7 @@ def test_case(name, user_inputs, expected_substrings):
     print(f"\n🧪 测试用例: {name}")
     print("-" * 50)
     
-    # 给 LLM 调用留出时间（避免速率限制）
-    time.sleep(1)
-    
+    # 速率限制由 qwen_client.rate_limiter 负责，这里不再固定 sleep
     actual_output = run_conversation_real(user_inputs)
     
     success = True
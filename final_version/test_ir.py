@@ -0,0 +1,309 @@
+# test_ir.py
+import sys
+import os
+import logging
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import ir
+from ir import IRBuilder, add_source, load_ir, lower_rules, import_frontend, REPO_ROOT
+from ir_runtime import IRRuntime
+from analyzer import analyze
+import bundle
+from session import Session, SlotSchema
+from turn_handler import handle_turn, FALLBACK_REPLY
+from dsl_loader import load_dsl
+from logger import setup_logger
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'rules.txt')
+REFUND_SCRIPT = os.path.join(REPO_ROOT, '12.5', 'scripts', 'refund.dsl')
+
+INTENTS = '''
+intent ask_order_for_logistics {
+    match: llm_intent: "query_logistics"
+    context: !has(order_id)
+    actions: [
+        ask("order_id", "请问您要查询哪个订单的物流信息？"),
+        goto(logistics_query)
+    ]
+}
+intent logistics_query {
+    match: llm_intent: "query_logistics"
+    context: has(order_id)
+    actions: [
+        call_api("logistics_service", {"order_id": "order_id"}),
+        if (has(api_result)) {
+            actions: [reply("订单 {{order_id}} 状态：{{api_result.status}}")]
+        } else {
+            actions: [reply("查询失败")]
+        }
+    ]
+}
+'''
+
+
+def classifier(scene, status, slots=None):
+    return lambda text: {"scene": scene, "status": status, "slots": dict(slots or {})}
+
+
+class TestIR(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        setup_logger().setLevel(logging.WARNING)
+
+    def test_rules_lowered_to_dispatch_table(self):
+        with open(RULES_PATH, encoding='utf-8') as f:
+            rules = load_dsl(f.read())
+        runtime = IRRuntime(lower_rules(rules))
+        session = Session(SlotSchema.from_rules(rules))
+
+        replies = handle_turn(runtime, session, "查物流",
+                              classifier("logistics", "need_order_id"))
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(session.pending_field, "order_id")
+
+        replies = handle_turn(runtime, session, "888999",
+                              classifier("logistics", "ready_to_query"))
+        self.assertEqual(session.get("order_id"), "888999")
+        self.assertIn("888999", replies[0])
+        self.assertEqual(handle_turn(runtime, session, "?", classifier("x", "y")), [FALLBACK_REPLY])
+
+    def test_label_script_resumes_at_wait(self):
+        calls = []
+
+        def check(order_id):
+            calls.append(order_id)
+            return "eligible" if order_id == "ORD1" else "not_found"
+
+        runtime = IRRuntime(load_ir([REFUND_SCRIPT]),
+                            {"check_refund_eligibility": check, "process_refund": calls.append})
+        session = Session(SlotSchema(()))
+        classify = classifier("refund", "start")
+
+        replies = handle_turn(runtime, session, "我要退款", classify)
+        self.assertIn("订单编号", replies[0])
+        self.assertIsNotNone(session.resume)
+
+        replies = handle_turn(runtime, session, "ORD9", classify)  # 不经过意图识别
+        self.assertIn("未找到订单 ORD9", replies[0])
+        replies = handle_turn(runtime, session, "ORD1", classify)
+        self.assertIn("ORD1", replies[0])
+        self.assertIsNone(session.resume)
+        self.assertEqual(calls, ["ORD9", "ORD1", "ORD1"])
+
+    def test_intent_guards_and_goto(self):
+        builder = IRBuilder()
+        add_source(builder, INTENTS)
+        program = builder.build()
+        self.assertEqual(program.unresolved, [])
+        runtime = IRRuntime(program, {"logistics_service": lambda args: {"status": f"已签收 {args['order_id']}"}})
+        session = Session(SlotSchema(()))
+
+        entry = runtime.dispatch(('intent', 'query_logistics'), session)
+        self.assertEqual(entry.name, "ask_order_for_logistics")
+        self.assertEqual(runtime.run(entry, session), ["请问您要查询哪个订单的物流信息？"])
+        self.assertEqual(session.pending_field, "order_id")
+
+        # ask 的字段已有值时跳过提问，goto 到 logistics_query
+        session.set("order_id", "888")
+        self.assertEqual(runtime.run(program.entries[0], session), ["订单 888 状态：已签收 888"])
+        self.assertEqual(runtime.dispatch(('intent', 'query_logistics'), session).name, "logistics_query")
+
+    def test_mixed_dialects_in_one_program(self):
+        program = load_ir([RULES_PATH, REFUND_SCRIPT])
+        self.assertIn(('state', 'logistics', 'need_order_id'), program.dispatch)
+        self.assertIn(('intent', 'refund'), program.dispatch)
+        self.assertIn("SAY_TEMPLATE", program.dump())
+
+    def test_undefined_goto_reported(self):
+        builder = IRBuilder()
+        add_source(builder, 'intent a {\n match: llm_intent: "a"\n context: has(x)\n actions: [goto(nowhere)]\n}')
+        program = builder.build()
+        self.assertEqual([t for _, _, t in program.unresolved], ["nowhere"])
+        with self.assertRaises(RuntimeError):
+            IRRuntime(program).run(program.entries[0], Session(SlotSchema(())))
+
+    def test_frontends_do_not_leak_modules(self):
+        before = sys.modules.get('parser')
+        label_parser = import_frontend('label_script')['parser']
+        intent_parser = import_frontend('intent')['parser']
+        self.assertIsNot(label_parser, intent_parser)
+        self.assertIs(sys.modules.get('parser'), before)
+        self.assertIs(ir.import_frontend('intent')['parser'], intent_parser)
+
+
+def codes(diagnostics):
+    return [d.code for d in diagnostics]
+
+
+class TestAnalyzer(unittest.TestCase):
+
+    def test_malformed_lines_reported_not_raised(self):
+        errors = []
+        rules = load_dsl("prompt: 孤立的 prompt\n[rule]\nscene: a\nprompt: 没有 ask\n"
+                         "status: b\n随便写写\ncolor: red\nreply: ok", errors)
+        self.assertEqual(len(rules), 1)
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(errors[1].startswith("第 4 行"))
+        diagnostics = analyze(lower_rules(rules), errors)
+        self.assertEqual(codes(diagnostics), ['malformed-line'] * 4)
+
+    def test_shadowed_rules_and_placeholders(self):
+        rules = load_dsl("[rule]\nscene: a\nstatus: b\nreply: 第一条\n"
+                         "[rule]\nscene: a\nstatus: b\nreply: {{order_id}} {{x}}\n"
+                         "[rule]\nscene: a\nstatus: c\nask: order_id\n")
+        diagnostics = analyze(lower_rules(rules))
+        self.assertEqual(codes(diagnostics), ['shadowed-rule', 'unset-placeholder'])
+        self.assertIn("{{x}}", diagnostics[1].message)
+        self.assertEqual(analyze(lower_rules(rules), slots=['x'])[1:], [])
+
+    def test_slot_spec_parsed_and_targets_checked(self):
+        errors, slots = [], {}
+        rules = load_dsl("[slot]\nname: order_id\nlength: 6-8\ncharset: digits\nlength: x\n"
+                         "invalid: logistics/bad_id\nunknown: nowhere\n"
+                         "[rule]\nscene: logistics\nstatus: bad_id\nreply: 订单号不对\n"
+                         "[slot]\ncharset: hex\n", errors, slots)
+        self.assertEqual(len(rules), 1)
+        self.assertEqual(slots, {'order_id': {'length': [6, 8], 'charset': '0123456789',
+                                              'invalid': ['logistics', 'bad_id']}})
+        self.assertEqual(len(errors), 3)  # length: x、unknown 不是 scene/status、[slot] 缺少 name
+        self.assertEqual(analyze(lower_rules(rules, slots)), [])
+        slots['order_id']['unknown'] = ['logistics', 'not_found']
+        self.assertEqual(codes(analyze(lower_rules(rules, slots))), ['undefined-target'])
+
+    def test_intent_targets_cycles_and_dead_actions(self):
+        builder = IRBuilder()
+        add_source(builder, '''
+intent a {
+    match: llm_intent: "q"
+    context: !has(x)
+    actions: [ask("x", "x?"), goto(b)]
+}
+intent b {
+    match: llm_intent: "q"
+    context: has(x)
+    actions: [reply("done"), reply("dead"), goto(a)]
+}
+intent c {
+    match: llm_intent: "q"
+    context: !has(x)
+    actions: [goto(missing)]
+}
+intent d {
+    match: llm_intent: "d"
+    context: has(x)
+    actions: [ask("y", "y?"), goto(d)]
+}
+''')
+        diagnostics = analyze(builder.build())
+        self.assertEqual(codes(diagnostics),
+                         ['undefined-target', 'shadowed-rule', 'unreachable-code', 'cycle'])
+        self.assertIn("[d]", diagnostics[-1].message)
+
+    def test_label_script_loop_through_wait_is_fine(self):
+        self.assertEqual(analyze(load_ir([REFUND_SCRIPT])), [])
+
+    def test_linear_work_on_large_rule_set(self):
+        """每条指令的后继最多被求两次（可达性 + 循环检查）；实际耗时见 benchmark.py analyzer"""
+        import analyzer
+        text = "".join(f"[rule]\nscene: s{i % 1000}\nstatus: t{i}\nask: f{i}\n"
+                       f"[rule]\nscene: s{i % 1000}\nstatus: t{i}\nreply: {{{{f{i}}}}}\n"
+                       for i in range(20_000))
+        program = lower_rules(load_dsl(text))
+        calls = []
+        successors = analyzer.successors
+
+        def counting_successors(code, pc):
+            calls.append(pc)
+            return successors(code, pc)
+
+        with patch.object(analyzer, 'successors', counting_successors):
+            diagnostics = analyze(program)
+        self.assertEqual(len(diagnostics), 20_000)  # 每对重复规则的第二条都被遮蔽
+        self.assertLessEqual(len(calls), 2 * len(program.code))
+
+
+class TestBundle(unittest.TestCase):
+    """预编译 bundle：与源文件编译结果一致，校验损坏和过期"""
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'rules.bundle')
+
+    @staticmethod
+    def snapshot(program):
+        code = [(op, None if op == ir.JUMP_IF_FALSE else a, b, c) for op, a, b, c in program.code]
+        entries = [(e.name, e.key, e.guard, e.start, e.match, e.desc, e.expect) for e in program.entries]
+        return code, entries, program.dispatch, program.unresolved, program.slots
+
+    def test_round_trip_all_dialects(self):
+        source = os.path.join(self.tmp.name, 'intents.dsl')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(INTENTS)
+        sources = [RULES_PATH, REFUND_SCRIPT, source]
+        program = bundle.compile_bundle(sources, self.path)
+        loaded = bundle.load_program(self.path)
+        self.assertEqual(self.snapshot(loaded), self.snapshot(program))
+        self.assertEqual(loaded.slots['order_id']['invalid'], ['logistics', 'invalid_order_id'])
+
+        # 加载后照样能执行（JUMP_IF_FALSE 的谓词在加载时重新编译）
+        runtime = IRRuntime(loaded, {"logistics_service": lambda args: {"status": "运输中"}})
+        session = Session(SlotSchema(()))
+        session.set("order_id", "888")
+        entry = runtime.dispatch(('intent', 'query_logistics'), session)
+        self.assertEqual(runtime.run(entry, session), ["订单 888 状态：运输中"])
+
+    def test_rules_recovered_for_prompt(self):
+        with open(RULES_PATH, encoding='utf-8') as f:
+            rules = load_dsl(f.read())
+        bundle.compile_bundle([RULES_PATH], self.path)
+        self.assertEqual(ir.rules_from_ir(bundle.load_program(self.path)), rules)
+
+    def test_corrupted_or_wrong_version_rejected(self):
+        bundle.compile_bundle([RULES_PATH], self.path)
+        with open(self.path, 'rb') as f:
+            data = bytearray(f.read())
+        data[-1] ^= 0xFF
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        with self.assertRaises(bundle.BundleError):
+            bundle.read_bundle(self.path)
+        data[4] = bundle.VERSION + 1
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        with self.assertRaisesRegex(bundle.BundleError, "版本"):
+            bundle.read_bundle(self.path)
+        self.assertFalse(bundle.is_bundle(RULES_PATH))
+
+    def test_int_sections_are_little_endian(self):
+        import struct
+        program = load_ir([RULES_PATH])
+        payload = bundle.encode_program(program)
+        (pool_len,) = struct.unpack_from('<I', payload, 0)
+        (code_len,) = struct.unpack_from('<I', payload, 4 + pool_len)
+        code = struct.unpack_from(f'<{code_len // 4}i', payload, 8 + pool_len)
+        self.assertEqual(list(code[0::4]), [op for op, _, _, _ in program.code])
+        # 按大端机器的方式读写（先交换字节序）时，文件内容与解码结果不变
+        with patch.object(bundle.sys, 'byteorder', 'big'):
+            swapped = bundle._pack(bundle._ints(payload[8 + pool_len:8 + pool_len + code_len]))
+        self.assertEqual(swapped, bytes(payload[8 + pool_len:8 + pool_len + code_len]))
+
+    def test_stale_bundle_recompiles_from_source(self):
+        source = os.path.join(self.tmp.name, 'rules.txt')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write("[rule]\nscene: a\nstatus: b\nreply: 旧\n")
+        bundle.compile_bundle([source], self.path)
+        with open(source, 'a', encoding='utf-8') as f:
+            f.write("[rule]\nscene: a\nstatus: c\nreply: 新\n")
+        _, sources, checksum = bundle.read_bundle(self.path)
+        self.assertTrue(bundle.is_stale(sources, checksum))
+        self.assertIn(('state', 'a', 'c'), bundle.load_program(self.path).dispatch)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,582 @@
+# test_qwen_client.py
+import sys
+import os
+import json
+import random
+import time
+import threading
+import unittest
+from concurrent.futures import CancelledError
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import qwen_client
+import llm_policy
+from rate_limiter import RateLimiter, RateLimited
+from dsl_loader import load_dsl
+from response_decoder import IntentState, decode_state, extract_json_object
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'rules.txt')
+
+# Generation.call 全部打了补丁，不会真正发出请求；只是让 API Key 检查通过。
+# 环境变量和 SDK 上的 api_key 只在本模块的测试期间生效，结束后恢复原值，不影响同一进程里的其他测试
+_key_patches = []
+
+
+def setUpModule():
+    _key_patches.append(patch.dict(os.environ, {"DASHSCOPE_API_KEY": "test-key"}))
+    _key_patches.append(patch.object(qwen_client.dashscope, 'api_key', "test-key"))
+    for p in _key_patches:
+        p.start()
+
+
+def tearDownModule():
+    while _key_patches:
+        _key_patches.pop().stop()
+
+
+def load_rules():
+    with open(RULES_PATH, encoding='utf-8') as f:
+        return load_dsl(f.read())
+
+
+def fake_response(content, input_tokens=100, cached_tokens=0):
+    """构造与 dashscope.Generation.call 返回值结构一致的假响应"""
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(
+        status_code=200,
+        output=SimpleNamespace(choices=[SimpleNamespace(message=message)]),
+        usage={"input_tokens": input_tokens,
+               "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+    )
+
+
+class TestPromptCache(unittest.TestCase):
+    """system prompt 只构建一次，规则变化时自动重建"""
+
+    def test_same_rules_reuse_prompt(self):
+        cache = qwen_client.PromptCache()
+        rules = load_rules()
+        first = cache.get(rules)
+        rebuilds = cache.rebuilds
+        self.assertIs(cache.get(rules), first)
+        self.assertIs(cache.get(load_rules()), first)  # 重新加载但内容相同
+        self.assertEqual(cache.rebuilds, rebuilds)
+
+    def test_rule_change_rebuilds_prompt(self):
+        cache = qwen_client.PromptCache()
+        rules = load_rules()
+        cache.get(rules)
+        rules.append({'type': 'rule', 'scene': 'invoice', 'status': 'need_title', 'actions': []})
+        self.assertIn("- invoice/need_title", cache.get(rules))
+        self.assertGreater(cache.tokens, 0)
+
+    def test_in_place_rule_edit_rebuilds_prompt(self):
+        cache = qwen_client.PromptCache()
+        rules = load_rules()
+        cache.get(rules)
+        rules[0] = {**rules[0], 'status': 'need_tracking_no'}  # 同一个列表、条数不变
+        self.assertIn("need_tracking_no", cache.get(rules))
+
+    def test_call_sends_cached_prefix_and_records_tokens(self):
+        rules = load_rules()
+        content = '{"scene":"logistics","status":"need_order_id","slots":{}}'
+        before = dict(qwen_client.prompt_stats)
+        with patch.object(qwen_client.dashscope.Generation, 'call',
+                          return_value=fake_response(content, 120, 100)) as call:
+            qwen_client.call_qwen_with_state("查物流", rules=rules)
+            qwen_client.call_qwen_with_state("我要退款", rules=rules)
+
+        first, second = (c.kwargs['messages'] for c in call.call_args_list)
+        self.assertIs(first[0]['content'], second[0]['content'])
+        self.assertEqual(qwen_client.prompt_stats['requests'] - before['requests'], 2)
+        self.assertEqual(qwen_client.prompt_stats['cached_tokens'] - before['cached_tokens'], 200)
+
+
+class TestSchemaValidation(unittest.TestCase):
+    """LLM 输出按规则推导出的 schema 校验，不合法时重问一次"""
+
+    def setUp(self):
+        self.rules = load_rules()
+
+    def test_schema_derived_from_rules(self):
+        schema = qwen_client.RuleSchema(self.rules)
+        self.assertIn(("logistics", "invalid_order_id"), schema.pairs)
+        self.assertEqual(schema.slots, ("order_id", "complaint_type", "refund_reason"))
+        prompt = qwen_client.build_system_prompt(schema)
+        self.assertIn("- refund/processing：", prompt)
+        self.assertIn("- order_id：", prompt)
+
+    def test_valid_output_single_call(self):
+        content = '{"scene":"logistics","status":"ready_to_query","slots":{"order_id":"888999","foo":"x"}}'
+        with patch.object(qwen_client.dashscope.Generation, 'call',
+                          return_value=fake_response(content)) as call:
+            state = qwen_client.call_qwen_with_state("查物流888999", rules=self.rules)
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(state, {"scene": "logistics", "status": "ready_to_query",
+                                 "slots": {"order_id": "888999"}})
+
+    def test_invalid_status_triggers_one_reask(self):
+        responses = [fake_response('{"scene":"logistics","status":"shipping","slots":{}}'),
+                     fake_response('{"scene":"logistics","status":"need_order_id","slots":{}}')]
+        with patch.object(qwen_client.dashscope.Generation, 'call', side_effect=responses) as call:
+            state = qwen_client.call_qwen_with_state("查物流", rules=self.rules)
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(state["status"], "need_order_id")
+        reask = call.call_args_list[1].kwargs['messages'][-1]['content']
+        self.assertIn("logistics/need_order_id", reask)
+
+    def test_still_invalid_falls_back(self):
+        with patch.object(qwen_client.dashscope.Generation, 'call',
+                          return_value=fake_response('不知道')) as call:
+            with patch('builtins.print'):
+                state = qwen_client.call_qwen_with_state("???", rules=self.rules)
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(state, {"scene": "other", "status": "unknown", "slots": {}})
+
+
+
+class TestResponseDecoder(unittest.TestCase):
+    """raw_decode 解析模型输出：代码块、多余文字、多个花括号、超长输出"""
+
+    STATE = {"scene": "refund", "status": "processing", "slots": {"refund_reason": "发错货了 {急}"}}
+
+    def test_plain_and_fenced(self):
+        text = json.dumps(self.STATE, ensure_ascii=False)
+        expected = IntentState("refund", "processing", {"refund_reason": "发错货了 {急}"})
+        self.assertEqual(decode_state(text), expected)
+        self.assertEqual(decode_state(f"```json\n{text}\n```"), expected)
+        self.assertEqual(decode_state(f"好的，结果如下：{text}\n以上。"), expected)
+
+    def test_first_complete_object_wins(self):
+        text = '{"scene":"logistics","status":"need_order_id","slots":{}} {"scene":"other"}'
+        self.assertEqual(decode_state(text).status, "need_order_id")
+        # 前面有不完整的花括号时跳过，继续找下一个 '{'
+        text = '说明 {不是json} 结果：{"scene":"other","status":"greeting","slots":{}}'
+        self.assertEqual(decode_state(text).status, "greeting")
+
+    def test_wrong_types_are_normalized(self):
+        state = decode_state('{"scene": 1, "status": "unknown", "slots": []}')
+        self.assertEqual(state, IntentState(None, "unknown", {}))
+
+    def test_malformed_returns_none(self):
+        for text in ("", "不知道", "{", '{"scene": "other"', "[1, 2]", "}{", "{" * 1000):
+            self.assertIsNone(decode_state(text), text)
+
+    def test_fuzz_never_raises(self):
+        rng = random.Random(20251219)
+        alphabet = '{}[]":,\\ `\nab中文0123456789'
+        valid = json.dumps(self.STATE, ensure_ascii=False)
+        for _ in range(2000):
+            noise = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+            cut = rng.randint(0, len(valid))
+            for text in (noise, noise + valid, valid[:cut] + noise):
+                result = decode_state(text)
+                self.assertTrue(result is None or isinstance(result, IntentState))
+            # 噪声里没有 '{' 时，后面跟着的合法 JSON 一定能解析出来
+            if '{' not in noise:
+                self.assertEqual(decode_state(noise + valid).scene, "refund")
+        # 随机噪声里不会出现深层嵌套；嵌套过深会让 raw_decode 超出递归深度
+        for text in ('{"a":' + '[' * 100_000, '{"a":' + '{"b":' * 100_000, '[' * 100_000 + valid):
+            result = decode_state(text)
+            self.assertTrue(result is None or isinstance(result, IntentState))
+        self.assertEqual(decode_state('{"a":' + '[' * 100_000 + ' ' + valid).scene, "refund")
+
+    def test_long_output_is_linear(self):
+        """超长输出最多尝试 MAX_ATTEMPTS 个 '{' 起点，每次都是一遍 raw_decode；实际耗时见 benchmark.py decoder"""
+        import response_decoder
+        starts = []
+        decoder = response_decoder._decoder
+
+        class CountingDecoder:
+            def raw_decode(self, text, pos):
+                starts.append(pos)
+                return decoder.raw_decode(text, pos)
+
+        valid = json.dumps(self.STATE, ensure_ascii=False)
+        with patch.object(response_decoder, '_decoder', CountingDecoder()):
+            self.assertIsNone(extract_json_object("{" * 200_000))
+            self.assertEqual(starts, list(range(response_decoder.MAX_ATTEMPTS)))
+            starts.clear()
+            self.assertEqual(extract_json_object("说明" * 200_000 + valid + "}" * 200_000), self.STATE)
+            self.assertEqual(starts, [400_000])
+
+
+class FakeLLM:
+    """
+    本地假 LLM：按模型和调用序号注入延迟或错误。和真实 SDK 一样，发出后不理会 cancel，
+    只受请求超时限制（延迟超过 timeout 时在 timeout 后抛 TimeoutError）；timeouts 记录每次收到的超时
+    """
+
+    def __init__(self, delays=None, errors=()):
+        self.delays = delays or {}   # 模型 -> 每次调用的延迟列表（用完后取最后一个）
+        self.errors = set(errors)    # 总是失败的模型
+        self.calls = []
+        self.timeouts = []
+
+    def __call__(self, model, cancel, timeout):
+        n = sum(1 for m in self.calls if m == model)
+        self.calls.append(model)
+        self.timeouts.append(timeout)
+        delays = self.delays.get(model, [0.0])
+        delay = delays[min(n, len(delays) - 1)]
+        time.sleep(min(delay, timeout))
+        if delay > timeout:
+            raise TimeoutError(f"{model} 请求超时")
+        if model in self.errors:
+            raise RuntimeError(f"{model} 500")
+        return f"{model}#{n}"
+
+
+class TestLLMPolicy(unittest.TestCase):
+    """对冲、降级、熔断，使用注入延迟的假 LLM"""
+
+    def make(self, **kwargs):
+        kwargs.setdefault("tiers", (("max", 2.0), ("turbo", 2.0)))
+        policy = llm_policy.LLMPolicy(**kwargs)
+        self.addCleanup(policy.close)
+        return policy
+
+    def test_hedge_wins_and_loser_abandoned(self):
+        policy = self.make(default_hedge_delay=0.05)
+        fake = FakeLLM({"max": [1.0, 0.01]})
+        start = time.perf_counter()
+        self.assertEqual(policy.call(fake), "max#1")
+        self.assertLess(time.perf_counter() - start, 0.5)
+        snapshot = policy.snapshot()
+        self.assertEqual((snapshot["hedges"], snapshot["hedge_wins"]), (1, 1))
+        self.assertEqual(snapshot["hedge_count"], 1)
+        # 还在跑的主请求只能放弃，它的请求超时不超过梯队时间，对冲请求的超时是剩余时间
+        self.assertEqual(snapshot["abandoned"], 1)
+        self.assertEqual(fake.timeouts[0], 2.0)
+        self.assertLess(fake.timeouts[1], 2.0)
+
+    def test_sdk_request_bounded_by_tier_time(self):
+        policy = self.make(tiers=(("max", 0.5), ("turbo", 1.0)), hedge=False)
+        cancel = threading.Event()
+        with patch.object(qwen_client, 'llm_policy', policy), \
+                patch.object(qwen_client.dashscope.Generation, 'call',
+                             return_value=fake_response('{"scene": "other", "status": "greeting", "slots": {}}')) as call:
+            qwen_client._generate([{"role": "user", "content": "你好"}])
+            self.assertEqual(call.call_args.kwargs['request_timeout'], 0.5)
+            cancel.set()
+            with self.assertRaises(CancelledError):
+                qwen_client._request([], "max", cancel, 1.0)
+        self.assertEqual(call.call_count, 1)  # 已经输掉的请求不再发出
+
+    def test_hedge_delay_follows_p95(self):
+        policy = self.make(min_samples=10, min_hedge_delay=0.01)
+        for i in range(100):
+            policy.latency.add(i / 100)
+        self.assertAlmostEqual(policy.hedge_delay(), 0.95)
+        fast = FakeLLM()
+        policy.call(fast)
+        self.assertEqual((fast.calls, policy.metrics["hedges"]), (["max"], 0))
+
+    def test_timeout_falls_back_to_cheaper_tier(self):
+        policy = self.make(tiers=(("max", 0.1), ("turbo", 1.0)), hedge=False)
+        fake = FakeLLM({"max": [1.0]})
+        self.assertEqual(policy.call(fake), "turbo#0")
+        self.assertEqual((policy.metrics["timeouts"], policy.metrics["fallbacks"]), (1, 1))
+        self.assertEqual(policy.snapshot()["fallback_count"], 1)
+
+    def test_breaker_opens_then_half_open_recovers(self):
+        now = [0.0]
+        breaker = llm_policy.CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        policy = self.make(breaker=breaker)
+        broken = FakeLLM(errors=("max", "turbo"))
+        with self.assertRaises(llm_policy.UpstreamUnavailable):
+            policy.call(broken)
+        self.assertTrue(policy.rule_only)
+        with self.assertRaises(llm_policy.UpstreamUnavailable):
+            policy.call(broken)
+        self.assertEqual(len(broken.calls), 2)  # 熔断期间不再请求上游
+        self.assertEqual(policy.metrics["short_circuited"], 1)
+
+        now[0] = 31
+        self.assertEqual(policy.call(FakeLLM()), "max#0")
+        self.assertEqual(breaker.state, llm_policy.CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        now = [0.0]
+        breaker = llm_policy.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        policy = self.make(breaker=breaker, hedge=False)
+        with self.assertRaises(llm_policy.UpstreamUnavailable):
+            policy.call(FakeLLM(errors=("max", "turbo")))
+        self.assertEqual(breaker.state, llm_policy.CircuitBreaker.OPEN)
+
+        now[0] = 31
+        started, release = threading.Event(), threading.Event()
+
+        def probe(model, cancel, timeout):
+            started.set()
+            release.wait(5)
+            return model
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(policy.call(probe)))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        # 试探请求还没有结果：同时到来的请求不会打到上游
+        other = FakeLLM()
+        with self.assertRaises(llm_policy.UpstreamUnavailable):
+            policy.call(other)
+        self.assertEqual(other.calls, [])
+        release.set()
+        thread.join(5)
+        self.assertEqual(results, ["max"])
+        self.assertEqual(breaker.state, llm_policy.CircuitBreaker.CLOSED)
+        self.assertEqual(policy.call(other), "max#0")
+
+    def test_lost_probe_expires(self):
+        now = [0.0]
+        breaker = llm_policy.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        now[0] = 62  # 试探请求一直没有报告结果
+        self.assertTrue(breaker.allow())
+
+    def test_api_error_does_not_crash_turn(self):
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+
+        rules = load_rules()
+        error = SimpleNamespace(status_code=500, code="InternalError", message="boom")
+        policy = self.make(tiers=(("max", 1.0), ("turbo", 1.0)))
+        with patch.object(qwen_client, 'llm_policy', policy), \
+                patch.object(qwen_client, 'rate_limiter', RateLimiter()), \
+                patch.object(qwen_client.dashscope.Generation, 'call', return_value=error) as call:
+            replies = handle_turn(IRRuntime(lower_rules(rules)), Session(SlotSchema.from_rules(rules)),
+                                  "查物流", lambda text: qwen_client.call_qwen_with_state(text, rules=rules))
+        self.assertEqual([c.kwargs['model'] for c in call.call_args_list], ["max", "turbo"])
+        self.assertIn("我不太确定您的需求", replies[0])
+        self.assertEqual(policy.metrics["rule_only"], 1)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """相同的并发识别请求只调用一次上游，结果分发给所有等待者"""
+
+    def run_concurrently(self, fn, n):
+        import threading
+        barrier = threading.Barrier(n)
+        results = [None] * n
+
+        def worker(i):
+            barrier.wait()
+            try:
+                results[i] = fn(i)
+            except BaseException as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_identical_requests_share_one_call(self):
+        rules = load_rules()
+        content = '{"scene":"logistics","status":"ready_to_query","slots":{"order_id":"888999"}}'
+
+        def slow_llm(**kwargs):
+            time.sleep(0.2)
+            return fake_response(content)
+
+        flights = qwen_client.SingleFlight()
+        with patch.object(qwen_client, 'single_flight', flights), \
+                patch.object(qwen_client.dashscope.Generation, 'call', side_effect=slow_llm) as call:
+            texts = ["查物流 888999", " 查物流  888999 "]
+            results = self.run_concurrently(
+                lambda i: qwen_client.call_qwen_with_state(texts[i % 2], rules=rules), 8)
+        self.assertEqual(call.call_count, 1)
+        self.assertTrue(all(r == results[0] for r in results))
+        self.assertEqual(results[0]["slots"], {"order_id": "888999"})
+        self.assertIsNot(results[0]["slots"], results[1]["slots"])
+        self.assertEqual(flights.stats, {"calls": 8, "upstream": 1, "coalesced": 7, "errors": 0})
+        self.assertAlmostEqual(flights.saved(), 7 / 8)
+
+    def test_error_fans_out_and_is_not_cached(self):
+        flights = qwen_client.SingleFlight()
+        calls = []
+
+        def failing():
+            calls.append(1)
+            time.sleep(0.1)
+            raise llm_policy.UpstreamUnavailable("LLM 不可用")
+
+        results = self.run_concurrently(lambda i: flights.do("查物流", failing), 4)
+        self.assertTrue(all(isinstance(r, llm_policy.UpstreamUnavailable) for r in results))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.do("查物流", lambda: "ok"), "ok")
+        self.assertEqual(flights.stats["errors"], 1)
+
+    def test_cancelled_leader_does_not_cancel_waiters(self):
+        from concurrent.futures import CancelledError
+        flights = qwen_client.SingleFlight()
+        attempts = []
+
+        def fn():
+            attempts.append(1)
+            time.sleep(0.1)
+            if len(attempts) == 1:
+                raise CancelledError()
+            return "ok"
+
+        results = self.run_concurrently(lambda i: flights.do("k", fn), 4)
+        self.assertEqual(sum(isinstance(r, CancelledError) for r in results), 1)
+        self.assertEqual(results.count("ok"), 3)
+        self.assertEqual(len(attempts), 2)
+
+    def test_waiter_timeout_leaves_leader_running(self):
+        flights = qwen_client.SingleFlight()
+
+        def fn(i):
+            if i == 0:
+                return flights.do("k", lambda: time.sleep(0.3) or "ok")
+            time.sleep(0.05)
+            return flights.do("k", lambda: "never", timeout=0.05)
+
+        results = self.run_concurrently(fn, 2)
+        self.assertEqual(results[0], "ok")
+        self.assertIsInstance(results[1], TimeoutError)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """请求数 / token 数令牌桶，按会话公平排队，超过截止时间丢弃"""
+
+    def test_token_bucket_refills_over_time(self):
+        from rate_limiter import TokenBucket
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        bucket.take(2)
+        self.assertAlmostEqual(bucket.wait_time(1), 0.5)
+        self.assertAlmostEqual(bucket.wait_time(5), 1.0)  # 超过容量的请求等到桶满即可
+        now[0] = 0.5
+        self.assertEqual(bucket.wait_time(1), 0)
+
+    def test_chatty_session_does_not_starve_others(self):
+        import threading
+        limiter = RateLimiter(requests_per_sec=20, burst=1)
+        order = []
+
+        def send(session):
+            limiter.acquire(session)
+            order.append(session)
+
+        threads = [threading.Thread(target=send, args=("chatty",)) for _ in range(6)]
+        for t in threads:
+            t.start()
+        time.sleep(0.02)
+        depth = limiter.snapshot()["queue_depth"]
+        others = [threading.Thread(target=send, args=("quiet",)) for _ in range(2)]
+        for t in others:
+            t.start()
+        for t in threads + others:
+            t.join()
+
+        self.assertGreater(depth, 0)
+        # 轮转：quiet 的两个请求不会排在 chatty 的全部积压之后
+        self.assertLessEqual(order.index("quiet"), 2)
+        self.assertLess(len(order) - 1 - order[::-1].index("quiet"), 5)
+        snapshot = limiter.snapshot()
+        self.assertEqual((snapshot["granted"], snapshot["queue_depth"]), (8, 0))
+        self.assertIsNotNone(snapshot["wait_p95"])
+
+    def test_deadline_drops(self):
+        import threading
+        limiter = RateLimiter(requests_per_sec=1, burst=1)
+        limiter.acquire("a")
+        with self.assertRaises(RateLimited):   # 预计要等 1s，截止时间只有 0.1s
+            limiter.acquire("b", deadline=time.monotonic() + 0.1)
+
+        # 排队途中实际用量超出预估，等不到截止时间也会被丢弃
+        limiter = RateLimiter(requests_per_sec=100, tokens_per_min=600)
+        limiter.acquire("a", tokens=600)
+        errors = []
+        waiter = threading.Thread(target=lambda: self.assertRaises(
+            RateLimited, limiter.acquire, "b", 5, time.monotonic() + 0.8) or errors.append(1))
+        waiter.start()
+        time.sleep(0.05)
+        limiter.settle(0, 100)
+        waiter.join()
+        self.assertEqual(errors, [1])
+        self.assertEqual(limiter.snapshot()["dropped"], 1)
+        self.assertEqual(limiter.snapshot()["queue_depth"], 0)
+
+    def test_try_acquire_never_jumps_the_queue(self):
+        limiter = RateLimiter(requests_per_sec=10, burst=2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual(limiter.metrics["denied"], 1)
+
+    def test_hedge_skipped_without_quota(self):
+        policy = llm_policy.LLMPolicy(tiers=(("max", 1.0),), default_hedge_delay=0.05)
+        self.addCleanup(policy.close)
+        fake = FakeLLM({"max": [0.2]})
+        self.assertEqual(policy.call(fake, admit=lambda: False), "max#0")
+        self.assertEqual((policy.metrics["hedges"], policy.metrics["not_admitted"]), (0, 1))
+
+    def test_quota_exhausted_turn_uses_rules(self):
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+
+        rules = load_rules()
+        limiter = RateLimiter(requests_per_sec=0.05, burst=1)
+        limiter.acquire()
+        with patch.object(qwen_client, 'rate_limiter', limiter), \
+                patch.object(qwen_client.dashscope.Generation, 'call') as call:
+            replies = handle_turn(IRRuntime(lower_rules(rules)), Session(SlotSchema.from_rules(rules)),
+                                  "查物流 101", lambda text: qwen_client.call_qwen_with_state(text, rules=rules))
+        call.assert_not_called()
+        self.assertIn("我不太确定您的需求", replies[0])
+        self.assertEqual(limiter.metrics["dropped"], 1)
+
+
+class TestLazySDK(unittest.TestCase):
+    """DashScope SDK 第一次真正调用 LLM 时才导入，API Key 在调用时才检查"""
+
+    def run_python(self, code, cwd):
+        import subprocess
+        env = {k: v for k, v in os.environ.items() if k != "DASHSCOPE_API_KEY"}
+        return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env,
+                              capture_output=True, text=True, timeout=60)
+
+    def test_entry_points_import_without_sdk_or_key(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        check = "import sys; import {}; print('dashscope' in sys.modules)"
+        result = self.run_python(check.format("main"), here)
+        self.assertEqual(result.stdout.strip(), "False", result.stderr)
+        result = self.run_python(check.format("interpreter"), os.path.join(os.path.dirname(here), "12.6"))
+        self.assertEqual(result.stdout.strip(), "False", result.stderr)
+
+    def test_missing_key_falls_back_to_rules(self):
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+
+        rules = load_rules()
+        env = {k: v for k, v in os.environ.items() if k != "DASHSCOPE_API_KEY"}
+        with patch.dict(os.environ, env, clear=True), \
+                patch.object(qwen_client.dashscope, 'api_key', None), \
+                patch.object(qwen_client.dashscope.Generation, 'call') as call:
+            with self.assertRaises(qwen_client.LLMNotConfigured):
+                qwen_client.call_qwen_with_state("查物流", rules=rules)
+            replies = handle_turn(IRRuntime(lower_rules(rules)), Session(SlotSchema.from_rules(rules)),
+                                  "查物流", lambda text: qwen_client.call_qwen_with_state(text, rules=rules))
+        call.assert_not_called()
+        self.assertIn("我不太确定您的需求", replies[0])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,6 +1,7 @@
 # test_unit.py
 import sys
 import os
+import builtins
 import unittest
 from unittest.mock import patch
 from io import StringIO
@@ -13,7 +14,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 def run_conversation_with_mock(user_inputs, mock_return_value):
     """
     模拟一次完整的对话流程，使用 mock 替代 Qwen 调用。
-    每次调用前会清空全局 context，确保测试隔离。
+    main_v2 每次运行都新建会话，测试之间互不影响。
     """
     inputs = iter(user_inputs)
     
@@ -27,22 +28,18 @@ def run_conversation_with_mock(user_inputs, mock_return_value):
     
     with redirect_stdout(output), redirect_stderr(output):
         # 替换内置 input 函数
-        original_input = __builtins__.input
-        __builtins__.input = fake_input
+        original_input = builtins.input
+        builtins.input = fake_input
 
         try:
-            # 关键：导入并清空 main 中的全局 context
-            from main import context
-            context.clear()  # 清除上一次测试残留数据
-
-            # 打补丁：替换 LLM 调用为预设返回值
-            with patch('qwen_client.call_qwen_with_state', return_value=mock_return_value):
+            # 打补丁：替换 LLM 调用为预设返回值（main 中是 from-import，需要在 main 上打补丁）
+            with patch('main.call_qwen_with_state', return_value=mock_return_value):
                 from main import main_v2
                 main_v2()
 
         finally:
             # 恢复原始 input
-            __builtins__.input = original_input
+            builtins.input = original_input
 
     return output.getvalue()
 
@@ -142,6 +139,614 @@ class TestCustomerServiceWithStubs(unittest.TestCase):
         self.assertIn("您好请问有什么可以帮到你的吗？我可以为您查物流，同时负责投诉和退款问题呢", result)
 
 
+
+class TestSession(unittest.TestCase):
+    """紧凑会话对象：槽位表来自规则，接口与 Context 保持一致"""
+
+    def setUp(self):
+        from dsl_loader import load_dsl
+        from session import SlotSchema
+        with open(os.path.join(os.path.dirname(__file__), 'rules.txt'), encoding='utf-8') as f:
+            self.schema = SlotSchema.from_rules(load_dsl(f.read()))
+
+    def test_schema_collects_slot_keys(self):
+        for key in ('order_id', 'complaint_type', 'refund_reason'):
+            self.assertIn(key, self.schema.keys)
+
+    def test_slot_keys_are_interned(self):
+        key = ''.join(['order', '_id'])
+        self.assertIs(sys.intern(key), self.schema.keys[self.schema.index['order_id']])
+
+    def test_set_render_and_clear(self):
+        from session import Session
+        session = Session(self.schema)
+        session.set('order_id', '888999')
+        session.set('coupon', 'A1')  # 规则中未出现的槽位
+        self.assertEqual(session.render("正在查询 {{order_id}}，{{coupon}}，{{x}}"), "正在查询 888999，A1，{{x}}")
+        self.assertEqual(session.data, {'order_id': '888999', 'coupon': 'A1'})
+        session.clear()
+        self.assertEqual(session.data, {})
+        self.assertFalse(session.has('order_id'))
+
+    def test_history_is_bounded(self):
+        from session import Session, ROLE_USER, ROLE_ASSISTANT, MAX_HISTORY
+        session = Session(self.schema)
+        for i in range(MAX_HISTORY + 5):
+            session.add_message(ROLE_USER if i % 2 == 0 else ROLE_ASSISTANT, str(i))
+        self.assertEqual(len(session.history), MAX_HISTORY)
+        self.assertEqual(session.messages()[-1], {"role": "user", "content": str(MAX_HISTORY + 4)})
+
+
+class TestStreamingLoader(unittest.TestCase):
+    """mmap 流式加载：结果与 load_dsl 一致，逐条产出规则"""
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, data):
+        path = os.path.join(self.tmp.name, 'rules.txt')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_same_result_as_load_dsl(self):
+        from dsl_loader import load_dsl, iter_dsl_file
+        path = os.path.join(os.path.dirname(__file__), 'rules.txt')
+        with open(path, encoding='utf-8') as f:
+            expected = load_dsl(f.read())
+        self.assertEqual(list(iter_dsl_file(path)), expected)
+
+    def test_yields_rule_by_rule(self):
+        from dsl_loader import iter_dsl_file
+        text = "[rule]\r\nscene: a\r\nstatus: b\r\nreply: 你好\r\n[rule]\nscene: c\nprompt: x"
+        errors = []
+        rules = iter_dsl_file(self.write(text.encode('utf-8')), errors)
+        first = next(rules)
+        self.assertEqual(first['actions'], [{'type': 'reply', 'message': '你好'}])
+        self.assertEqual(errors, [])  # 第二条规则还没有解析
+        self.assertEqual(next(rules)['scene'], 'c')
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(list(iter_dsl_file(self.write(b''))), [])
+
+
+class TestPendingFieldPredictor(unittest.TestCase):
+    """回答 pending 字段时按规则图本地推断下一状态，不确定时才交给 LLM 复核"""
+
+    def setUp(self):
+        from dsl_loader import iter_dsl_file
+        self.rules = list(iter_dsl_file(os.path.join(os.path.dirname(__file__), 'rules.txt')))
+
+    def make(self, **kwargs):
+        from predictor import PendingFieldPredictor
+        predictor = PendingFieldPredictor(self.rules, **kwargs)
+        self.addCleanup(predictor.close)
+        return predictor
+
+    def test_matching_answer_resolved_locally(self):
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+
+        def classify(text):
+            calls.append(text)
+            return {"scene": "logistics", "status": "need_order_id", "slots": {}}
+
+        calls = []
+        predictor = self.make()
+        runtime = IRRuntime(lower_rules(self.rules))
+        session = Session(SlotSchema.from_rules(self.rules))
+        handle_turn(runtime, session, "查物流", classify, predictor)
+        replies = handle_turn(runtime, session, "888999", classify, predictor)
+        self.assertEqual(replies, ['"正在查询 888999 的物流信息..."'])
+        self.assertEqual(calls, ["查物流"])
+        self.assertEqual(predictor.stats["local"], 1)
+
+    def test_mismatch_verified_by_llm(self):
+        predictor = self.make()
+        llm_state = {"scene": "refund", "status": "need_reason", "slots": {}}
+        self.assertEqual(predictor.resolve("order_id", "算了我要退款", lambda text: llm_state), llm_state)
+        self.assertEqual(predictor.stats["llm"], 1)
+
+    def test_slow_or_failing_llm_falls_back_to_prediction(self):
+        import time
+        predictor = self.make(timeout=0.05)
+
+        def slow(text):
+            time.sleep(0.5)
+            return {"scene": "other", "status": "unknown", "slots": {}}
+
+        def broken(text):
+            raise RuntimeError("API 调用失败")
+
+        self.assertEqual(predictor.resolve("order_id", "SF123", slow)["status"], "invalid_order_id")
+        self.assertEqual(predictor.resolve("refund_reason", "发错货了", broken)["status"], "processing")
+        self.assertEqual((predictor.stats["timeouts"], predictor.stats["errors"]), (1, 1))
+
+    def test_no_prediction_calls_llm_directly(self):
+        predictor = self.make()
+        self.assertIsNone(predictor.predict("complaint_type", "太慢了"))  # 不符合 expect，也没有其他去向
+        state = predictor.resolve("unknown_field", "x", lambda text: {"scene": "other"})
+        self.assertEqual(state, {"scene": "other"})
+
+
+
+def _stub_classify(user_input):
+    """工作进程里使用的测试桩：纯数字视为订单号，其余视为查物流"""
+    if user_input.isdigit():
+        return {"scene": "logistics", "status": "ready_to_query", "slots": {}}
+    return {"scene": "logistics", "status": "need_order_id", "slots": {}}
+
+
+def _crashing_classify(user_input):
+    """意图识别抛出非 UpstreamUnavailable 异常的测试桩"""
+    if user_input == "崩溃":
+        raise ValueError("boom")
+    return _stub_classify(user_input)
+
+
+def _no_digits_classify(user_input):
+    """纯数字的回答应当由 predictor 在本地推断，走到 LLM 就报错"""
+    if user_input.isdigit():
+        raise ValueError("pending 字段的回答不应交给 LLM")
+    return _stub_classify(user_input)
+
+
+class _RecordingTurnLog:
+    """代替 TurnLogWriter，记录 append 的参数"""
+
+    def __init__(self):
+        self.rows = []
+
+    def append(self, *row):
+        self.rows.append(row)
+
+
+class TestIntentModel(unittest.TestCase):
+    """用 LLM 标注训练的本地意图分类器，以及放在 LLM 前面的 LocalIntentClassifier"""
+
+    SAMPLES = [
+        ("帮我查一下物流", "logistics", "need_order_id", False),
+        ("我的快递到哪了", "logistics", "need_order_id", False),
+        ("查物流，订单号888999", "logistics", "ready_to_query", True),
+        ("订单123456的包裹到哪了", "logistics", "ready_to_query", True),
+        ("我要投诉", "complaint", "need_type", False),
+        ("我想投诉一下", "complaint", "need_type", False),
+        ("我要退款", "refund", "need_reason", False),
+        ("申请退钱", "refund", "need_reason", False),
+        ("你好", "other", "greeting", False),
+        ("在吗", "other", "greeting", False),
+    ]
+
+    def setUp(self):
+        from intent_model import train
+        self.model = train(self.SAMPLES)
+
+    def label(self, text):
+        best, confidence = self.model.predict([text])
+        return self.model.labels[best[0]], float(confidence[0])
+
+    def test_predicts_unseen_variants(self):
+        self.assertEqual(self.label("麻烦查下物流")[0], "logistics/need_order_id")
+        self.assertEqual(self.label("你好呀")[0], "other/greeting")
+        self.assertEqual(self.label("快递单号654321")[0], "logistics/ready_to_query")
+
+    def test_batch_matches_single_and_roundtrip(self):
+        import tempfile
+        import numpy as np
+        from intent_model import IntentModel
+
+        texts = ["我要投诉", "", "申请退款", "在吗在吗"]
+        batch = self.model.scores(texts)
+        single = np.vstack([self.model.scores([t]) for t in texts])
+        np.testing.assert_allclose(batch, single, atol=1e-6)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.npz')
+            self.model.save(path)
+            loaded = IntentModel.load(path)
+        np.testing.assert_allclose(loaded.scores(texts), batch)
+        self.assertEqual(loaded.labels, self.model.labels)
+
+    def test_local_classifier_routes_by_confidence_and_slots(self):
+        import json
+        import tempfile
+        from intent_model import LocalIntentClassifier
+
+        llm_state = {"scene": "logistics", "status": "ready_to_query", "slots": {"order_id": "654321"}}
+        calls = []
+
+        def llm(text):
+            calls.append(text)
+            return llm_state
+
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, 'labels.jsonl')
+            classify = LocalIntentClassifier(self.model, llm, threshold=0.5, log_path=log_path)
+            self.assertEqual(classify("我要投诉"), {"scene": "complaint", "status": "need_type", "slots": {}})
+            # 带槽位的类别只能由 LLM 提取槽位
+            self.assertEqual(classify("快递单号654321"), llm_state)
+            self.assertEqual(LocalIntentClassifier(self.model, llm, threshold=1.01)("我要投诉"), llm_state)
+            with open(log_path, encoding='utf-8') as f:
+                logged = [json.loads(line) for line in f]
+
+        self.assertEqual(calls, ["快递单号654321", "我要投诉"])
+        self.assertEqual(classify.stats, {"local": 1, "llm": 1})
+        self.assertEqual(logged, [{"utterance": "快递单号654321", **llm_state}])
+
+
+class TestWorkerPool(unittest.TestCase):
+    """多进程会话池：同一会话始终落在同一工作进程，上下文跨轮保留；前端和 main_v2 一样经过准入控制"""
+
+    def setUp(self):
+        from dsl_loader import load_dsl
+        with open(os.path.join(os.path.dirname(__file__), 'rules.txt'), encoding='utf-8') as f:
+            self.rules = load_dsl(f.read())
+
+    def test_session_affinity_keeps_context(self):
+        from worker_pool import WorkerPool
+        rules = self.rules
+
+        with WorkerPool(rules, classify=_stub_classify, num_workers=2) as pool:
+            first = pool.handle_batch([("a", "查物流"), ("b", "查物流")])
+            second = pool.handle_batch([("a", "111111"), ("b", "222222")])
+
+        self.assertIn("请问您的订单号是？", first[0][0])
+        self.assertIn("正在查询 111111 的物流信息...", second[0][0])
+        self.assertIn("正在查询 222222 的物流信息...", second[1][0])
+
+    def test_turn_error_does_not_kill_worker(self):
+        from turn_handler import FALLBACK_REPLY
+        from worker_pool import WorkerPool
+        rules = self.rules
+
+        with WorkerPool(rules, classify=_crashing_classify, num_workers=1) as pool:
+            first = pool.handle_batch([("a", "查物流"), ("b", "崩溃"), ("c", "查物流")])
+            second = pool.handle_batch([("a", "111111")])
+            self.assertTrue(all(p.is_alive() for p in pool.processes))
+
+        self.assertEqual(first[1], [FALLBACK_REPLY])
+        self.assertIn("请问您的订单号是？", first[2][0])
+        self.assertIn("正在查询 111111 的物流信息...", second[0][0])  # 同一进程上的会话还在
+
+    def test_overload_replies_busy_without_dispatch(self):
+        from admission import AdmissionController
+        from worker_pool import WorkerPool
+        admission = AdmissionController(max_in_flight=1, max_queue=0)
+        turn_log = _RecordingTurnLog()
+        with WorkerPool(self.rules, classify=_stub_classify, num_workers=1,
+                        admission=admission, turn_log=turn_log) as pool:
+            with admission.slot():  # 名额被占满，队列长度为 0
+                shed = pool.handle_batch([("a", "查物流"), ("b", "查物流")])
+            after = pool.handle("a", "查物流")
+
+        self.assertEqual(len(shed), 2)
+        self.assertTrue(all("当前咨询人数较多，请稍后再试~" in replies[0] for replies in shed))
+        self.assertEqual(admission.metrics["shed_queue_full"], 1)
+        self.assertEqual([row[2:4] for row in turn_log.rows], [("system", "shed")] * 2 + [("logistics", "need_order_id")])
+        self.assertIn("请问您的订单号是？", after[0])  # 被拒绝的轮次没有进入会话
+
+    def test_workers_use_predictor_and_turn_log(self):
+        from worker_pool import WorkerPool
+        turn_log = _RecordingTurnLog()
+        with WorkerPool(self.rules, classify=_no_digits_classify, num_workers=2, turn_log=turn_log) as pool:
+            pool.handle("a", "查物流")
+            replies = pool.handle("a", "888999")
+
+        self.assertIn("正在查询 888999 的物流信息...", replies[0])
+        self.assertEqual([row[2:4] for row in turn_log.rows],
+                         [("logistics", "need_order_id"), ("logistics", "ready_to_query")])
+        self.assertEqual(turn_log.rows[1][5], "888999")
+
+    def test_concurrent_callers_get_their_own_replies(self):
+        import threading
+        from worker_pool import WorkerPool
+        results = {}
+
+        def converse(pool, i):
+            pool.handle(f"s{i}", "查物流")
+            results[i] = pool.handle(f"s{i}", f"{100000 + i}")[0]
+
+        with WorkerPool(self.rules, classify=_stub_classify, num_workers=2, max_pending=1) as pool:
+            threads = [threading.Thread(target=converse, args=(pool, i)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        for i in range(8):
+            self.assertIn(f"正在查询 {100000 + i} 的物流信息...", results[i])
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """有界并发 + 有界队列：过载时回复 system/busy 规则，延迟不随负载无限增长"""
+
+    def setUp(self):
+        from dsl_loader import iter_dsl_file
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import SlotSchema
+        self.rules = list(iter_dsl_file(os.path.join(os.path.dirname(__file__), 'rules.txt')))
+        self.runtime = IRRuntime(lower_rules(self.rules))
+        self.schema = SlotSchema.from_rules(self.rules)
+
+    def test_queue_budget_adapts_to_latency(self):
+        from admission import AdaptiveSLO
+        slo = AdaptiveSLO(turn_slo=1.0, min_wait=0.1, max_wait=0.5)
+        self.assertEqual(slo.queue_budget(), 0.5)
+        for _ in range(10):
+            slo.observe(0.7)
+        self.assertAlmostEqual(slo.queue_budget(), 0.3)
+        for _ in range(50):
+            slo.observe(2.0)  # LLM 变慢：排队预算收紧到下限
+        self.assertEqual(slo.queue_budget(), 0.1)
+
+    def test_overload_sheds_load_with_bounded_latency(self):
+        import time
+        import threading
+        from admission import AdmissionController, AdaptiveSLO
+        from session import Session
+
+        def slow_classify(text):
+            time.sleep(0.05)
+            return {"scene": "logistics", "status": "need_order_id", "slots": {}}
+
+        admission = AdmissionController(max_in_flight=2, max_queue=4,
+                                        slo=AdaptiveSLO(turn_slo=0.3, min_wait=0.05, max_wait=0.2))
+        offered = 40  # 约为处理能力的 10 倍
+        barrier = threading.Barrier(offered)
+        results = [None] * offered
+
+        def turn(i):
+            session = Session(self.schema)
+            barrier.wait()
+            start = time.monotonic()
+            replies = admission.handle(self.runtime, session, "查物流", slow_classify)
+            results[i] = (replies, time.monotonic() - start)
+
+        threads = [threading.Thread(target=turn, args=(i,)) for i in range(offered)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        busy = [replies for replies, _ in results if replies == ['"当前咨询人数较多，请稍后再试~"']]
+        served = [replies for replies, _ in results if "请问您的订单号是？" in replies[0]]
+        self.assertEqual(len(busy) + len(served), offered)
+        self.assertGreaterEqual(len(served), 2)
+        self.assertGreater(len(busy), offered // 2)
+        # 排队不超过预算 0.2s，加上一次处理耗时
+        self.assertLess(max(latency for _, latency in results), 0.5)
+        snapshot = admission.snapshot()
+        self.assertEqual(snapshot["admitted"], len(served))
+        self.assertEqual(snapshot["shed_queue_full"] + snapshot["shed_slo"], len(busy))
+        self.assertLessEqual(snapshot["max_queue_depth"], 4)
+        self.assertEqual((snapshot["in_flight"], snapshot["queue_depth"]), (0, 0))
+
+    def test_busy_reply_without_rule_and_not_sent_to_llm(self):
+        from dsl_loader import RuleSchema
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session
+        from turn_handler import busy_reply, BUSY_REPLY
+
+        plain = [rule for rule in self.rules if rule.get('scene') != 'system']
+        self.assertEqual(busy_reply(IRRuntime(lower_rules(plain)), Session(self.schema)), [BUSY_REPLY])
+        self.assertNotIn(('system', 'busy'), RuleSchema(self.rules).pairs)
+
+
+class TestSlotValidator(unittest.TestCase):
+    """[slot] 本地校验：格式不对 / 不在已知 ID 快照里的值直接转到 invalid 状态，不调用 LLM"""
+
+    def setUp(self):
+        import tempfile
+        from dsl_loader import iter_dsl_file
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.slots = {}
+        self.rules = list(iter_dsl_file(os.path.join(os.path.dirname(__file__), 'rules.txt'), slots=self.slots))
+
+    def runtime(self, **order_id):
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        slots = {'order_id': {**self.slots['order_id'], **order_id}}
+        return IRRuntime(lower_rules(self.rules, slots))
+
+    def test_known_id_index(self):
+        from slot_validator import KnownIdIndex
+        path = os.path.join(self.tmp.name, 'known.idx')
+        KnownIdIndex.from_ids(["123456", "000123", "SF1001", "123456"]).save(path)
+        index = KnownIdIndex.load(path)
+        self.assertEqual(len(index), 3)
+        self.assertIn("123456", index)
+        self.assertIn("SF1001", index)
+        self.assertIn("000123", index)
+        self.assertNotIn("123", index)  # 与 000123 数值相同但位数不同
+        self.assertNotIn("654321", index)
+        self.assertNotIn("SF1002", index)
+
+    def test_malformed_answer_rejected_without_llm(self):
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+
+        calls = []
+
+        def classify(text):
+            calls.append(text)
+            return {"scene": "logistics", "status": "need_order_id", "slots": {}}
+
+        runtime = self.runtime()
+        session = Session(SlotSchema.from_rules(self.rules))
+        handle_turn(runtime, session, "查物流", classify)
+        self.assertEqual(handle_turn(runtime, session, "SF123", classify), ['"您再确定一下订单号，这里没查到你的订单"'])
+        self.assertEqual(calls, ["查物流"])
+        self.assertIsNone(session.get("order_id"))
+
+        # LLM 直接给出的槽位也要本地校验：5 位订单号不能进入 ready_to_query
+        llm = lambda text: {"scene": "logistics", "status": "ready_to_query", "slots": {"order_id": "12345"}}
+        self.assertEqual(handle_turn(runtime, session, "查订单12345", llm), ['"您再确定一下订单号，这里没查到你的订单"'])
+
+    def test_topic_switch_while_asking_goes_to_llm(self):
+        from session import Session, SlotSchema
+        from predictor import PendingFieldPredictor
+        from turn_handler import handle_turn
+
+        states = {"查物流": {"scene": "logistics", "status": "need_order_id", "slots": {}},
+                  "算了，我要退款": {"scene": "refund", "status": "need_reason", "slots": {}}}
+        calls = []
+
+        def classify(text):
+            calls.append(text)
+            return states[text]
+
+        runtime = self.runtime()
+        for predictor in (None, PendingFieldPredictor(self.rules)):
+            calls.clear()
+            session = Session(SlotSchema.from_rules(self.rules))
+            handle_turn(runtime, session, "查物流", classify, predictor)
+            replies = handle_turn(runtime, session, "算了，我要退款", classify, predictor)
+            self.assertEqual(calls, ["查物流", "算了，我要退款"])
+            self.assertNotIn('"您再确定一下订单号，这里没查到你的订单"', replies)
+            self.assertTrue(any("退款" in msg for msg in replies), replies)
+            self.assertIsNone(session.get("order_id"))
+            if predictor is not None:
+                predictor.close()
+
+    def test_unknown_id_rejected_with_snapshot(self):
+        from slot_validator import KnownIdIndex
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+
+        path = os.path.join(self.tmp.name, 'known.idx')
+        KnownIdIndex.from_ids(["888999"]).save(path)
+        runtime = self.runtime(known=path)
+        llm = lambda text: {"scene": "logistics", "status": "ready_to_query", "slots": {"order_id": text[-6:]}}
+        session = Session(SlotSchema.from_rules(self.rules))
+        self.assertEqual(handle_turn(runtime, session, "查物流111222", llm), ['"您再确定一下订单号，这里没查到你的订单"'])
+        self.assertEqual(handle_turn(runtime, session, "查物流888999", llm), ['"正在查询 888999 的物流信息..."'])
+
+        # 快照文件不存在时只做格式校验
+        runtime = self.runtime(known=os.path.join(self.tmp.name, 'missing.idx'))
+        self.assertIsNone(runtime.validators['order_id'].known)
+        self.assertEqual(handle_turn(runtime, session, "查物流111222", llm), ['"正在查询 111222 的物流信息..."'])
+
+
+class TestTurnLog(unittest.TestCase):
+    """列式对话日志：handle_turn 写入，memmap 读取，NumPy 统计命中 / 未匹配 / 耗时"""
+
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'turn_log')
+
+    def test_turns_recorded_and_queried(self):
+        from dsl_loader import iter_dsl_file
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session, SlotSchema
+        from turn_handler import handle_turn
+        from turn_log import TurnLogWriter, TurnLog
+        from turn_query import rule_hits, unmatched_rates, latency_percentiles, latency_by_rule, time_range
+
+        states = {
+            "查物流": {"scene": "logistics", "status": "need_order_id", "slots": {}},
+            "888999": {"scene": "logistics", "status": "ready_to_query", "slots": {"order_id": "888999"}},
+            "开发票": {"scene": "invoice", "status": "need_title", "slots": {}},
+        }
+        rules = list(iter_dsl_file(os.path.join(os.path.dirname(__file__), 'rules.txt')))
+        runtime = IRRuntime(lower_rules(rules))
+        inputs = ["查物流", "888999", "开发票", "查物流", "开发票"]
+        with TurnLogWriter(self.path, batch_size=2) as writer:
+            for text in inputs:
+                handle_turn(runtime, Session(SlotSchema.from_rules(rules)), text, states.get, turn_log=writer)
+
+        log = TurnLog(self.path)
+        self.assertEqual(len(log), 5)
+        self.assertEqual([log.text(i) for i in range(5)], inputs)
+        hits = dict(rule_hits(log))
+        self.assertEqual(sorted(hits.values()), [1, 2])
+        self.assertEqual(unmatched_rates(log)[0], (("invoice", "need_title"), 2, 2, 1.0))
+        self.assertEqual([item[2] for item in unmatched_rates(log)[1:]], [0, 0])
+        self.assertIsNotNone(latency_percentiles(log, 'classify_latency')[95])
+        self.assertEqual(set(latency_by_rule(log)), set(hits) | {None})
+        self.assertEqual(time_range(log, since=log['ts'][-1] + 1), slice(5, 5))
+
+    def test_reopen_after_partial_write(self):
+        from turn_log import TurnLogWriter, TurnLog, column_path
+        with TurnLogWriter(self.path, clock=lambda: 1.0) as writer:
+            writer.append(0.1, None, "other", "greeting", "r1", "你好")
+        # 模拟写到一半崩溃：堆和部分列多出一截
+        with open(os.path.join(self.path, 'heap.bin'), 'ab') as f:
+            f.write("残留".encode('utf-8'))
+        with open(column_path(self.path, 'ts'), 'ab') as f:
+            f.write(b'\0' * 8)
+        self.assertEqual(len(TurnLog(self.path)), 1)
+
+        with TurnLogWriter(self.path, clock=lambda: 2.0) as writer:
+            writer.append(0.2, 0.05, "refund", "processing", None, "退款")
+        log = TurnLog(self.path)
+        self.assertEqual([log.text(0), log.text(1)], ["你好", "退款"])
+        self.assertEqual(log['ts'].tolist(), [1.0, 2.0])
+        self.assertEqual(log.names['rules'], ["r1"])
+        self.assertEqual(log['rule'].tolist(), [0, -1])
+
+    def test_concurrent_turns_keep_ts_sorted_and_shed_turns_logged(self):
+        import threading
+        from dsl_loader import iter_dsl_file
+        from ir import lower_rules
+        from ir_runtime import IRRuntime
+        from session import Session, SlotSchema
+        from admission import AdmissionController
+        from turn_handler import handle_turn, busy_reply
+        from turn_log import TurnLogWriter, TurnLog
+        from turn_query import time_range, shed_count, report
+
+        rules = list(iter_dsl_file(os.path.join(os.path.dirname(__file__), 'rules.txt')))
+        runtime = IRRuntime(lower_rules(rules))
+        new_session = lambda: Session(SlotSchema.from_rules(rules))
+        started, release = threading.Event(), threading.Event()
+
+        def slow(text):
+            started.set()
+            release.wait(5)
+            return {"scene": "other", "status": "greeting", "slots": {}}
+
+        fast = lambda text: {"scene": "other", "status": "greeting", "slots": {}}
+        admission = AdmissionController(max_in_flight=1, max_queue=0)
+        with TurnLogWriter(self.path) as writer:
+            # 先开始的“慢”轮次最后结束；期间到达的轮次一个被准入控制拒绝，一个正常处理
+            worker = threading.Thread(target=admission.handle,
+                                      args=(runtime, new_session(), "慢", slow, None, writer))
+            worker.start()
+            self.assertTrue(started.wait(5))
+            self.assertEqual(admission.handle(runtime, new_session(), "拒绝", fast, None, writer),
+                             busy_reply(runtime, new_session()))
+            handle_turn(runtime, new_session(), "快", fast, turn_log=writer)
+            release.set()
+            worker.join(5)
+
+        log = TurnLog(self.path)
+        self.assertEqual([log.text(i) for i in range(len(log))], ["拒绝", "快", "慢"])
+        ts = log['ts'].tolist()
+        self.assertEqual(ts, sorted(ts))
+        self.assertEqual(time_range(log, since=ts[1]), slice(1, 3))
+        self.assertEqual(shed_count(log), 1)
+        self.assertEqual((log.names['scenes'][log['scene'][0]], log.names['statuses'][log['status'][0]]),
+                         ("system", "shed"))
+        self.assertIn("🚦 过载拒绝: 1 轮", report(log))
+
+        # 系统时钟回拨时 ts 也不会倒退
+        clock = iter([10.0, 9.0, 11.0])
+        path = os.path.join(self.tmp.name, 'clock')
+        with TurnLogWriter(path, clock=lambda: next(clock)) as writer:
+            for text in "abc":
+                writer.append(0.0, None, "other", "greeting", None, text)
+        self.assertEqual(TurnLog(path)['ts'].tolist(), [10.0, 10.0, 11.0])
+
+
 if __name__ == '__main__':
     # 运行所有单元测试
     unittest.main(verbosity=2)
\ No newline at end of file
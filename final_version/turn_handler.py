@@ -0,0 +1,128 @@
+# turn_handler.py
+import time
+
+from session import ROLE_USER, ROLE_ASSISTANT
+from logger import setup_logger
+from llm_policy import UpstreamUnavailable
+from rate_limiter import current_session
+from slot_validator import check_slots
+
+EXIT_KEYWORDS = {'退出', '结束', '再见', 'bye', 'exit', 'quit'}
+RESET_REPLIES = ("用户退出会话，系统已重置状态。", "您好！请问是要查物流、投诉还是退款？")
+FALLBACK_REPLY = "我不太确定您的需求，请说明是要查物流、投诉还是退款？"
+# LLM 不可用（熔断 / 全部梯队失败）时的意图状态，只按规则回复
+RULE_ONLY_STATE = {"scene": "other", "status": "unknown", "slots": {}}
+# 过载时的回复：优先用规则文件里 scene: system / status: busy 的规则，没有这条规则时用 BUSY_REPLY
+BUSY_STATE = ('state', 'system', 'busy')
+BUSY_REPLY = "当前咨询人数较多，请稍后再试。"
+
+logger = setup_logger()
+
+
+def busy_reply(runtime, session, turn_log=None, user_input="", latency=0.0):
+    """
+    准入控制拒绝本轮时的回复（见 admission.py）：不做意图识别，也不改动会话状态。
+    turn_log 不为 None 时记一行 system/shed，latency 为被拒绝前排队的时间
+    """
+    entry = runtime.dispatch(BUSY_STATE, session)
+    replies = [BUSY_REPLY] if entry is None else runtime.run(entry, session)
+    if turn_log is not None:
+        from turn_log import SHED_SCENE, SHED_STATUS  # 开启了对话日志时 turn_log 已经导入
+        turn_log.append(latency, None, SHED_SCENE, SHED_STATUS, None if entry is None else entry.name, user_input)
+    return replies
+
+
+def plausible_answer(runtime, predictor, field, value):
+    """回答是否像 field 的值：符合 [slot] 的字符集（见 SlotValidator.plausible），或者能匹配上 ask 的 expect"""
+    validator = runtime.validators.get(field)
+    if validator is not None and validator.plausible(value):
+        return True
+    plan = predictor.plans.get(field) if predictor is not None else None
+    return plan is not None and plan.expect is not None and plan.expect.search(value) is not None
+
+
+def handle_turn(runtime, session, user_input, classify, predictor=None, turn_log=None):
+    """
+    处理一轮对话，返回本轮要回复给用户的消息列表。
+    runtime 为 ir_runtime.IRRuntime（规则已编译成 IR），
+    classify 为意图识别函数（通常是 qwen_client.call_qwen_with_state），
+    predictor 为 predictor.PendingFieldPredictor，用户回答 pending 字段时先在本地推断下一状态（推断不确定时同步等待 LLM 复核，有超时），
+    turn_log 为 turn_log.TurnLogWriter，做过意图识别的轮次记一行（scene / status / 命中的规则 / 耗时）。
+    """
+    start = time.perf_counter()
+    if user_input in EXIT_KEYWORDS or user_input.lower() in EXIT_KEYWORDS:
+        logger.info("🔄 用户触发会话重置")
+        session.clear()
+        return list(RESET_REPLIES)
+
+    # 脚本停在 wait 处：输入直接交给脚本，不再做意图识别
+    if session.resume is not None:
+        session.add_message(ROLE_USER, user_input)
+        replies = runtime.resume(session, user_input)
+        for msg in replies:
+            session.add_message(ROLE_ASSISTANT, msg)
+        return replies
+
+    # 处理 pending 字段；回答像是输错的值（见 plausible_answer）且没通过 [slot] 校验时，
+    # 直接转到 invalid / unknown 状态，不再识别意图；不像的（如“算了，我要退款”）当作换话题，照常识别意图
+    pending = session.pending_field
+    state = None
+    if pending is not None:
+        session.pending_field = None
+        rejected = check_slots(runtime.validators, {pending: user_input})
+        if rejected is None:
+            session.set(pending, user_input)
+            logger.info(f"✅ 记录字段: {pending} = {user_input}")
+        elif plausible_answer(runtime, predictor, pending, user_input):
+            state = rejected
+        else:
+            logger.info(f"💬 回答不像 {pending} 的值，当作新的请求识别意图")
+
+    session.add_message(ROLE_USER, user_input)
+
+    # 调用 Qwen（回答 pending 字段时优先本地推断）；限流时按会话公平排队
+    classify_latency = None
+    if state is None:
+        session_token = current_session.set(id(session))
+        classify_start = time.perf_counter()
+        try:
+            if pending is not None and predictor is not None:
+                state = predictor.resolve(pending, user_input, classify)
+            else:
+                state = classify(user_input)  # 注意：不再传 history（简化）
+        except UpstreamUnavailable as e:
+            logger.warning(f"🔌 {e}，本轮按纯规则模式处理")
+            state = RULE_ONLY_STATE
+        finally:
+            current_session.reset(session_token)
+        classify_latency = time.perf_counter() - classify_start
+        # LLM 提取的槽位同样要通过本地校验，格式判断不依赖 LLM
+        state = check_slots(runtime.validators, state.get("slots", {})) or state
+    scene = state.get("scene", "other")
+    status = state.get("status", "unknown")
+    slots = state.get("slots", {})
+
+    # 自动将 LLM 提取的槽位写入上下文
+    for key, value in slots.items():
+        session.set(key, value)
+        logger.debug(f"📥 从 LLM 提取槽位: {key} = {value}")
+
+    logger.debug(f"🧠 Qwen 输出: scene='{scene}', status='{status}', slots={slots}")
+    logger.debug(f"📦 上下文: {session.data}")
+
+    # 匹配规则；没有对应的 [rule] 时，再找与场景同名的脚本 / intent
+    entry = runtime.dispatch(('state', scene, status), session)
+    if entry is None:
+        entry = runtime.dispatch(('intent', scene), session)
+    if entry is None:
+        logger.warning(f"❓ 未匹配任何规则: scene='{scene}', status='{status}'")
+        replies = [FALLBACK_REPLY]
+    else:
+        logger.info(f"🎯 匹配规则: [{entry.name}]")
+        replies = runtime.run(entry, session)
+    for msg in replies:
+        session.add_message(ROLE_ASSISTANT, msg)
+    if turn_log is not None:
+        turn_log.append(time.perf_counter() - start, classify_latency, scene, status,
+                        None if entry is None else entry.name, user_input)
+    return replies
@@ -0,0 +1,179 @@
+# turn_log.py
+# 列式对话日志：每轮对话一行，每一列是一个只追加的定长二进制文件，读取时用 np.memmap 直接映射。
+# scene / status / 规则名 intern 成整数编号（编号表存在 names.json），用户输入存在字符串堆 heap.bin 里，
+# text_end 列记录每行文本在堆中的结束偏移。统计查询见 turn_query.py。
+#
+#   目录结构：ts.f8  latency.f4  classify_latency.f4  scene.u2  status.u2  rule.i4  text_end.u8  heap.bin  names.json
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+# 列名 -> dtype；文件名为 "列名.类型"
+COLUMNS = {
+    'ts': np.float64,                 # 写入时间戳（本轮结束时由 TurnLogWriter 打上，单调不减，开始时间为 ts - latency）
+    'latency': np.float32,            # 本轮从开始到结束的总耗时（秒）
+    'classify_latency': np.float32,   # 意图识别（LLM / 本地推断）耗时（秒），没有调用时为 NaN
+    'scene': np.uint16,
+    'status': np.uint16,
+    'rule': np.int32,                 # 匹配到的规则编号，未匹配为 -1
+    'text_end': np.uint64,            # 用户输入在 heap.bin 中的结束偏移
+}
+NAME_TABLES = ('scenes', 'statuses', 'rules')
+UNMATCHED = -1
+# 准入控制拒绝（load shedding）的轮次记为 scene = system、status = shed
+SHED_SCENE, SHED_STATUS = 'system', 'shed'
+BATCH_SIZE = 4096
+
+
+def column_path(path, name):
+    return os.path.join(path, f"{name}.{np.dtype(COLUMNS[name]).str[1:]}")
+
+
+def _load_names(path):
+    try:
+        with open(os.path.join(path, 'names.json'), encoding='utf-8') as f:
+            names = json.load(f)
+    except FileNotFoundError:
+        names = {}
+    return {table: list(names.get(table, [])) for table in NAME_TABLES}
+
+
+class TurnLogWriter:
+    """
+    追加写入对话日志，攒够 batch_size 行后整批写盘（close / flush 时写出剩余的行）。
+    先写字符串堆和编号表，再写各列，最后写 text_end：读取方按最短的列确定行数，
+    中途崩溃最多丢掉最后一批不完整的行。append 是线程安全的。
+    ts 在 append 时持锁打上（不用轮次开始的时间：并发的轮次结束顺序和开始顺序不同），
+    并且不小于上一行的 ts，所以 ts 列总是有序的，turn_query.time_range 可以二分查找。
+
+        with TurnLogWriter('turn_log') as log:
+            log.append(latency, classify_latency, scene, status, rule_name, user_input)
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, clock=time.time):
+        self.path = path
+        self.batch_size = batch_size
+        self.clock = clock
+        os.makedirs(path, exist_ok=True)
+        self.last_ts = self._repair()
+        self.names = _load_names(path)
+        self.ids = {table: {name: i for i, name in enumerate(names)} for table, names in self.names.items()}
+        self.names_dirty = False
+        self.heap = open(os.path.join(path, 'heap.bin'), 'ab')
+        self.heap_size = self.heap.tell()
+        self.columns = {name: open(column_path(path, name), 'ab') for name in COLUMNS}
+        self.buffer = {name: [] for name in COLUMNS}
+        self.texts = []
+        self.lock = threading.Lock()
+
+    def _repair(self):
+        """上次写到一半崩溃时，把各列截断到相同行数、字符串堆截断到最后一行的结束位置；返回最后一行的 ts"""
+        files = {name: column_path(self.path, name) for name in COLUMNS}
+        n = min(os.path.getsize(file) // np.dtype(COLUMNS[name]).itemsize if os.path.exists(file) else 0
+                for name, file in files.items())
+        for name, file in files.items():
+            with open(file, 'ab') as f:
+                f.truncate(n * np.dtype(COLUMNS[name]).itemsize)
+        itemsize = np.dtype(COLUMNS['text_end']).itemsize
+        heap_size = int(np.fromfile(files['text_end'], COLUMNS['text_end'], 1, offset=(n - 1) * itemsize)[0]) if n else 0
+        with open(os.path.join(self.path, 'heap.bin'), 'ab') as f:
+            f.truncate(heap_size)
+        itemsize = np.dtype(COLUMNS['ts']).itemsize
+        return float(np.fromfile(files['ts'], COLUMNS['ts'], 1, offset=(n - 1) * itemsize)[0]) if n else float('-inf')
+
+    def _intern(self, table, name):
+        ids = self.ids[table]
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(self.names[table])
+            self.names[table].append(name)
+            self.names_dirty = True
+        return i
+
+    def append(self, latency, classify_latency, scene, status, rule, text):
+        """rule 为规则名，未匹配时为 None；classify_latency 为 None 表示本轮没有做意图识别"""
+        data = text.encode('utf-8')
+        with self.lock:
+            self.last_ts = max(self.clock(), self.last_ts)  # 系统时钟回拨时也保持有序
+            buffer = self.buffer
+            buffer['ts'].append(self.last_ts)
+            buffer['latency'].append(latency)
+            buffer['classify_latency'].append(np.nan if classify_latency is None else classify_latency)
+            buffer['scene'].append(self._intern('scenes', scene))
+            buffer['status'].append(self._intern('statuses', status))
+            buffer['rule'].append(UNMATCHED if rule is None else self._intern('rules', rule))
+            self.heap_size += len(data)
+            buffer['text_end'].append(self.heap_size)
+            self.texts.append(data)
+            if len(self.texts) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.texts:
+            return
+        self.heap.write(b''.join(self.texts))
+        self.heap.flush()
+        self.texts = []
+        if self.names_dirty:
+            tmp = os.path.join(self.path, 'names.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.names, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.path, 'names.json'))
+            self.names_dirty = False
+        for name in sorted(COLUMNS, key=lambda name: name == 'text_end'):
+            np.asarray(self.buffer[name], COLUMNS[name]).tofile(self.columns[name])
+            self.columns[name].flush()
+            self.buffer[name] = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.heap.close()
+            for f in self.columns.values():
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TurnLog:
+    """
+    只读打开对话日志：各列为 np.memmap（行数取各列文件的最短长度），
+    names 为编号表，text(i) 从字符串堆中取出第 i 行的用户输入。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = _load_names(path)
+        sizes = {name: os.path.getsize(column_path(path, name)) // np.dtype(dtype).itemsize
+                 for name, dtype in COLUMNS.items()}
+        self.n = min(sizes.values())
+        self.columns = {name: self._map(column_path(path, name), dtype, self.n) for name, dtype in COLUMNS.items()}
+        heap_size = int(self.columns['text_end'][-1]) if self.n else 0
+        self.heap = self._map(os.path.join(path, 'heap.bin'), np.uint8, heap_size)
+
+    @staticmethod
+    def _map(path, dtype, n):
+        if n == 0:
+            return np.empty(0, dtype)  # 空文件不能 mmap
+        return np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def text(self, i):
+        start = int(self.columns['text_end'][i - 1]) if i else 0
+        return self.heap[start:int(self.columns['text_end'][i])].tobytes().decode('utf-8')
@@ -0,0 +1,126 @@
+# turn_query.py
+# 对列式对话日志（turn_log.py）做统计，全部是 NumPy 向量化计算，几百万轮也只要几秒。
+# 用法:
+#   python turn_query.py turn_log [--since 时间戳] [--until 时间戳] [--top 10]
+import sys
+import time
+
+import numpy as np
+
+from turn_log import TurnLog, UNMATCHED, SHED_SCENE, SHED_STATUS
+
+PERCENTILES = (50, 95, 99)
+
+
+def time_range(log, since=None, until=None):
+    """[since, until) 时间范围（按轮次结束时间）对应的行区间；ts 在写入时打上、单调不减，用二分查找"""
+    ts = log['ts']
+    start = 0 if since is None else int(np.searchsorted(ts, since, 'left'))
+    stop = len(log) if until is None else int(np.searchsorted(ts, until, 'left'))
+    return slice(start, max(start, stop))
+
+
+def shed_count(log, rows=slice(None)):
+    """准入控制拒绝（system/shed）的轮次数"""
+    scenes, statuses = log.names['scenes'], log.names['statuses']
+    if SHED_SCENE not in scenes or SHED_STATUS not in statuses:
+        return 0
+    return int(np.count_nonzero((log['scene'][rows] == scenes.index(SHED_SCENE))
+                                & (log['status'][rows] == statuses.index(SHED_STATUS))))
+
+
+def rule_hits(log, rows=slice(None)):
+    """每条规则的命中次数，从多到少：[(规则名, 次数)]"""
+    rules = log.names['rules']
+    counts = np.bincount(log['rule'][rows] - UNMATCHED, minlength=len(rules) + 1)[1:]
+    order = np.argsort(-counts, kind='stable')
+    return [(rules[i], int(counts[i])) for i in order if counts[i]]
+
+
+def latency_percentiles(log, column='latency', rows=slice(None), percentiles=PERCENTILES):
+    """整体耗时分位数（秒）：{分位: 值}；NaN（没有做意图识别的轮次）不参与统计"""
+    values = np.asarray(log[column][rows])
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {p: None for p in percentiles}
+    return dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+
+
+def latency_by_rule(log, column='latency', rows=slice(None), percentiles=PERCENTILES):
+    """每条规则的耗时分位数：{规则名: {分位: 值}}，未匹配的轮次记在 None 下"""
+    rules = np.asarray(log['rule'][rows])
+    values = np.asarray(log[column][rows])
+    keep = ~np.isnan(values)
+    rules, values = rules[keep], values[keep]
+    # 按 (规则, 耗时) 排序后每条规则是连续的一段，分位数直接按下标取
+    order = np.lexsort((values, rules))
+    rules, values = rules[order], values[order]
+    ids, starts, counts = np.unique(rules, return_index=True, return_counts=True)
+    names = log.names['rules']
+    result = {}
+    for rule, start, count in zip(ids, starts, counts):
+        picks = start + np.minimum(count - 1, (np.array(percentiles) / 100 * count).astype(np.int64))
+        result[None if rule == UNMATCHED else names[rule]] = dict(zip(percentiles, values[picks].tolist()))
+    return result
+
+
+def unmatched_rates(log, rows=slice(None)):
+    """
+    每个 (scene, status) 组合的总轮次和未匹配轮次，按未匹配次数从多到少：
+    [((scene, status), 总数, 未匹配数, 未匹配率)]
+    """
+    scenes, statuses = log.names['scenes'], log.names['statuses']
+    width = max(len(statuses), 1)
+    keys = np.asarray(log['scene'][rows], np.int64) * width + log['status'][rows]
+    size = len(scenes) * width
+    total = np.bincount(keys, minlength=size)
+    missed = np.bincount(keys, np.asarray(log['rule'][rows]) == UNMATCHED, minlength=size).astype(np.int64)
+    order = np.lexsort((-total, -missed))
+    return [((scenes[k // width], statuses[k % width]), int(total[k]), int(missed[k]), missed[k] / total[k])
+            for k in order if total[k]]
+
+
+def _format_percentiles(values):
+    return ", ".join(f"p{p} {'-' if v is None else f'{v * 1e3:.0f} ms'}" for p, v in values.items())
+
+
+def report(log, since=None, until=None, top=10):
+    rows = time_range(log, since, until)
+    n = rows.stop - rows.start
+    lines = [f"📊 {n} 轮对话"]
+    if not n:
+        return "\n".join(lines)
+    shed = shed_count(log, rows)
+    lines.append(f"🚦 过载拒绝: {shed} 轮（{shed / n:.1%}）")
+    lines.append(f"⏱️ 单轮耗时: {_format_percentiles(latency_percentiles(log, 'latency', rows))}")
+    lines.append(f"🧠 意图识别耗时: {_format_percentiles(latency_percentiles(log, 'classify_latency', rows))}")
+    lines.append("🔥 热门规则:")
+    for rule, count in rule_hits(log, rows)[:top]:
+        lines.append(f"  [{rule}] {count} 次（{count / n:.1%}）")
+    lines.append("❓ 未匹配的 scene/status:")
+    for (scene, status), total, missed, rate in unmatched_rates(log, rows)[:top]:
+        if missed and (scene, status) != (SHED_SCENE, SHED_STATUS):
+            lines.append(f"  {scene}/{status}: {missed}/{total}（{rate:.1%}）")
+    return "\n".join(lines)
+
+
+def _option(args, name, default):
+    if name in args:
+        i = args.index(name)
+        value = args[i + 1]
+        del args[i:i + 2]
+        return value
+    return default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    since = _option(args, '--since', None)
+    until = _option(args, '--until', None)
+    top = int(_option(args, '--top', 10))
+    if len(args) != 1:
+        print("用法: python turn_query.py 日志目录 [--since 时间戳] [--until 时间戳] [--top 10]")
+        sys.exit(2)
+    start = time.perf_counter()
+    print(report(TurnLog(args[0]), since and float(since), until and float(until), top))
+    print(f"（查询耗时 {time.perf_counter() - start:.2f} s）")
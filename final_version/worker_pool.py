@@ -0,0 +1,215 @@
+# worker_pool.py
+import os
+import time
+import zlib
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import Future
+
+from ir import lower_rules
+from ir_runtime import IRRuntime
+from session import Session, SlotSchema
+from turn_handler import handle_turn, busy_reply, FALLBACK_REPLY
+from admission import AdmissionController, Overloaded
+from predictor import PendingFieldPredictor
+from logger import setup_logger
+
+# 每个工作进程同时在途（已发出、还没收到回复）的批次上限，满了以后新的批次在父进程里等待
+MAX_PENDING_BATCHES = 2
+
+logger = setup_logger()
+
+
+def _mp_context():
+    # fork 时子进程直接继承父进程里已编译好的规则（写时复制），无需重新解析或序列化
+    if 'fork' in mp.get_all_start_methods():
+        return mp.get_context('fork')
+    return mp.get_context()
+
+
+class _TurnRows:
+    """工作进程里代替 TurnLogWriter：只收集 append 的参数，随回复一起发回父进程，由父进程写盘"""
+
+    def __init__(self):
+        self.rows = []
+
+    def append(self, *row):
+        self.rows.append(row)
+
+
+def _worker_main(conn, runtime, schema, classify, predictor, log_turns):
+    """
+    工作进程主循环：每次收到一批 (session_id, user_input)，按顺序用 handle_turn 处理（带 pending 字段的本地推断），
+    整批返回 (回复列表, 对话日志行)。会话只存在于负责它的工作进程中，收到 None 时退出。
+    单轮处理出错时记录日志并回复 FALLBACK_REPLY，不让异常结束进程（否则整批回复和这个进程上的会话都会丢失）。
+    """
+    sessions = {}
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        turn_log = _TurnRows() if log_turns else None
+        results = []
+        for session_id, user_input in batch:
+            session = sessions.get(session_id)
+            if session is None:
+                session = sessions[session_id] = Session(schema)
+            try:
+                results.append(handle_turn(runtime, session, user_input, classify, predictor, turn_log))
+            except Exception:
+                logger.exception(f"💥 会话 {session_id} 处理失败，本轮回复兜底提示")
+                results.append([FALLBACK_REPLY])
+        conn.send((results, turn_log.rows if turn_log is not None else []))
+    predictor.close()
+    conn.close()
+
+
+class _WorkerLink:
+    """
+    父进程一侧到某个工作进程的管道。最多 max_pending 个批次同时在途，满了 submit 会等前面的批次回来（背压）。
+    工作进程按收到的顺序回复，后台线程按发送顺序把回复交给各批次的 Future，多个线程同时提交也不会串。
+    """
+
+    def __init__(self, conn, max_pending):
+        self.conn = conn
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.closed = False
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def submit(self, batch):
+        self.slots.acquire()
+        future = Future()
+        with self.lock:
+            try:
+                if self.closed:
+                    raise EOFError("工作进程已退出")
+                self.conn.send(batch)
+            except BaseException:
+                self.slots.release()
+                raise
+            self.pending.append(future)
+        return future
+
+    def _read(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future = self.pending.popleft()
+            self.slots.release()
+            future.set_result(message)
+        # 工作进程已退出：还在等的批次不会再有回复
+        with self.lock:
+            self.closed = True
+            while self.pending:
+                self.pending.popleft().set_exception(EOFError("工作进程已退出"))
+                self.slots.release()
+
+
+class WorkerPool:
+    """
+    多进程对话池：按 session_id 的哈希把会话固定分配到某个工作进程（会话亲和），
+    同一会话的消息总是由同一进程按顺序处理。进程间通过管道传递消息。
+
+        with WorkerPool(rules, classify=call_qwen_with_state, turn_log=writer) as pool:
+            replies = pool.handle("user-1", "查物流")
+
+    和 main_v2 走同一套前端：每次 handle / handle_batch 先经过准入控制（admission.py），
+    被拒绝时在父进程里直接回复 busy_reply，不发给工作进程；工作进程里的 handle_turn 带上 predictor，
+    对话日志行随回复发回父进程，写入 turn_log（turn_log.TurnLogWriter，为 None 时不记录）。
+    admission 默认同时放行 num_workers * max_pending 次调用；每个工作进程最多 max_pending 个批次在途。
+    slots 为规则文件里的 [slot] 校验配置（load_dsl / iter_dsl_file 的 slots 参数收集）。
+    """
+
+    def __init__(self, rules, classify, num_workers=None, slots=None, admission=None, predictor=None,
+                 turn_log=None, max_pending=MAX_PENDING_BATCHES):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.runtime = IRRuntime(lower_rules(rules, slots))
+        self.schema = SlotSchema.from_rules(rules)
+        self.admission = admission or AdmissionController(max_in_flight=self.num_workers * max_pending)
+        self.turn_log = turn_log
+        predictor = predictor or PendingFieldPredictor(rules)
+        ctx = _mp_context()
+        self.conns = []
+        self.processes = []
+        for _ in range(self.num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            p = ctx.Process(target=_worker_main,
+                            args=(child_conn, self.runtime, self.schema, classify, predictor, turn_log is not None),
+                            daemon=True)
+            p.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(p)
+        # 进程全部启动后再起读回复的线程，fork 时父进程里还没有别的线程
+        self.links = [_WorkerLink(conn, max_pending) for conn in self.conns]
+
+    def worker_for(self, session_id):
+        # 不能用内置 hash()：字符串哈希每个进程随机化，重启后路由会变
+        return zlib.crc32(session_id.encode('utf-8')) % self.num_workers
+
+    def handle(self, session_id, user_input):
+        """处理单条消息，返回回复列表"""
+        return self.handle_batch([(session_id, user_input)])[0]
+
+    def handle_batch(self, turns):
+        """
+        批量处理 [(session_id, user_input), ...]，结果顺序与输入一致。
+        整批作为一次调用经过准入控制，被拒绝时每轮都回复繁忙提示（不改动会话）。
+        每个工作进程只收发一次消息，各进程并行处理自己的那一份。
+        """
+        start = time.perf_counter()
+        try:
+            with self.admission.slot():
+                return self._dispatch(turns)
+        except Overloaded as e:
+            logger.warning(f"🚦 系统繁忙（{e}），本批 {len(turns)} 轮直接回复繁忙提示")
+            latency = time.perf_counter() - start
+            # busy 规则只是固定回复，用空会话渲染即可，会话本身在工作进程里
+            return [busy_reply(self.runtime, Session(self.schema), self.turn_log, user_input, latency)
+                    for _, user_input in turns]
+
+    def _dispatch(self, turns):
+        shards = [[] for _ in range(self.num_workers)]
+        positions = [[] for _ in range(self.num_workers)]
+        for i, (session_id, user_input) in enumerate(turns):
+            w = self.worker_for(session_id)
+            shards[w].append((session_id, user_input))
+            positions[w].append(i)
+
+        futures = {w: self.links[w].submit(shard) for w, shard in enumerate(shards) if shard}
+
+        results = [None] * len(turns)
+        for w, future in futures.items():
+            replies, rows = future.result()
+            for i, reply in zip(positions[w], replies):
+                results[i] = reply
+            if self.turn_log is not None:
+                for row in rows:
+                    self.turn_log.append(*row)
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for p in self.processes:
+            p.join(timeout=5)
+        for link in self.links:
+            link.reader.join(timeout=5)
+        for conn in self.conns:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()